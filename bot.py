@@ -1,46 +1,275 @@
 import discord
 from exceptions import ChannelNotFoundException
-from discord.utils import get
 import asyncio
 import os
+import random
+import time
+from collections import deque
 from dotenv import load_dotenv
+from metrics import REGISTRY
+
+
+# Sends messages in the background, with one worker per channel so that a slow or rate limited channel does not hold up the others.
+# Long messages are split at line boundaries to fit Discord's message length limit, sends are spaced out to stay within the
+# per-channel rate limit, and failed sends are retried with jittered exponential backoff.
+class OutboundQueue:
+    MAX_LENGTH = 2000
+    RATE_LIMIT = 5 # Messages per channel...
+    RATE_PERIOD = 5 # ...per this many seconds
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = 1
+
+    def __init__(self):
+        self.queues = {}
+        self.workers = {}
+        self.recent_sends = {}
+
+        # Send statistics, for monitoring
+        self.send_durations = deque(maxlen=100)
+        self.sent_count = 0
+        self.failed_count = 0
+        self.rate_limit_wait = 0
+        REGISTRY.gauge('discord_outbound_queue_depth', 'Messages waiting to be sent to Discord', function = self.depth)
+
+    # Queues a message for the channel and returns a future which is resolved once every part of the message has been sent.
+    def enqueue(self, channel, message):
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(OutboundQueue.consume_error) # Callers do not have to wait for the result
+
+        queue = self.queues.get(channel.id)
+        if queue is None:
+            queue = self.queues[channel.id] = asyncio.Queue()
+            self.recent_sends[channel.id] = deque(maxlen=OutboundQueue.RATE_LIMIT)
+            self.workers[channel.id] = asyncio.create_task(self.run_worker(channel.id, queue))
+
+        queue.put_nowait((channel, OutboundQueue.split_message(message), future, time.perf_counter()))
+        return future
+
+    @staticmethod
+    def consume_error(future):
+        if not future.cancelled():
+            future.exception()
+
+    # Number of messages waiting to be sent, over all channels
+    def depth(self):
+        return sum(queue.qsize() for queue in self.queues.values())
+
+    def stats(self):
+        durations = list(self.send_durations)
+        return {
+            'depth': self.depth(),
+            'sent': self.sent_count,
+            'failed': self.failed_count,
+            'rate_limit_wait': self.rate_limit_wait,
+            'mean_send_time': sum(durations) / len(durations) if len(durations) > 0 else 0,
+            'max_send_time': max(durations) if len(durations) > 0 else 0
+        }
+
+    # Splits a message into parts no longer than the limit, preferably at line breaks.
+    @staticmethod
+    def split_message(message, limit = MAX_LENGTH):
+        parts = []
+        current = ''
+        for line in message.split('\n'):
+            # Lines which are too long on their own are split wherever the limit falls
+            while len(line) > limit:
+                if current != '':
+                    parts.append(current)
+                    current = ''
+                parts.append(line[:limit])
+                line = line[limit:]
+
+            if current == '':
+                current = line
+            elif len(current) + 1 + len(line) <= limit:
+                current += '\n' + line
+            else:
+                parts.append(current)
+                current = line
+
+        if current != '' or len(parts) == 0:
+            parts.append(current)
+        return parts
+
+    async def run_worker(self, channel_id, queue):
+        while True:
+            channel, parts, future, enqueued = await queue.get()
+            if future.cancelled():
+                continue
+
+            try:
+                for part in parts:
+                    await self.send_part(channel, part)
+            except Exception as ex:
+                self.failed_count += 1
+                REGISTRY.counter('discord_messages_failed_total', 'Messages which could not be sent to Discord').inc()
+                print('Failed to send message to channel ' + str(channel_id) + '. Reason: ' + str(ex))
+                if not future.done():
+                    future.set_exception(ex)
+            else:
+                self.sent_count += 1
+                REGISTRY.counter('discord_messages_sent_total', 'Messages sent to Discord').inc()
+                REGISTRY.summary('discord_message_delivery_seconds', 'Time from queueing a message to it being sent, including rate limit waits').observe_since(enqueued)
+                if not future.done():
+                    future.set_result(None)
+
+    # Waits until another message can be sent to the channel without going over the rate limit.
+    async def wait_for_rate_limit(self, channel_id):
+        recent = self.recent_sends[channel_id]
+        if len(recent) == OutboundQueue.RATE_LIMIT:
+            wait = recent[0] + OutboundQueue.RATE_PERIOD - asyncio.get_running_loop().time()
+            if wait > 0:
+                self.rate_limit_wait += wait
+                REGISTRY.counter('discord_rate_limit_wait_seconds_total', 'Time spent waiting to stay within the rate limit').inc(wait)
+                await asyncio.sleep(wait)
+        recent.append(asyncio.get_running_loop().time())
+
+    async def send_part(self, channel, part):
+        for attempt in range(1, OutboundQueue.MAX_ATTEMPTS + 1):
+            await self.wait_for_rate_limit(channel.id)
+
+            started = time.perf_counter()
+            try:
+                await channel.send(part)
+                self.send_durations.append(REGISTRY.summary('discord_send_seconds', 'Duration of each Discord send request').observe_since(started))
+                return
+            except (discord.Forbidden, discord.NotFound):
+                raise # Retrying will not help
+            except discord.RateLimited as ex:
+                error = ex
+                delay = ex.retry_after
+            except discord.HTTPException as ex:
+                if ex.status != 429 and ex.status < 500:
+                    raise
+                error = ex
+                delay = OutboundQueue.RETRY_DELAY * 2 ** (attempt - 1)
+                if ex.status == 429:
+                    delay = float(ex.response.headers.get('Retry-After', delay))
+            except (OSError, asyncio.TimeoutError) as ex:
+                error = ex
+                delay = OutboundQueue.RETRY_DELAY * 2 ** (attempt - 1)
+
+            if attempt == OutboundQueue.MAX_ATTEMPTS:
+                raise error
+
+            delay = delay * random.uniform(1, 1.5) # Jitter, so that retries for several channels do not line up
+            self.rate_limit_wait += delay
+            REGISTRY.counter('discord_send_retries_total', 'Discord sends which were retried').inc(reason = type(error).__name__)
+            REGISTRY.counter('discord_rate_limit_wait_seconds_total', 'Time spent waiting to stay within the rate limit').inc(delay)
+            print('Sending message to channel ' + str(channel.id) + ' failed. Retrying in ' + '{:.1f}'.format(delay) + ' s. Reason: ' + str(error))
+            await asyncio.sleep(delay)
+
+
 
 class Bot:
 
-    def __init__(self, token, guild_id, test_mode = False):
+    # A client can be passed in instead of connecting to Discord, such as fakes.FakeDiscordClient. See create_client for lean.
+    def __init__(self, token, guild_id, test_mode = False, client = None, lean = False):
         self.token = token
-        self.client = discord.Client(intents=discord.Intents.default())
+        self.client = client if client is not None else Bot.create_client(lean)
         self.guild_id = guild_id
         self.test_mode = test_mode
+        self.outbound = OutboundQueue()
 
+        # Text channels indexed by (guild id, channel name). Built when the client is ready and kept up to date from gateway events.
+        self.channels = {}
+        for handler in (self.on_ready, self.on_guild_join, self.on_guild_remove, 
+                self.on_guild_channel_create, self.on_guild_channel_delete, self.on_guild_channel_update):
+            self.client.event(handler)
+
+    # The bot only sends messages and looks up text channels, which only needs the guilds intent (guilds and their channels, and
+    # channel changes). The lean client asks Discord for nothing else, so no message, typing or reaction events are received, and
+    # turns off the message cache, the member cache and member chunking, so that memory stays flat over a two week conference.
+    @staticmethod
+    def create_client(lean = False):
+        if not lean:
+            return discord.Client(intents=discord.Intents.default())
+
+        intents = discord.Intents.none()
+        intents.guilds = True
+        return discord.Client(intents=intents, 
+            max_messages=None, 
+            member_cache_flags=discord.MemberCacheFlags.none(), 
+            chunk_guilds_at_startup=False)
 
     async def start(self):
         await self.client.start(self.token)
 
-    # Sends a message to a channel with the matching channel id.
-    async def send_message(self, channel_id, message):
+    async def on_ready(self):
+        self.channels = {}
+        for guild in self.client.guilds:
+            self.index_guild(guild)
+        print('Discord client ready. Indexed ' + str(len(self.channels)) + ' text channels.')
+
+    async def on_guild_join(self, guild):
+        self.index_guild(guild)
+
+    async def on_guild_remove(self, guild):
+        self.channels = {key: channel for key, channel in self.channels.items() if key[0] != guild.id}
+
+    async def on_guild_channel_create(self, channel):
+        self.index_channel(channel)
+
+    async def on_guild_channel_delete(self, channel):
+        self.unindex_channel(channel)
+
+    async def on_guild_channel_update(self, before, after):
+        self.unindex_channel(before)
+        self.index_channel(after)
+
+    def index_guild(self, guild):
+        for channel in guild.text_channels:
+            self.index_channel(channel)
+
+    # If several channels share a name, the first one indexed is used.
+    def index_channel(self, channel):
+        if channel.type == discord.ChannelType.text:
+            self.channels.setdefault((channel.guild.id, channel.name), channel)
+
+    def unindex_channel(self, channel):
+        key = (channel.guild.id, channel.name)
+        indexed = self.channels.get(key)
+        if indexed is None or indexed.id != channel.id:
+            return
+
+        # Fall back to another channel with the same name, if there is one
+        del self.channels[key]
+        for other in channel.guild.text_channels:
+            if other.id != channel.id and other.name == channel.name:
+                self.index_channel(other)
+                break
+
+    # Gets the text channel in the bot's guild with the matching name. Append '-test' if in test mode.
+    def get_channel_by_name(self, channel_name):
+        target = channel_name if not self.test_mode else channel_name + '-test'
+        channel_obj = self.channels.get((int(self.guild_id), target))
+        if channel_obj is None:
+            raise ChannelNotFoundException('Could not get the channel with name ' + target)
+        return channel_obj
+
+    # Queues a message for a channel with the matching channel id and returns without waiting for it to be sent. The returned
+    # future can be awaited for the result.
+    def enqueue_message(self, channel_id, message):
         print('Sending message to channel with id ' + str(channel_id))
         channel_obj = self.client.get_channel(channel_id)
 
         if channel_obj is None:
             raise ChannelNotFoundException('Error sending message to channel. Could not get the channel with id ' + str(channel_id))
         else:
-            await channel_obj.send(message)
+            return self.outbound.enqueue(channel_obj, message)
+
+    # Sends a message to a channel with the matching channel id.
+    async def send_message(self, channel_id, message):
+        await self.enqueue_message(channel_id, message)
 
 
     # Sends a message to a channel with the matching channel name. Append '-test' if in test mode.
     async def send_message_by_name(self, channel_name, message):
-        target = channel_name if not self.test_mode else channel_name + '-test'
-        channel_obj = discord.utils.get(self.client.get_all_channels(), guild__id = int(self.guild_id), name=target, type=discord.ChannelType.text)
-        if channel_obj is None:
-            raise ChannelNotFoundException('Error sending message to channel. Could not get the channel with name ' + channel_name)
-        else:
-            await channel_obj.send(message)
+        channel_obj = self.get_channel_by_name(channel_name)
+        await self.outbound.enqueue(channel_obj, message)
 
     async def get_channel_id_by_name(self, channel_name):
-        print('get_channel_id_by_name:', channel_name)
-        channel_obj = discord.utils.get(self.client.get_all_channels(), guild__id = int(self.guild_id), name=channel_name, type=discord.ChannelType.text)
-        return channel_obj.id
+        return self.get_channel_by_name(channel_name).id
 
     @staticmethod
     def get_valid_name(channel_name, channel_number):
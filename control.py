@@ -0,0 +1,146 @@
+import asyncio, json
+from urllib.parse import urlsplit, parse_qs
+from metrics import REGISTRY
+
+
+# Small HTTP server for operating the broadcast, e.g. with curl:
+#   curl -X POST http://127.0.0.1:8750/skip
+#   curl -X POST http://127.0.0.1:8750/jump?number=3
+#   curl http://127.0.0.1:8750/status
+#   curl http://127.0.0.1:8750/metrics
+# Commands (POST): skip, stop, pause, resume, jump (to a playback number in the current session). status and metrics (in the
+# Prometheus text format) are also available with GET. With several tracks, commands and status go to the first track unless a track
+# is given, e.g. POST /skip?track=2.
+# Each request is handled on the event loop as it arrives, so nothing polls while idle. It listens on localhost only by default;
+# reach it from another machine through an SSH tunnel, or listen on another address and set a token, which is then required in
+# an "Authorization: Bearer <token>" header.
+class ControlServer:
+    READ_TIMEOUT = 5 # Seconds to receive a request
+    MAX_BODY = 4096
+
+    # managers is the CSCWManager of each track, by track number
+    def __init__(self, managers, host = '127.0.0.1', port = 8750, token = None):
+        self.managers = managers
+        self.host = host
+        self.port = port
+        self.token = token
+        self.server = None
+
+        # Handlers by path. Each gets the manager of the requested track and the request parameters, and returns (HTTP status, reply).
+        self.commands = {
+            'skip': self.skip,
+            'stop': self.stop,
+            'pause': self.pause,
+            'resume': self.resume,
+            'jump': self.jump
+        }
+        self.queries = {
+            'status': self.status,
+            'metrics': self.metrics
+        }
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        print('Control server listening on http://' + self.host + ':' + str(self.port))
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            method, target, headers, body = await asyncio.wait_for(self.read_request(reader), ControlServer.READ_TIMEOUT)
+            status, reply = await self.dispatch(method, target, headers, body)
+        except (ValueError, TypeError, UnicodeDecodeError, asyncio.IncompleteReadError, asyncio.TimeoutError) as ex:
+            status, reply = 400, {'error': 'Bad request: ' + str(ex)}
+        except Exception as ex:
+            status, reply = 500, {'error': str(ex)}
+
+        if isinstance(reply, str):
+            content_type, content = 'text/plain; version=0.0.4; charset=utf-8', reply.encode('utf-8')
+        else:
+            content_type, content = 'application/json', json.dumps(reply).encode('utf-8')
+
+        try:
+            writer.write(('HTTP/1.1 ' + str(status) + ' ' + ControlServer.get_reason(status) + '\r\nContent-Type: ' + content_type
+                + '\r\nContent-Length: ' + str(len(content)) + '\r\nConnection: close\r\n\r\n').encode('latin-1') + content)
+            await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', 0))
+        if length > ControlServer.MAX_BODY:
+            raise ValueError('Request body too large')
+        body = await reader.readexactly(length) if length > 0 else b''
+        return method.upper(), target, headers, body
+
+    async def dispatch(self, method, target, headers, body):
+        if self.token is not None and headers.get('authorization') != 'Bearer ' + self.token:
+            return 401, {'error': 'Missing or wrong token'}
+
+        url = urlsplit(target)
+        path = url.path.strip('/')
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if len(body) > 0 and headers.get('content-type', '').startswith('application/json'):
+            params.update(json.loads(body))
+
+        if path in self.queries and method in ('GET', 'POST'):
+            handler = self.queries[path]
+        elif path in self.commands:
+            if method != 'POST':
+                return 405, {'error': 'Use POST for ' + path}
+            handler = self.commands[path]
+        else:
+            return 404, {'error': 'Unknown command ' + path, 'commands': sorted(list(self.commands) + list(self.queries))}
+
+        track = int(params.get('track', min(self.managers)))
+        if track not in self.managers:
+            return 404, {'error': 'Unknown track ' + str(track), 'tracks': sorted(self.managers)}
+        return await handler(self.managers[track], params)
+
+    @staticmethod
+    def get_reason(status):
+        return {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found', 405: 'Method Not Allowed', 409: 'Conflict',
+            500: 'Internal Server Error'}.get(status, '')
+
+    async def skip(self, manager, params):
+        manager.skip()
+        return 200, {'result': 'skipped'}
+
+    async def stop(self, manager, params):
+        manager.stop()
+        return 200, {'result': 'stopped'}
+
+    async def pause(self, manager, params):
+        manager.pause()
+        return 200, {'result': 'paused'}
+
+    async def resume(self, manager, params):
+        manager.resume()
+        return 200, {'result': 'resumed'}
+
+    async def jump(self, manager, params):
+        playback_number = int(params.get('number', params.get('playback_number')))
+        if not manager.jump(playback_number):
+            return 409, {'error': 'No video with playback number ' + str(playback_number) + ' in the current session'}
+        return 200, {'result': 'jumped', 'playback_number': playback_number}
+
+    async def status(self, manager, params):
+        return 200, await manager.get_status()
+
+    async def metrics(self, manager, params):
+        return 200, REGISTRY.render()
@@ -1,31 +1,124 @@
 import argparse
-import asyncio, os, time
-import apscheduler.events
+import asyncio, os, sys
+import heapq, itertools
+import threading
 import json
-import keyboard
-from xmlrpc.client import Boolean
-import pandas as pd
-from pytz import utc
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from dateutil import parser as date_parser
+import time
 from datetime import datetime, timezone, timedelta
 from exceptions import ChannelNotFoundException
-from player import VLCPlayer
-from bot import Bot
-from data import SessionVideo, Paper
+from playback import PlaybackClient
+from control import ControlServer
+from metrics import REGISTRY
+from data import ConferenceData
+from jobstore import SessionJobStore, StoredJob
 from dotenv import load_dotenv
 
+# Modules which are slow to import (discord, keyboard, apscheduler, dateutil) are imported where they are first needed, so that
+# restarting the script reaches "Scheduling complete" quickly. This also keeps them out of the playback process.
+
 
 
 class PlaybackStatus:
-    def __init__(self, session_name, session_number, playback_number):
+    __slots__ = ('session_name', 'session_number', 'playback_number', 'position', 'announced')
+
+    def __init__(self, session_name, session_number, playback_number, position = 0, announced = None):
         self.session_name = session_name
         self.session_number = session_number
         self.playback_number = playback_number
+        self.position = position # Media time in the current video, in milliseconds
+        self.announced = announced if announced is not None else [] # Playback numbers of the videos already announced
+
+
+# Writes the playback status to a JSON file. Each write goes to a temporary file which then replaces the status file, so a crash
+# while writing never leaves a corrupt status file behind. Writes run in a worker thread, off the event loop, and frequent updates
+# (such as the media position) are coalesced so that only the latest status is written.
+class StatusJournal:
+    def __init__(self, status_file):
+        self.status_file = status_file
+        self.pending = None
+        self.writer = None
+        self.writer_waiting = False
+        self.closed = False
+        self.lock = threading.Lock()
+
+    # Schedules the status to be written after the delay (in seconds). A later save replaces a status that was not written yet.
+    def save(self, status, delay = 0):
+        self.pending = status
+
+        # Write changes which must not be lost (delay 0) right away, instead of waiting for a coalesced write.
+        if self.writer is not None and self.writer_waiting and delay == 0:
+            self.writer.cancel()
+            self.writer = None
+
+        if self.writer is None:
+            self.writer = asyncio.get_running_loop().create_task(self.write_pending(delay))
+
+    async def write_pending(self, delay):
+        self.writer_waiting = True
+        await asyncio.sleep(delay)
+        self.writer_waiting = False
+
+        while self.pending is not None:
+            status, self.pending = self.pending, None
+            await asyncio.get_running_loop().run_in_executor(None, self.write, status)
+        self.writer = None
+
+    def write(self, status):
+        with self.lock:
+            if not self.closed:
+                self.write_file(status)
+
+    def write_file(self, status):
+        temp_file = self.status_file + '.tmp'
+        with open(temp_file, 'w') as outfile:
+            json.dump(status, outfile)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(temp_file, self.status_file)
+
+    # Writes the status waiting for a coalesced write, if any, and ignores later writes. Called from any thread before the process
+    # exits, as the writer task would not get to run.
+    def close(self):
+        with self.lock:
+            status, self.pending = self.pending, None
+            if status is not None and not self.closed:
+                self.write_file(status)
+            self.closed = True
+
+    # Reads the status file. Returns None if there is no status file or it cannot be read.
+    def load(self):
+        if not os.path.isfile(self.status_file):
+            return None
+
+        try:
+            with open(self.status_file, 'r') as openfile:
+                return json.load(openfile)
+        except (OSError, ValueError) as ex:
+            print('Could not read status file ' + self.status_file + '. Reason: ' + str(ex))
+            return None
+
+
+# Everything needed to start a session, built ahead of the session start time by CSCWManager.prepare_session.
+class PreparedSession:
+    def __init__(self, session_number, session_name, session_videos, playlist_version, authors_version, 
+            session_channel_id = None, session_message = None, paper_messages = None):
+        self.session_number = session_number
+        self.session_name = session_name
+        self.session_videos = session_videos
+        self.playlist_version = playlist_version
+        self.authors_version = authors_version
+        self.session_channel_id = session_channel_id
+        self.session_message = session_message
+        self.paper_messages = paper_messages if paper_messages is not None else {} # Announcements for each paper, by playback number
         
 
-# Handles playback of scheduled videos and persists playback status.
+# Handles playback of the scheduled videos of one track and persists its playback status. Each track has its own manager, player
+# process, status file and TV channel. The Discord bot and the conference data can be shared by the managers of all tracks.
 class CSCWManager:
+    PLAYBACK_ATTEMPTS = 3
+    POSITION_SAVE_INTERVAL = 5 # Seconds between saves of the media position
+    ANNOUNCEMENT_TIMEOUT = 30 # Seconds, after which a paper announcement which could not be sent is dropped
+
     def __init__(self, 
              bot, 
              tv_channel_id, 
@@ -35,43 +128,100 @@ class CSCWManager:
              media_path, 
              status_file = 'status.json',
              filler_video = '',
-             test_mode = False):
+             test_mode = False,
+             media_index_file = None,
+             hotkeys = False,
+             player = None,
+             clock = None,
+             track = 1,
+             data = None,
+             snapshot_file = None):
         self.bot = bot
-        self.player = VLCPlayer(test_mode) # Create the player
+        self.track = track
+        self.clock = clock # Gives the current time instead of the system clock, such as simulation.VirtualClock
+        # Create the player. Videos are played by a separate process, unless another player is passed in (see fakes.FakePlayer).
+        self.player = player if player is not None else PlaybackClient(test_mode)
         self.tv_channel_id = tv_channel_id
         self.playlist_file = playlist_file
         self.media_path = media_path
         self.status_file = status_file
+        self.status_journal = StatusJournal(status_file)
+        self.quit_callbacks = []
         self.filler_video = filler_video
 
         self.playback_status = PlaybackStatus(session_name = 'Idle', session_number=0, playback_number=0)
 
-        self.papers_data = pd.read_csv(papers_file).fillna('')
-        self.authors_data = pd.read_csv(authors_file).fillna('')
+        # Session being broadcast, its videos and the index of the one playing
+        self.current_session = None
+        self.current_videos = None
+        self.current_index = None
+        self.broadcast_ended = asyncio.Event() # Set while no session is being broadcast
+        self.broadcast_ended.set()
+        self.preempting = False # Set while the BroadcastScheduler stops the session for the next one
+        self.player.add_item_callback(self.on_item)
+        self.player.add_progress_callback(self.on_progress)
+
+        # Sessions prepared by the warm-up jobs, by session number
+        self.prepared_sessions = {}
+
+        # Time that the session which is starting was scheduled for, until its first frame is displayed
+        self.pending_first_frame = None
+        self.first_frame_latencies = {}
+        self.player.add_frame_callback(self.on_first_frame)
+
+        # Data files are read on first use (see load_data), from the compiled snapshot if it is up to date
+        self.data = data if data is not None else ConferenceData(playlist_file, papers_file, authors_file, media_path, media_index_file, snapshot_file)
+        self.papers = self.data.papers
+        self.authors = self.data.authors
+        self.playlist = self.data.playlist
+        self.media = self.data.media
+
+        if hotkeys:
+            self.register_hotkeys()
     
     
-    def save_playback_status(self):
+    # Reads the papers, authors and playlist files, unless they were already read and have not changed.
+    def load_data(self):
+        self.data.refresh()
+
+
+    # Reports session videos which the media preflight found problems with, or which it has not checked.
+    def check_media(self, session_number, session_videos):
+        if self.media is None or len(self.media.media) == 0:
+            return
+
+        for video in session_videos:
+            info = self.media.get_info(video.video_path)
+            if info is None:
+                print('Session ' + str(session_number) + ': ' + video.video_path + ' is not in the media index. Run scripts/media_preflight.py to check it.')
+            elif len(info.problems) > 0:
+                print('Session ' + str(session_number) + ': ' + video.video_path + ' may not play correctly: ' + '; '.join(info.problems))
+
+
+    # Saves the playback status to file. Use a delay for frequent updates which can be coalesced.
+    def save_playback_status(self, delay = 0):
         out = { 
             "session_name": self.playback_status.session_name,
             "session_number": self.playback_status.session_number, 
-            "playback_number": self.playback_status.playback_number
+            "playback_number": self.playback_status.playback_number,
+            "position": self.playback_status.position,
+            "announced": list(self.playback_status.announced)
         }
         
-        with open(self.status_file, "w") as outfile:
-            json.dump(out, outfile)
+        self.status_journal.save(out, delay)
 
 
     def load_playback_status(self):
-        if not os.path.isfile(self.status_file):
+        status_dict = self.status_journal.load()
+        if status_dict is None:
             print('Cannot load status file. Play status unchanged.')
             return
 
-        with open(self.status_file, 'r') as openfile:
-            status_dict = json.load(openfile)
-
         self.playback_status.session_name = status_dict["session_name"]
         self.playback_status.session_number = status_dict["session_number"]
         self.playback_status.playback_number = status_dict["playback_number"]
+        self.playback_status.position = status_dict.get("position", 0)
+        self.playback_status.announced = status_dict.get("announced", [])
 
 
     def create_session_message(self, session_number, session_name, session_channel_id, session_videos):
@@ -92,37 +242,7 @@ class CSCWManager:
 
 
     def create_author_message(self, paper):
-        message = ''
-
-        j = 1
-        for i, row in self.authors_data.iterrows():
-
-            mapped_cycle = Paper.map_cycle(paper.cycle) # Map the cycle to the internal cycles used in the authors list
-
-            if row["cycle"].lower() == mapped_cycle and int(row["id"]) == paper.id:
-                column = "author_" + str(j)
-                next_author = str(row[column]).strip() if column in self.authors_data.columns else None
-                while next_author is not None and len(next_author) > 2:
-                    cur_author = next_author
-                    j += 1
-                    column = "author_" + str(j)
-                    next_author = str(row[column]).strip() if column in self.authors_data.columns else None
-                    
-                    #First author
-                    if j == 2:
-                        message += cur_author
-                    # Normal case, after first
-                    elif next_author is not None and len(next_author) > 2:
-                        message += ', ' + cur_author    
-                    # This is the last author
-                    else:
-                        message += ' and ' + cur_author
-
-        message.strip().replace('\n', '')
-        if len(message) > 2:
-            return message
-
-        return None
+        return self.authors.get_credit(paper)
 
 
     def create_paper_message(self, paper):
@@ -138,102 +258,330 @@ class CSCWManager:
 
         return message
 
-    # Play a filler video
-    def play_filler(self):
+    # Operator keys on the playback machine: 's' skips the current video and 'q' or 'Esc' quits. The keyboard module reports key
+    # presses from its own listener thread, and needs root on Linux. The control server (see control.py) works without them.
+    def register_hotkeys(self):
+        import keyboard
+
+        keyboard.add_hotkey('s', self.skip)
+        keyboard.add_hotkey('q', self.quit)
+        keyboard.add_hotkey('esc', self.quit)
+
+    # Operator commands, from the control server or the hotkeys
+    def skip(self):
+        print('Operator: skip')
+        self.player.skip()
+
+    def stop(self):
+        print('Operator: stop')
+        self.player.stop()
+
+    def pause(self):
+        print('Operator: pause')
+        self.player.pause()
+
+    def resume(self):
+        print('Operator: resume')
+        self.player.resume()
+
+    # Plays the video of the current session with the given playback number. Returns False if there is no such video.
+    def jump(self, playback_number):
+        if self.current_videos is None:
+            return False
+
+        for i, video in enumerate(self.current_videos):
+            if video.play_order == playback_number:
+                print('Operator: jump to video # ' + str(playback_number))
+                self.player.jump(i)
+                return True
+        return False
+
+    async def get_status(self):
+        status = {
+            'track': self.track,
+            'session_name': self.playback_status.session_name,
+            'session_number': self.playback_status.session_number,
+            'playback_number': self.playback_status.playback_number,
+            'position': self.playback_status.position
+        }
+
+        player_status = await self.player.status()
+        if player_status is None:
+            status['player'] = 'not responding'
+        else:
+            status['player'] = 'paused' if player_status['paused'] else player_status['state']
+            status['video'] = player_status['video']
+            status['time'] = player_status['time']
+            status['length'] = player_status['length']
+        return status
+
+    def now(self):
+        return self.clock.now(timezone.utc) if self.clock is not None else datetime.now(timezone.utc)
+
+    # Registers a function to be called (on the hotkey listener thread) before the process exits, such as closing the other tracks
+    def add_quit_callback(self, callback):
+        self.quit_callbacks.append(callback)
+
+    # Writes the pending playback status and stops the player process
+    def close(self):
+        self.status_journal.close()
+        self.player.close()
+
+    def quit(self):
+        print('Quitting playback.')
+        for callback in list(self.quit_callbacks):
+            callback()
+        self.close()
+        os._exit(0)
+
+    # Plays a video and waits for it to finish without blocking the event loop. If the playback process crashed, it has
+    # already been restarted, so the video is played again from the start. Returns the reason that playback finished.
+    async def play_video(self, video_path, repeat = False):
+        for attempt in range(CSCWManager.PLAYBACK_ATTEMPTS):
+            self.player.play_video(video_path, repeat = repeat)
+            reason = await self.player.wait_finished()
+            if reason != 'crashed':
+                break
+            print('Playback process crashed while playing ' + video_path + '. Retrying.')
+
+        return reason
+
+    # Play a filler video. It loops until it is skipped or the next session starts.
+    async def play_filler(self):
         if self.filler_video != '':
                 try:      
-                    self.player.play_video(self.filler_video)
-                    while True:
-                        if keyboard.is_pressed('s'):
-                            self.player.stop()
-                        if keyboard.is_pressed('Esc') or keyboard.is_pressed('q'):
-                            exit(0)
-                        if not self.player.is_playing():
-                            break
+                    await self.play_video(self.filler_video, repeat = True)
                 except Exception as ex:
                     print('Error playing the filler video') 
 
 
-    # Sends messages to session channel (before playback) for each video that is a paper presenation and then plays all session videos.
-    async def broadcast_session(self, session_videos):
+    # Called by the player as each video of the session starts. Saves the playback status to file, so that playback can resume
+    # from this video after a restart.
+    def on_item(self, event):
+        if self.current_videos is None:
+            return
 
-        for i, video in enumerate(session_videos):
-            #Only play the video with correct playback number. This is needed for cases where playback has restarted after first video.
-            if not video.play_order == self.playback_status.playback_number:
-                continue
-            
-            try:
-                print('Now playing video # ' + str(video.play_order) + ': ' + video.video_path)
-
-                # Save the playback status to file.
-                self.playback_status.playback_number = video.play_order
-                self.save_playback_status()
-
-                self.player.play_video(video.video_path)
-                time.sleep(1)
-
-                while True:
-                    if keyboard.is_pressed('s'):
-                        self.player.stop()
-                    if keyboard.is_pressed('Esc') or keyboard.is_pressed('q'):
-                        exit(0)
-                    if not self.player.is_playing():
-                        break
-                    continue
-                
-                if (i + 1) < len(session_videos):
-                    self.playback_status.playback_number = session_videos[i + 1].play_order
-            
-            except Exception as ex:
-                print('Error playing video ' + video.video_path + 'Reason: ' + str(ex))
+        self.current_index = event['index']
+        video = self.current_videos[self.current_index]
+        print('Now playing video # ' + str(video.play_order) + ': ' + video.video_path)
 
+        # The first video of a resumed session starts at the saved position
+        if video.play_order != self.playback_status.playback_number:
+            self.playback_status.position = 0
+        self.playback_status.playback_number = video.play_order
+        self.announce_video(video)
+        self.save_playback_status()
+
+
+    # Called by the player every second or so. Saves the media position, so that a restarted session can resume mid-video.
+    def on_progress(self, event):
+        if self.current_videos is None or event['index'] != self.current_index:
+            return
+
+        self.playback_status.position = event['time']
+        self.save_playback_status(delay = CSCWManager.POSITION_SAVE_INTERVAL)
+
+
+    # Announces a paper presentation in the session channel as its video starts. The message is sent in the background so that
+    # playback never waits for Discord, and each video is only announced once even if the session is resumed.
+    def announce_video(self, video):
+        prepared = self.current_session
+        if prepared is None or prepared.session_channel_id is None:
+            return
+
+        message = prepared.paper_messages.get(video.play_order)
+        if message is None or video.play_order in self.playback_status.announced:
+            return
+
+        self.playback_status.announced.append(video.play_order)
+        asyncio.create_task(self.send_announcement(prepared.session_channel_id, message))
+
+
+    async def send_announcement(self, channel_id, message):
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.bot.enqueue_message(channel_id, message), CSCWManager.ANNOUNCEMENT_TIMEOUT)
+            REGISTRY.summary('paper_announcement_delay_seconds', 'Time from a paper video starting to its announcement being sent').observe_since(started)
+        except asyncio.TimeoutError:
+            print('Announcement for channel ' + str(channel_id) + ' was not sent within ' + str(CSCWManager.ANNOUNCEMENT_TIMEOUT) + ' s and was dropped.')
+        except Exception as ex:
+            print('Sending announcement to channel ' + str(channel_id) + ' failed. Reason: ' + str(ex))
+
+
+    # Plays all session videos back to back, starting from the video with the current playback number. Paper presentations are
+    # announced in the session channel as their videos start (see on_item).
+    async def broadcast_session(self, session_videos):
+        #Only play from the video with correct playback number. This is needed for cases where playback has restarted after first video.
+        start_index = None
+        for i, video in enumerate(session_videos):
+            if video.play_order == self.playback_status.playback_number:
+                start_index = i
+                break
+
+        video_paths = [video.video_path for video in session_videos]
+        self.current_videos = session_videos
+        self.current_index = start_index
+        self.broadcast_ended.clear()
+        attempts = 0
+
+        while start_index is not None and start_index < len(session_videos):
+            # Resume the first video from the saved position, if there is one
+            self.player.play_playlist(video_paths, start_index, position = self.playback_status.position)
+            reason = await self.player.wait_finished()
+            REGISTRY.counter('playback_finished_total', 'Session playlists which stopped playing, by reason').inc(reason = reason)
+
+            # Another session has taken over the player, and owns the playback status now.
+            if self.current_videos is not session_videos:
+                return
+
+            failed_video = session_videos[self.current_index].video_path
+            if reason == 'crashed' and attempts + 1 < CSCWManager.PLAYBACK_ATTEMPTS:
+                # The playback process has been restarted. Play the interrupted video again, from the last saved position.
+                print('Playback process crashed while playing ' + failed_video + '. Retrying.')
+                attempts += 1
+                start_index = self.current_index
+            elif reason == 'crashed' or reason == 'error':
+                print('Error playing video ' + failed_video + '. Reason: ' + reason)
+                attempts = 0
+                start_index = self.current_index + 1
+                self.playback_status.position = 0
+            else:
+                if reason == 'stopped':
+                    print('Playback stopped. Ending session.')
+                break
+
+        self.end_broadcast()
+
+
+    # Resets the playback status to idle once a session has finished, or was preempted by the next one.
+    def end_broadcast(self):
+        self.current_session = None
+        self.current_videos = None
+        self.pending_first_frame = None # The session ended before its first frame was displayed
         self.playback_status.session_name = 'idle'
         self.playback_status.session_number = 0
         self.playback_status.playback_number = 0
+        self.playback_status.position = 0
+        self.playback_status.announced = []
+        self.broadcast_ended.set()
 
         self.save_playback_status()
 
 
-    # Sends message to the main session channel for the session and then broadcast it. Reads the playlist and papers data from file
-    # at the beginning of each session, to allow for the user to change playlist or paper info, any time before the session starts.
-    async def start_session (self, session_number, session_name, play_number = 0, filler_video = ''):
-        print ('Starting session ' + str(session_number) + ' ' + session_name)
-        playlist_data = pd.read_csv(self.playlist_file).fillna('')
+    async def get_session_channel_id(self, session_number, session_name):
+        channel_name = self.bot.get_valid_name(session_name, session_number)
+        return await self.bot.get_channel_id_by_name(channel_name)
 
-        session_videos = []
 
-        for i, playlist_video in playlist_data.iterrows():
-            if int(playlist_video["session_number"]) == int(session_number):
-                paper = None
-                video_path = os.path.join(self.media_path, playlist_video["file_name"])
+    # Warm-up for a session, run some minutes before it starts. Reads the session videos, renders the announcements and has the
+    # player open the video files, so that start_session only needs to send the announcement and start playback.
+    async def prepare_session(self, session_number, session_name):
+        print('Preparing session ' + str(session_number) + ' ' + session_name)
+        started = time.perf_counter()
+        self.load_data()
+        session_videos = self.playlist.get_session(session_number, self.track)
+
+        session_channel_id = None
+        session_message = None
+        paper_messages = {}
+        if len(session_videos) > 0:
+            try:
+                session_channel_id = await self.get_session_channel_id(session_number, session_name)
+                session_message = self.create_session_message(session_number, session_name, session_channel_id, session_videos)
+            except Exception as ex:
+                print('Could not prepare the announcement for session ' + str(session_number) + '. Reason: ' + str(ex))
+
+            for video in session_videos:
+                if video.is_paper() and not video.paper.title.strip() == '':
+                    paper_messages[video.play_order] = self.create_paper_message(video.paper)
+
+            self.check_media(session_number, session_videos)
+            self.player.preload([video.video_path for video in session_videos])
+
+        prepared = PreparedSession(session_number = session_number, 
+            session_name = session_name, 
+            session_videos = session_videos, 
+            playlist_version = self.playlist.version, 
+            authors_version = self.authors.version,
+            session_channel_id = session_channel_id,
+            session_message = session_message,
+            paper_messages = paper_messages)
+        self.prepared_sessions[int(session_number)] = prepared
+        REGISTRY.summary('session_prepare_seconds', 'Time to prepare a session: read the playlist, render the announcements and preload the videos').observe_since(started)
+        return prepared
+
+
+    # Gets the prepared session, unless the playlist, papers or authors changed since it was prepared.
+    async def get_prepared_session(self, session_number, session_name):
+        self.load_data()
+
+        prepared = self.prepared_sessions.pop(int(session_number), None)
+        if prepared is None or prepared.session_name != session_name \
+                or prepared.playlist_version != self.playlist.version or prepared.authors_version != self.authors.version:
+            REGISTRY.counter('session_warmup_total', 'Sessions started, by whether the warm-up could be used').inc(result = 'miss', track = self.track)
+            prepared = await self.prepare_session(session_number, session_name)
+        else:
+            REGISTRY.counter('session_warmup_total', 'Sessions started, by whether the warm-up could be used').inc(result = 'hit', track = self.track)
+
+        return prepared
+
+
+    def on_first_frame(self, event):
+        if self.pending_first_frame is None:
+            return
+
+        session_number, scheduled_time = self.pending_first_frame
+        self.pending_first_frame = None
+
+        latency = (self.now() - scheduled_time).total_seconds()
+        self.first_frame_latencies[session_number] = latency
+        REGISTRY.summary('session_first_frame_delay_seconds', 'Time from the scheduled start of a session to its first frame being displayed').observe(latency)
+        print('Scheduled-to-first-frame latency for session ' + str(session_number) + ': ' + '{:.3f}'.format(latency) + ' s')
 
-                # If this is a paper, get the info for the paper
-                if playlist_video["is_paper"]:
-                    paper = Paper.get_paper(papers = self.papers_data, id = playlist_video["paper_id"], cycle = playlist_video["cycle"])
-                else:
-                    print('Not a paper')
 
-                session_videos.append(SessionVideo(session_number = session_number, 
-                    video_path = video_path, 
-                    play_order = (int)(playlist_video["play_order"]),
-                    paper = paper))
+    def on_session_message_sent(self, future, scheduled_time):
+        if future.cancelled() or future.exception() is not None:
+            return
+
+        delay = (self.now() - scheduled_time).total_seconds()
+        REGISTRY.summary('session_announcement_delay_seconds', 'Time from the scheduled start of a session to its announcement being sent').observe(delay)
+
 
-        # Ensure that videos are sorted by play order
-        session_videos.sort(key=SessionVideo.sort_video)
+    # Sends message to the main session channel for the session and then broadcast it. The session is normally prepared by a warm-up
+    # job, and is prepared again if the playlist or papers data changed since then, to allow for the user to change playlist or paper
+    # info, any time before the session starts.
+    async def start_session (self, session_number, session_name, play_number = 0, filler_video = '', scheduled_time = None, position = 0):
+        print ('Starting session ' + str(session_number) + ' ' + session_name + ' on track ' + str(self.track))
+        REGISTRY.counter('sessions_started_total', 'Sessions started, including resumed sessions').inc(track = self.track)
+        prepared = await self.get_prepared_session(session_number, session_name)
+        session_videos = prepared.session_videos
+        self.current_session = prepared
+
+        # The first frame of a session without videos would be the filler's
+        if scheduled_time is not None and len(session_videos) > 0:
+            self.pending_first_frame = (session_number, scheduled_time)
 
         # Update the current session name and number
         self.playback_status.session_name = session_name
         self.playback_status.session_number = session_number
         self.playback_status.playback_number = play_number
+        self.playback_status.position = position
+        if play_number == 0:
+            self.playback_status.announced = []
 
         # If the session is starting from the first video and there are videos to play, send an announcement.
         if self.playback_status.playback_number == 0 and len(session_videos) > 0:
-            channel_name = self.bot.get_valid_name(session_name, session_number)
-            session_channel_id = await self.bot.get_channel_id_by_name(channel_name)
-            session_message = self.create_session_message(session_number, session_name, session_channel_id, session_videos)
             try:
+                # The session channel could not be found during the warm-up. Try again.
+                if prepared.session_channel_id is None:
+                    prepared.session_channel_id = await self.get_session_channel_id(session_number, session_name)
+                    prepared.session_message = self.create_session_message(session_number, session_name, prepared.session_channel_id, session_videos)
+
+                session_message = prepared.session_message
                 print("Sending announcement for start of session: " + self.playback_status.session_name)
-                await self.bot.send_message(self.tv_channel_id, session_message)
+                sent = self.bot.enqueue_message(self.tv_channel_id, session_message) # Sent in the background while playback starts
+                if scheduled_time is not None:
+                    sent.add_done_callback(lambda future: self.on_session_message_sent(future, scheduled_time))
             except Exception as ex:
                 print('Sending session message failed for session "' + str(session_number) + '. ' + str(session_name) +'" Reason: ' + str(ex))
 
@@ -247,185 +595,545 @@ class CSCWManager:
         except Exception as ex:
             print('Broadcasting session failed for session ' + str(session_number) + '. ' + str(session_name) +'. Reason: ' +str(ex))
 
-        # Play a filler video after session
-        self.play_filler()
+        # Play a filler video after session, unless the next session is taking over (see BroadcastScheduler.preempt)
+        if not self.preempting:
+            await self.play_filler()
       
 
 
+# A session waiting in the BroadcastScheduler queue
+class ScheduledBroadcast:
+    def __init__(self, time, session_number, session_name, play_number = 0, position = 0, job_id = None):
+        self.time = time
+        self.session_number = session_number
+        self.session_name = session_name
+        self.play_number = play_number
+        self.position = position
+        self.job_id = job_id
+
+
+# Starts each session at its start time, from a heap of upcoming sessions ordered by start time. If the previous session is still
+# on air when the next one is due, it is preempted according to the policy:
+#   cut:         stop it right away
+#   fade:        fade the audio out over FADE_SECONDS, then stop it
+#   finish-talk: let the current video finish, then stop it. It is cut if it runs more than max_overrun past the next start time.
+# The next session is then started, so it is never kept off air for longer than the policy allows.
+class BroadcastScheduler:
+    POLICIES = ('cut', 'fade', 'finish-talk')
+    FADE_SECONDS = 5
+    CANCEL_TIMEOUT = 5 # Seconds to wait for a preempted session to stop
+
+    def __init__(self, manager, time_zone = timezone.utc, policy = 'cut', max_overrun = timedelta(minutes = 10), grace_period = 10, on_start = None, clock = None):
+        if policy not in BroadcastScheduler.POLICIES:
+            raise ValueError('Unknown preemption policy ' + str(policy))
+
+        self.manager = manager
+        self.time_zone = time_zone
+        self.policy = policy
+        self.max_overrun = max_overrun
+        self.grace_period = grace_period
+        self.on_start = on_start # Called with each ScheduledBroadcast as it starts
+        self.on_preempt = None # Called with the ScheduledBroadcast which is on air when the next one is due
+        self.clock = clock
+        self.queue = [] # Heap of (time, sequence number, ScheduledBroadcast)
+        self.counter = itertools.count() # Keeps sessions with the same start time in the order they were added
+        self.wakeup = asyncio.Event() # Set when a session is added, so that the run loop checks the head of the queue again
+        self.current = None
+        self.task = None
+        self.runner = None
+        REGISTRY.gauge('broadcast_queued_sessions', 'Sessions waiting to be started', function = lambda: len(self.queue), track = manager.track)
+
+    def add(self, broadcast):
+        heapq.heappush(self.queue, (broadcast.time, next(self.counter), broadcast))
+        self.wakeup.set()
+        return broadcast
+
+    def now(self):
+        return self.clock.now(self.time_zone) if self.clock is not None else datetime.now(self.time_zone)
+
+    # Starts the run loop. Must be called from the event loop that runs the sessions.
+    def start(self):
+        self.runner = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            if len(self.queue) == 0:
+                await self.wakeup.wait()
+                continue
+
+            # Sleep until the first session is due, or until a session is added
+            delay = (self.queue[0][0] - self.now()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, broadcast = heapq.heappop(self.queue)
+            try:
+                await self.hand_over(broadcast)
+            except Exception as ex:
+                print('Starting session ' + str(broadcast.session_number) + ' failed. Reason: ' + str(ex))
+
+    # Preempts the session on air, if there is one, and starts the given session.
+    async def hand_over(self, broadcast):
+        lateness = (self.now() - broadcast.time).total_seconds()
+        if lateness > self.grace_period:
+            print('Session ' + str(broadcast.session_number) + '. ' + broadcast.session_name + ' is starting ' + '{:.0f}'.format(lateness) + ' s late.')
+
+        if self.task is not None and not self.task.done():
+            started = time.perf_counter()
+            await self.preempt()
+            REGISTRY.summary('broadcast_preempt_seconds', 'Time to stop the previous session before starting the next one').observe_since(started)
+
+        if self.on_start is not None:
+            self.on_start(broadcast)
+
+        self.current = broadcast
+        self.task = asyncio.get_running_loop().create_task(self.manager.start_session(
+            session_number = broadcast.session_number,
+            session_name = broadcast.session_name,
+            play_number = broadcast.play_number,
+            scheduled_time = broadcast.time,
+            position = broadcast.position))
+        delay = (self.now() - broadcast.time).total_seconds()
+        REGISTRY.summary('broadcast_handover_delay_seconds', 'Time from the scheduled start of a session to it being started').observe(delay)
+        print('Handed over to session ' + str(broadcast.session_number) + ' ' + '{:.3f}'.format(delay) + ' s after its start time')
+
+    # Stops the session which is running. Once its videos are done it only plays the filler, which is stopped right away. While a
+    # session is being preempted, the manager does not start the filler after it, so that the filler does not flash on screen
+    # before the next session.
+    async def preempt(self):
+        if self.manager.current_videos is not None:
+            print('Session ' + str(self.current.session_number) + '. ' + self.current.session_name + ' is overrunning. Preempting it (' + self.policy + ').')
+            REGISTRY.counter('broadcast_preemptions_total', 'Sessions which were still on air when the next one started').inc(policy = self.policy)
+            if self.on_preempt is not None:
+                self.on_preempt(self.current)
+
+            self.manager.preempting = True
+            if self.policy == 'fade':
+                self.manager.player.fade_out(BroadcastScheduler.FADE_SECONDS)
+                try:
+                    await asyncio.wait_for(self.manager.broadcast_ended.wait(), BroadcastScheduler.FADE_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+            elif self.policy == 'finish-talk':
+                self.manager.player.finish_current()
+                try:
+                    await asyncio.wait_for(self.manager.broadcast_ended.wait(), self.max_overrun.total_seconds())
+                except asyncio.TimeoutError:
+                    print('The current video did not finish within ' + str(self.max_overrun) + '. Cutting it.')
+
+            # Stop the video which is still playing (cut right away, faded out, or past the maximum overrun)
+            if not self.manager.broadcast_ended.is_set():
+                self.manager.player.stop()
+
+        self.task.cancel()
+        await asyncio.wait([self.task], timeout = BroadcastScheduler.CANCEL_TIMEOUT)
+        self.manager.preempting = False
+        if self.manager.current_videos is not None:
+            self.manager.end_broadcast()
+
+
+# Schedules the sessions of the manager's track. Session starts are run by a BroadcastScheduler, which can preempt a session that
+# overruns. The warm-up jobs are run by APScheduler, which always runs on the system clock, or by the clock if one is given (see
+# simulation.VirtualClock).
 class CSCWSchedulingHandler:
     DELIMITER = '||||'
+    WARMUP_PREFIX = 'warmup'
 
     def __init__(self, 
         manager,
-        time_zone=timezone.utc, grace_period = 10):
+        time_zone=timezone.utc, grace_period = 10, warmup_minutes = 5, job_store = None, policy = 'cut', max_overrun_minutes = 10, clock = None):
+        from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
         self.manager = manager
+        self.track = manager.track
         self.scheduler = AsyncIOScheduler(timezone=time_zone)
-        self.running_job_id = None
+        self.broadcasts = BroadcastScheduler(manager, time_zone, policy, timedelta(minutes = max_overrun_minutes), grace_period, on_start = self.on_broadcast_start, clock = clock)
+        self.clock = clock
         self.time_zone = time_zone
+        self.warmup = timedelta(minutes = warmup_minutes)
+        self.job_store = job_store
+
+    def now(self):
+        return self.broadcasts.now()
+
+    # Jobs of track 1 keep the ids they had before tracks were added, so that existing job stores remain valid
+    @staticmethod
+    def get_job_id(time, session_number, session_name, track = 1):
+        delimiter = CSCWSchedulingHandler.DELIMITER
+        job_id = str(session_number) + delimiter + str(session_name) + delimiter + str(time)
+        if track != 1:
+            job_id += delimiter + 'track' + str(track)
+        return job_id
 
     def job_submitted_listener(self, event):
         print('Running job: ' + str(event.job_id))
-        self.running_job = event.job_id
 
+    # Only warm-ups are run by APScheduler. A missed warm-up is not a problem, the session is prepared when it starts instead.
     def job_missed_listener(self, event):
         print('Missed job id ' + str(event.job_id))
-        
-        running_job = self.scheduler.get_job(self.running_job_id)
-        if running_job is not None:
-            running_job.pause()
-            print('Current broadcast stopped to avoid missing next session. Stopped job ' + str(self.running_job_id)) 
-
-        components = str(event.job_id).split(CSCWSchedulingHandler.DELIMITER)
-        session_number = int(components[0].strip())
-        session_name = components[1].strip()
-        
-        self.running_job_id = self.add_session(
-            time = datetime.now(self.time_zone), 
-            session_number=session_number,
-            session_name=session_name)
-        print('Recovering missed job...Starting the broadcast for the next session.' + str(event.job_id))
+        REGISTRY.counter('scheduler_missed_jobs_total', 'Warm-up jobs which did not run on time').inc()
+
+    def on_broadcast_start(self, broadcast):
+        print('Running job: ' + str(broadcast.job_id))
+
+        if self.job_store is not None:
+            self.job_store.mark_done([broadcast.job_id])
         
 
     def error_listener(self, event):
+        REGISTRY.counter('scheduler_job_errors_total', 'Scheduled jobs which raised an error').inc()
         print('Bot is stopping. ' + str(event))
         self.scheduler.shutdown(wait=False)
+        self.manager.status_journal.close()
+        if self.job_store is not None:
+            self.job_store.close()
         os._exit(1)
         
     def add_session(self, 
         time, 
         session_number, 
         session_name, 
-        play_number = 0):
+        play_number = 0,
+        position = 0):
             delimiter = CSCWSchedulingHandler.DELIMITER
-            return self.scheduler.add_job(self.manager.start_session, 'date', 
-                    id = str(session_number) + delimiter + str(session_name) + delimiter + str(time),
-                    run_date=time, 
-                    kwargs = {
-                    'session_number': session_number,
-                    'session_name': session_name,
-                    'play_number': play_number
-                    })
+            job_id = CSCWSchedulingHandler.get_job_id(time, session_number, session_name, self.track)
+
+            # Prepare the session ahead of time, unless it is resuming or starting right away
+            warmup_time = time - self.warmup
+            if self.warmup > timedelta(0) and play_number == 0 and warmup_time > self.now():
+                if self.clock is not None:
+                    self.clock.run_at(warmup_time, self.manager.prepare_session, session_number = session_number, session_name = session_name)
+                else:
+                    self.scheduler.add_job(self.manager.prepare_session, 'date', 
+                        id = CSCWSchedulingHandler.WARMUP_PREFIX + delimiter + job_id,
+                        run_date=warmup_time, 
+                        kwargs = {
+                        'session_number': session_number,
+                        'session_name': session_name
+                        })
+
+            return self.broadcasts.add(ScheduledBroadcast(time, session_number, session_name, play_number, position, job_id))
 
     def start(self):
+        import apscheduler.events
+
         self.scheduler.add_listener(self.job_submitted_listener, apscheduler.events.EVENT_JOB_SUBMITTED)
         self.scheduler.add_listener(self.job_missed_listener, apscheduler.events.EVENT_JOB_MISSED)
         self.scheduler.add_listener(self.error_listener, apscheduler.events.EVENT_JOB_ERROR)
     
-        self.scheduler.start()
+        if self.clock is None:
+            self.scheduler.start()
+        self.broadcasts.start()
+
+
+# Format of the session times in sessions.csv (UTC, 24-hour)
+TIME_FORMAT = '%Y-%m-%d %H:%M'
+
+
+# Reads the timetable and converts the week 1 and week 2 session times to UTC datetimes, one column at a time. Times which are not
+# in TIME_FORMAT (e.g., after the file was edited in a spreadsheet) are parsed one by one, and are NaT if they cannot be parsed.
+# The track column is optional. Sessions without a track are on track 1.
+def load_timetable(sessions_file, time_zone = timezone.utc):
+    import pandas as pd
+
+    timetable_data = pd.read_csv(sessions_file)
+    if 'track' in timetable_data.columns:
+        timetable_data['track'] = pd.to_numeric(timetable_data['track'], errors = 'coerce').fillna(1).astype(int)
+    else:
+        timetable_data['track'] = 1
+
+    for column in ('w1_time_utc', 'w2_time_utc'):
+        text = timetable_data[column].astype(str).str.strip()
+        times = pd.to_datetime(text, format = TIME_FORMAT, errors = 'coerce')
+
+        unparsed = times.isna() & timetable_data[column].notna()
+        if unparsed.any():
+            times[unparsed] = [parse_time(value) for value in text[unparsed]]
+
+        timetable_data[column] = times.dt.tz_localize(time_zone)
+
+    return timetable_data
+
+
+def get_tracks(timetable_data):
+    return sorted(set(int(track) for track in timetable_data['track']))
+
+
+def parse_time(value):
+    import pandas as pd
+    from dateutil import parser as date_parser
+
+    try:
+        return date_parser.parse(value).replace(tzinfo = None)
+    except (ValueError, OverflowError):
+        return pd.NaT
+
+
+# Schedule the sessions of the scheduler's track to be broadcast at the correct time for both week 1 and week 2, unless that time
+# has already passed.
+def schedule_sessions(scheduler, timetable_data, time_zone = timezone.utc, sessions_file = 'sessions.csv'):
+    import pandas as pd
+
+    now = scheduler.now()
+    for i, (session_number, session_name, w1_time, w2_time, track) in enumerate(zip(timetable_data["session_number"], 
+            timetable_data["session_name"], 
+            timetable_data["w1_time_utc"], 
+            timetable_data["w2_time_utc"],
+            timetable_data["track"])):
+        if track != scheduler.track:
+            continue
+        if pd.isna(w1_time) or pd.isna(w2_time):
+            print('Could not parse date for row ' + str(i+2) + ' in file ' + sessions_file)
+            continue
+
+        for week, session_time in ((1, w1_time.to_pydatetime()), (2, w2_time.to_pydatetime())):
+            if session_time > now:
+                print('Scheduling session '+ str(session_number) + '. ' + str(session_name) +' for week ' + str(week) + '. Time: ' + str(session_time))
+                scheduler.add_session(
+                time=session_time, 
+                session_number = int(session_number),
+                session_name = session_name)
+            else:
+                print('Cannot schedule session '+ str(session_number) + ' for week ' + str(week) + '. Time is in the past. Time: ' + str(session_time))
+
+
+# Builds the broadcast jobs for both weeks of every session in the timetable, on all tracks, including those in the past.
+def get_session_jobs(timetable_data, sessions_file = 'sessions.csv'):
+    import pandas as pd
+
+    jobs = []
+    for i, (session_number, session_name, w1_time, w2_time, track) in enumerate(zip(timetable_data["session_number"], 
+            timetable_data["session_name"], 
+            timetable_data["w1_time_utc"], 
+            timetable_data["w2_time_utc"],
+            timetable_data["track"])):
+        if pd.isna(w1_time) or pd.isna(w2_time):
+            print('Could not parse date for row ' + str(i+2) + ' in file ' + sessions_file)
+            continue
+
+        for session_time in (w1_time.to_pydatetime(), w2_time.to_pydatetime()):
+            job_id = CSCWSchedulingHandler.get_job_id(session_time, session_number, session_name, int(track))
+            jobs.append(StoredJob(job_id, int(session_number), str(session_name), session_time, track = int(track)))
+
+    return jobs
+
+
+# A session which was missed while the script was not running is still started if it should have started less than this long ago
+MISSED_SESSION_WINDOW = timedelta(hours = 1)
+
+
+# Updates the job store from the sessions file, for all tracks, if the file changed since it was last read.
+def update_job_store(job_store, sessions_file, time_zone = timezone.utc):
+    if job_store.is_current(sessions_file):
+        print('Loading scheduled sessions from ' + job_store.path)
+    else:
+        timetable_data = load_timetable(sessions_file, time_zone)
+        added, removed = job_store.apply(get_session_jobs(timetable_data, sessions_file), sessions_file)
+        print('Updated scheduled sessions from ' + sessions_file + ': ' + str(added) + ' added, ' + str(removed) + ' removed')
+
+
+# Schedules the sessions of the scheduler's track from the job store (see update_job_store). Jobs which were missed while the script
+# was not running are reconciled in one pass: the latest session which should have started within MISSED_SESSION_WINDOW is started
+# right away (unless it is being resumed from the status file), and any other missed sessions are reported and marked as done.
+def schedule_stored_sessions(scheduler, job_store, resume_session_number = None):
+    now = scheduler.now()
+    jobs = job_store.load_jobs(scheduler.track)
+    past_jobs = [job for job in jobs if job.run_time <= now]
+    missed_jobs = [job for job in past_jobs if not job.done]
+
+    if len(missed_jobs) > 0:
+        current_job = past_jobs[-1]
+        for job in missed_jobs:
+            if job is current_job and now - job.run_time < MISSED_SESSION_WINDOW and job.session_number != resume_session_number:
+                print('Session ' + str(job.session_number) + '. ' + job.session_name + ' was missed at ' + str(job.run_time) + '. Starting it now.')
+                scheduler.add_session(
+                    time = now + timedelta(seconds=10),
+                    session_number = job.session_number,
+                    session_name = job.session_name)
+            else:
+                print('Session ' + str(job.session_number) + '. ' + job.session_name + ' was missed at ' + str(job.run_time) + '.')
+        job_store.mark_done([job.id for job in missed_jobs])
+
+    for job in jobs:
+        if job.run_time > now:
+            print('Scheduling session '+ str(job.session_number) + '. ' + job.session_name + '. Time: ' + str(job.run_time))
+            scheduler.add_session(
+                time = job.run_time,
+                session_number = job.session_number,
+                session_name = job.session_name)
+
+
+# If there is an incomplete session in the status file, schedules that session to restart at the correct playback number.
+def schedule_resume(scheduler, manager):
+    if manager.playback_status.playback_number > 0:
+        print('Scheduling existing playback to resume for session ' + str(manager.playback_status.session_number) + ' at video ' + str(manager.playback_status.playback_number)
+            + ', ' + str(manager.playback_status.position // 1000) + ' s in')
+        resume_time = scheduler.now() + timedelta(seconds=10)
+        scheduler.add_session(
+                time=resume_time, 
+                session_number = manager.playback_status.session_number,
+                session_name = manager.playback_status.session_name,
+                play_number = manager.playback_status.playback_number,
+                position = manager.playback_status.position)
+
+
+def parse_args():
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument('-t', '--test', help='Test mode active. Defaults to false', default = False, type=bool)
+    args_parser.add_argument('-w', '--warmup', help='Minutes before each session to prepare it. Defaults to 5', default = 5, type=float)
+    args_parser.add_argument('-j', '--job-store', help='SQLite file for keeping the scheduled sessions between restarts (e.g., jobs.sqlite)', default = None)
+    args_parser.add_argument('-p', '--preempt', help='What to do with a session which is still on air when the next one starts: cut, fade or finish-talk. Defaults to cut',
+        default = 'cut', choices = BroadcastScheduler.POLICIES)
+    args_parser.add_argument('--control-port', help='Port of the control server. Defaults to 8750', default = 8750, type=int)
+    args_parser.add_argument('--control-host', help='Address for the control server to listen on. Defaults to 127.0.0.1 (this machine only)', default = '127.0.0.1')
+    args_parser.add_argument('--metrics-log', help='File to append timing measurements to, as JSON lines', default = None)
+    args_parser.add_argument('--lean-client', help='Connect to Discord with only the guilds intent and without message and member caches, to use less memory (see scripts/memory_benchmark.py)', action='store_true')
+    args_parser.add_argument('--hotkeys', help='Also accept the s (skip) and q (quit) keys on this machine. Needs root on Linux', action='store_true')
+    args_parser.add_argument('--max-overrun', help='Minutes that the current talk may run past the next session start with --preempt finish-talk. Defaults to 10', default = 10, type=float)
+    args_parser.add_argument('--simulate', help='Run the whole timetable on a virtual clock, with fake playback and Discord, and report how it went (see simulation.py)', action='store_true')
+    args_parser.add_argument('--crashes', help='With --simulate, number of playback process crashes to inject. Defaults to 0', default = 0, type=int)
+    args_parser.add_argument('--restarts', help='With --simulate, number of restarts of the script to inject. Defaults to 0', default = 0, type=int)
+    args_parser.add_argument('--seed', help='With --simulate, random seed for the crash and restart times. Defaults to 1', default = 1, type=int)
+    args_parser.add_argument('--verbose', help='With --simulate, also show the output of the bot', action='store_true')
+    return args_parser.parse_args()
+
+
+# Status file of each track. Track 1 keeps the file name it had before tracks were added.
+def get_status_file(track):
+    return os.path.join('.', 'status.json' if track == 1 else 'status-' + str(track) + '.json')
+
+
+# TV channel of each track, from TV_CHANNEL_ID for track 1 and TV_CHANNEL_ID_<track> for the other tracks
+def get_tv_channel_id(track):
+    channel_id = os.getenv('TV_CHANNEL_ID_' + str(track))
+    if channel_id is None:
+        if track != 1:
+            print('Warning: TV_CHANNEL_ID_' + str(track) + ' is not set. Track ' + str(track) + ' is announced in TV_CHANNEL_ID.')
+        channel_id = os.getenv('TV_CHANNEL_ID')
+    return int(channel_id)
 
 
 # Overall approach: Schedule all the video playlists to play for each session start time in both weeks and play the video(s) for each session in playlists. Ensure that all start times are in UTC and that the clock used is UTC. Iterate over each session row (indexed by #) in the time table and schedule the videos for each session in both weeks. Lookup the corresponding data for each session in session_data.
-async def main():
+async def main(args):
     media_path = 'videos'
     scheduling_path = 'scheduling'
     misfire_grace_period = 10
     time_zone = timezone.utc
-    status_file = os.path.join('.', 'status.json')
     playlist_file = os.path.join(scheduling_path, 'playlist.csv')
     papers_file = os.path.join(scheduling_path, 'papers.csv')
     authors_file = os.path.join(scheduling_path, 'authors.csv')
     sessions_file = os.path.join(scheduling_path, 'sessions.csv')
+    media_index_file = os.path.join(scheduling_path, 'media_index.json')
+    snapshot_file = os.path.join(scheduling_path, 'conference_data.pickle')
     filler_video = os.path.join(media_path, 'cscw_filler.mp4')
 
-    timetable_data = pd.read_csv(sessions_file)
-
-    #Set up the command-line argument for test mode
-    args_parser = argparse.ArgumentParser()
-    args_parser.add_argument('-t', '--test', help='Test mode active. Defaults to false', default = False, type=bool)
-    args = args_parser.parse_args()
-
     if args.test:
         print('***Running bot in test mode***')
 
+    if args.metrics_log is not None:
+        REGISTRY.open_log(args.metrics_log)
+
     # Load configuration file
     load_dotenv()
     bot_token = os.getenv('TOKEN')
-    live_tv_channel = int(os.getenv('TV_CHANNEL_ID'))
     guild_id = os.getenv('GUILD_ID')
-
-    bot = Bot(bot_token, guild_id, test_mode = args.test) # Create the bot
-    
-    manager = CSCWManager(bot = bot, 
-        tv_channel_id = live_tv_channel,
-        playlist_file = playlist_file,
-        papers_file = papers_file,
-        authors_file = authors_file,
-        media_path = media_path,
-        status_file = status_file,
-        filler_video = filler_video,
-        test_mode = args.test)
-
-    manager.load_playback_status()
-
-    scheduler = CSCWSchedulingHandler(manager, time_zone)
-    
-    print ('Scheduling sessions...')
-
-    #If there is an incomplete session, schedule that session to restart at the correct playback number
-    if manager.playback_status.playback_number > 0:
-        print('Scheduling existing playback to resume for session ' + str(manager.playback_status.session_number) + ' at video ' + str(manager.playback_status.playback_number))
-        resume_time = datetime.now(time_zone) + timedelta(seconds=10)
-        scheduler.add_session(
-                time=resume_time, 
-                session_number = manager.playback_status.session_number,
-                session_name = manager.playback_status.session_name,
-                play_number = manager.playback_status.playback_number)
-
-    for i, session_row in timetable_data.iterrows():
-        # Schedule the session to be broadcast at the correct time for both week 1 and week 2
-        try:
-            w1_time = date_parser.parse(session_row["w1_time_utc"]).replace(tzinfo=time_zone)# Get the datetime for week 1 as utc
-            w2_time = date_parser.parse(session_row["w2_time_utc"]).replace(tzinfo=time_zone)# Get the datetime for week 2 as utc
-        except Exception as ex:
-            print('Could not parse date for row ' + str(i+2) + ' in file ' + sessions_file + '. Reason: ' + str(ex))
-            continue
-        
-        # Add session time for week 1 but first check if time is later than right now
-        if w1_time > datetime.now(time_zone):
-            print('Scheduling session '+ str(session_row["session_number"]) + '. ' + str(session_row["session_name"]) +' for week 1. Time: ' + str(w1_time))
-            scheduler.add_session(
-            time=w1_time, 
-            session_number = session_row["session_number"],
-            session_name = session_row["session_name"])
+    control_token = os.getenv('CONTROL_TOKEN') # Optional
+
+    # All tracks are scheduled from the same sessions file and job store
+    job_store = SessionJobStore(args.job_store) if args.job_store is not None else None
+    timetable_data = None
+    if job_store is not None:
+        update_job_store(job_store, sessions_file, time_zone)
+        tracks = job_store.get_tracks() or [1]
+    else:
+        timetable_data = load_timetable(sessions_file, time_zone)
+        tracks = get_tracks(timetable_data) or [1]
+
+    # Each track has its own manager, player process and status file. The conference data is read once for all of them.
+    # The bot is created once scheduling is complete.
+    data = ConferenceData(playlist_file, papers_file, authors_file, media_path, media_index_file, snapshot_file)
+    managers = {}
+    schedulers = []
+    for track in tracks:
+        manager = CSCWManager(bot = None, 
+            tv_channel_id = get_tv_channel_id(track),
+            playlist_file = playlist_file,
+            papers_file = papers_file,
+            authors_file = authors_file,
+            media_path = media_path,
+            status_file = get_status_file(track),
+            filler_video = filler_video,
+            test_mode = args.test,
+            media_index_file = media_index_file,
+            hotkeys = args.hotkeys and track == tracks[0],
+            track = track,
+            data = data)
+        managers[track] = manager
+
+        manager.load_playback_status()
+
+        scheduler = CSCWSchedulingHandler(manager, time_zone, misfire_grace_period, warmup_minutes = args.warmup, job_store = job_store,
+            policy = args.preempt, max_overrun_minutes = args.max_overrun)
+        schedulers.append(scheduler)
+
+        print ('Scheduling sessions of track ' + str(track) + '...')
+
+        schedule_resume(scheduler, manager)
+
+        if job_store is not None:
+            resume_session_number = manager.playback_status.session_number if manager.playback_status.playback_number > 0 else None
+            schedule_stored_sessions(scheduler, job_store, resume_session_number)
         else:
-            print('Cannot schedule session '+ str(session_row["session_number"]) + ' for week 1. Time is in the past. Time: ' + str(w1_time))
+            schedule_sessions(scheduler, timetable_data, time_zone, sessions_file)
 
-        # Add session time for week 2, apply same check as for week 1
-        if w2_time > datetime.now(time_zone):
-            print('Scheduling session '+ str(session_row["session_number"]) + '. ' + str(session_row["session_name"]) +' for week 2. Time: ' + str(w1_time))
-            scheduler.add_session(
-            time=w2_time, 
-            session_number = session_row["session_number"],
-            session_name = session_row["session_name"])
-        else:
-            print('Cannot schedule session '+ str(session_row["session_number"]) + ' for week 2. Time is in the past. Time: ' + str(w2_time))
-    #End-for
-
-    #Test schedule
-    if False:
-        for i, session_row in timetable_data.iterrows():
-            session_number = i+1
-            if session_number == 52:
-                scheduler.add_session(
-                    time=datetime.now(time_zone) + timedelta(seconds=10), 
-                    session_number = session_number,
-                    session_name = session_row["session_name"])
-   
-    scheduler.start()
+        scheduler.start()
     print("Scheduling complete.")
+
+    # Quitting (see CSCWManager.quit) also closes the other tracks and the job store before the process exits
+    for manager in managers.values():
+        for other in managers.values():
+            if other is not manager:
+                manager.add_quit_callback(other.close)
+        if job_store is not None:
+            manager.add_quit_callback(job_store.close)
+
+    from bot import Bot
+    bot = Bot(bot_token, guild_id, test_mode = args.test, lean = args.lean_client) # Create the bot, shared by all tracks
+    data.refresh()
+    for manager in managers.values():
+        manager.bot = bot
+        manager.player.start()
+
+    if args.control_host not in ('127.0.0.1', 'localhost', '::1') and control_token is None:
+        print('Warning: the control server is reachable from other machines without a token. Set CONTROL_TOKEN in .env.')
+    control_server = ControlServer(managers, args.control_host, args.control_port, control_token)
+    await control_server.start()
                 
-    # Play filler video to start
-    manager.play_filler()
+    # Play filler video to start. It keeps looping in the background until the first session starts.
+    for manager in managers.values():
+        asyncio.create_task(manager.play_filler())
                 
     print('Starting Discord bot. Please keep this script running.')    
-    await manager.bot.start()
+    await bot.start()
 
            
         
    
 
 
-asyncio.run(main()) # Start the app
+# The guard is needed because the playback process imports this module when it is spawned.
+if __name__ == '__main__':
+    args = parse_args()
+    if args.simulate:
+        from simulation import run_simulation
+        sys.exit(1 if run_simulation(args) > 0 else 0)
+    else:
+        asyncio.run(main(args)) # Start the app
 
 
 
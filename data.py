@@ -1,4 +1,17 @@
+import os
+import sys
+import json
+import pickle
+import time
+from metrics import REGISTRY
+
+# pandas is only imported when a data file has to be read, so that loading the compiled snapshot (see ConferenceData) does not
+# need it.
+
+
 class SessionVideo:
+    __slots__ = ('session_number', 'video_path', 'play_order', 'paper')
+
     def __init__(self, session_number, video_path, play_order, paper = None):
         self.session_number = session_number
         self.video_path = video_path
@@ -15,6 +28,8 @@ class SessionVideo:
 
 
 class Paper :
+    __slots__ = ('title', 'id', 'cycle', 'talk_number', 'presenter')
+
     def __init__(self, title, id, cycle, talk_number, presenter = None): 
         self.title = title
         self.id = id
@@ -22,17 +37,17 @@ class Paper :
         self.talk_number = talk_number
         self.presenter = presenter
 
+    # Normalizes a cycle and paper id pair into the key used for paper lookups. Returns None if there is no cycle or the id is not a
+    # number. Cycles are interned, as there are only a few of them for thousands of papers.
     @staticmethod
-    def get_paper (papers, cycle, id):
-        for i, paper in papers.iterrows():
-            paper_cycle = paper["cycle"].lower()
-            paper_id = int(paper["paper_id"])
-            if paper_cycle == cycle.lower() and paper_id == int(id):
-                return Paper(title = paper["title"], 
-                cycle = paper_cycle, 
-                id = paper_id, 
-                talk_number = paper["talk_number"],
-                presenter = paper["presenter"])
+    def make_key(cycle, id):
+        cycle = str(cycle).strip().lower()
+        if cycle in ('', 'none', 'nan'): # Missing, or an empty cell read by pandas
+            return None
+        try:
+            return (sys.intern(cycle), int(float(id)))
+        except (TypeError, ValueError):
+            return None
 
     # Maps a URL cycle identifier (e.g., CSCW21d) to a cycle name used internally (e.g., July21)
     @staticmethod
@@ -49,4 +64,326 @@ class Paper :
             case 'cscw22b':
                 name = 'jan22'
         
-        return name
\ No newline at end of file
+        return name
+
+
+
+# Base class for lookup tables built from a data file. The table is only rebuilt when the file changes on disk. TABLES names the
+# attributes which hold the built tables, which are saved in the compiled snapshot (see ConferenceData).
+class FileIndex:
+    TABLES = ()
+
+    def __init__(self, path):
+        self.path = path
+        self.stamp = None
+        self.version = 0
+
+    def get_stamp(self):
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    # Rebuilds the table if the file was modified since it was last read. Returns True if the table was rebuilt.
+    def refresh(self):
+        stamp = self.get_stamp()
+        if stamp == self.stamp:
+            return False
+
+        started = time.perf_counter()
+        self.build()
+        REGISTRY.summary('data_reload_seconds', 'Time to read and index a data file').observe_since(started, file = os.path.basename(self.path))
+        self.stamp = stamp
+        self.version += 1
+        return True
+
+    def build(self):
+        raise NotImplementedError
+
+    # The built tables and the stamp of the file they were built from
+    def export(self):
+        return {'stamp': self.stamp, 'tables': {name: getattr(self, name) for name in self.TABLES}}
+
+    # Uses tables from export() instead of reading the file. Only call it if the file has not changed since (see is_current).
+    def restore(self, exported):
+        for name, value in exported['tables'].items():
+            setattr(self, name, value)
+        self.stamp = exported['stamp']
+        self.version += 1
+
+    def is_current(self, exported):
+        return exported['stamp'] is not None and exported['stamp'] == self.get_stamp()
+
+
+
+# Papers from papers.csv, indexed by normalized (cycle, paper_id).
+class PaperCatalog(FileIndex):
+    TABLES = ('papers',)
+
+    def __init__(self, papers_file):
+        super().__init__(papers_file)
+        self.papers = {}
+
+    def build(self):
+        import pandas as pd
+
+        papers_data = pd.read_csv(self.path).fillna('')
+        presenters = papers_data["presenter"] if "presenter" in papers_data.columns else [''] * len(papers_data)
+
+        papers = {}
+        for cycle, paper_id, title, talk_number, presenter in zip(papers_data["cycle"], 
+                papers_data["paper_id"], 
+                papers_data["title"], 
+                papers_data["talk_number"], 
+                presenters):
+            key = Paper.make_key(cycle, paper_id)
+
+            # Skip rows without a valid id. If a paper is listed twice, the first row is used.
+            if key is None or key in papers:
+                continue
+
+            papers[key] = Paper(title = title, 
+                cycle = key[0], 
+                id = key[1], 
+                talk_number = talk_number,
+                presenter = presenter)
+
+        self.papers = papers
+
+    def get_paper(self, cycle, id):
+        key = Paper.make_key(cycle, id)
+        return self.papers.get(key)
+
+
+
+# Formatted author credits (e.g., "A, B and C") from authors.csv, indexed by (internal cycle, id).
+class AuthorIndex(FileIndex):
+    TABLES = ('credits',)
+
+    def __init__(self, authors_file):
+        super().__init__(authors_file)
+        self.credits = {}
+
+    def build(self):
+        import pandas as pd
+
+        authors_data = pd.read_csv(self.path).fillna('')
+
+        # Author columns are numbered from author_1, in the order the authors should be credited.
+        columns = []
+        while "author_" + str(len(columns) + 1) in authors_data.columns:
+            columns.append("author_" + str(len(columns) + 1))
+
+        credits = {}
+        for cycle, id, *names in zip(authors_data["cycle"], authors_data["id"], *(authors_data[column] for column in columns)):
+            key = Paper.make_key(cycle, id)
+            if key is None or key in credits:
+                continue
+
+            credit = AuthorIndex.format_credit(names)
+            if credit is not None:
+                credits[key] = credit
+
+        self.credits = credits
+
+    # Joins author names as "A, B and C". Names are read up to the first empty (or too short) entry.
+    @staticmethod
+    def format_credit(names):
+        authors = []
+        for name in names:
+            name = str(name).strip()
+            if len(name) <= 2:
+                break
+            authors.append(name)
+
+        if len(authors) == 0:
+            return None
+        if len(authors) == 1:
+            return authors[0]
+
+        return ', '.join(authors[:-1]) + ' and ' + authors[-1]
+
+    # Gets the author credit for a paper. The paper cycle is mapped to the internal cycles used in the authors list. Cycles which
+    # are not mapped are looked up as they are, so papers of different unknown cycles do not share credits.
+    def get_credit(self, paper):
+        cycle = Paper.map_cycle(paper.cycle)
+        key = Paper.make_key(cycle if cycle is not None else paper.cycle, paper.id)
+        return self.credits.get(key)
+
+
+
+# Videos from playlist.csv, grouped by track and session number into SessionVideo lists sorted by play order. The track column
+# is optional, and defaults to track 1. Session videos hold Paper objects, so the playlist is also rebuilt when the paper catalog
+# is reloaded.
+class PlaylistStore(FileIndex):
+    TABLES = ('sessions',)
+
+    def __init__(self, playlist_file, papers, media_path):
+        super().__init__(playlist_file)
+        self.papers = papers
+        self.media_path = media_path
+        self.papers_version = None
+        self.sessions = {}
+
+    def refresh(self):
+        self.papers.refresh()
+        if self.papers_version != self.papers.version:
+            self.stamp = None
+
+        return super().refresh()
+
+    # The session videos hold the restored papers, so the paper catalog must be restored first
+    def restore(self, exported):
+        super().restore(exported)
+        self.papers_version = self.papers.version
+
+    def build(self):
+        import pandas as pd
+
+        playlist_data = pd.read_csv(self.path).fillna('')
+        tracks = playlist_data["track"] if "track" in playlist_data.columns else [1] * len(playlist_data)
+
+        sessions = {}
+        for session_number, file_name, is_paper, paper_id, cycle, play_order, track in zip(playlist_data["session_number"], 
+                playlist_data["file_name"], 
+                playlist_data["is_paper"], 
+                playlist_data["paper_id"], 
+                playlist_data["cycle"], 
+                playlist_data["play_order"],
+                tracks):
+            try:
+                session_number = int(session_number)
+                play_order = int(play_order)
+                track = int(track) if track != '' else 1
+            except ValueError:
+                print('Ignoring playlist entry with invalid session number, play order or track for file ' + str(file_name))
+                continue
+
+            # If this is a paper, get the info for the paper
+            paper = self.papers.get_paper(cycle = cycle, id = paper_id) if is_paper else None
+
+            sessions.setdefault((track, session_number), []).append(SessionVideo(session_number = session_number, 
+                video_path = os.path.join(self.media_path, file_name), 
+                play_order = play_order,
+                paper = paper))
+
+        # Ensure that videos are sorted by play order
+        for session_videos in sessions.values():
+            session_videos.sort(key=SessionVideo.sort_video)
+
+        self.sessions = sessions
+        self.papers_version = self.papers.version
+
+    # Gets the videos for a session of a track in play order. Call refresh() first to pick up changes to the playlist file.
+    def get_session(self, session_number, track = 1):
+        return list(self.sessions.get((int(track), int(session_number)), []))
+
+
+
+class MediaInfo:
+    __slots__ = ('duration', 'video_codec', 'audio_codec', 'fast_start', 'problems')
+
+    def __init__(self, duration = None, video_codec = None, audio_codec = None, fast_start = None, problems = None):
+        self.duration = duration # Seconds
+        self.video_codec = video_codec
+        self.audio_codec = audio_codec
+        self.fast_start = fast_start # Whether the MP4 index comes before the media data
+        self.problems = problems if problems is not None else []
+
+
+
+# Duration and integrity of each video, by file name, from the index written by scripts/media_preflight.py. The index is optional.
+class MediaIndex(FileIndex):
+    TABLES = ('media',)
+
+    def __init__(self, index_file):
+        super().__init__(index_file)
+        self.media = {}
+
+    def refresh(self):
+        if not os.path.isfile(self.path):
+            return False
+
+        return super().refresh()
+
+    def is_current(self, exported):
+        if not os.path.isfile(self.path):
+            return exported['stamp'] is None
+        return super().is_current(exported)
+
+    def build(self):
+        with open(self.path, 'r') as openfile:
+            files = json.load(openfile)['files']
+
+        self.media = {name: MediaInfo(entry['duration'], entry['video_codec'], entry['audio_codec'], entry['fast_start'], entry['problems'])
+            for name, entry in files.items()}
+
+    # Gets the info for a video, or None if it is not in the index.
+    def get_info(self, video_path):
+        return self.media.get(os.path.basename(video_path))
+
+
+
+# The data files used to run the sessions, shared by the managers of all tracks: papers, authors, playlist and the optional
+# media index. Each file is only read again when it changed.
+# The built tables can be compiled into a snapshot file (see scripts/compile_data.py), which is loaded with a single unpickle
+# instead of parsing the CSV files with pandas. The snapshot is only used if none of the files changed since it was written, and
+# only on the first refresh. Pickle keeps shared objects shared, so each paper and interned cycle is stored and loaded once. The
+# snapshot is a local file written by this code, and must not be taken from anywhere else.
+class ConferenceData:
+    SNAPSHOT_VERSION = 2 # Changed whenever the tables or their keys change
+
+    def __init__(self, playlist_file, papers_file, authors_file, media_path, media_index_file = None, snapshot_file = None):
+        self.media_path = media_path
+        self.snapshot_file = snapshot_file
+        self.papers = PaperCatalog(papers_file)
+        self.authors = AuthorIndex(authors_file)
+        self.playlist = PlaylistStore(playlist_file, self.papers, media_path)
+        self.media = MediaIndex(media_index_file) if media_index_file is not None else None
+
+    # Indexes in the order they are restored, by name
+    def get_indexes(self):
+        indexes = {'papers': self.papers, 'authors': self.authors, 'playlist': self.playlist}
+        if self.media is not None:
+            indexes['media'] = self.media
+        return indexes
+
+    # Writes the snapshot of the current tables. Call refresh() first.
+    def save_snapshot(self, snapshot_file):
+        snapshot = {'version': ConferenceData.SNAPSHOT_VERSION, 'media_path': self.media_path,
+            'indexes': {name: index.export() for name, index in self.get_indexes().items()}}
+        temp_file = snapshot_file + '.tmp'
+        with open(temp_file, 'wb') as outfile:
+            pickle.dump(snapshot, outfile, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, snapshot_file)
+
+    # Restores the tables from the snapshot if it is current. Returns True if it was used.
+    def load_snapshot(self):
+        started = time.perf_counter()
+        try:
+            with open(self.snapshot_file, 'rb') as infile:
+                snapshot = pickle.load(infile)
+        except FileNotFoundError:
+            return False
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as ex:
+            print('Could not read the data snapshot ' + self.snapshot_file + ': ' + str(ex))
+            return False
+
+        indexes = self.get_indexes()
+        if snapshot.get('version') != ConferenceData.SNAPSHOT_VERSION or snapshot.get('media_path') != self.media_path \
+                or any(name not in snapshot['indexes'] or not index.is_current(snapshot['indexes'][name]) for name, index in indexes.items()):
+            print('Data snapshot ' + self.snapshot_file + ' is out of date. Reading the data files instead.')
+            return False
+
+        for name, index in indexes.items():
+            index.restore(snapshot['indexes'][name])
+        REGISTRY.summary('data_reload_seconds', 'Time to read and index a data file').observe_since(started, file = os.path.basename(self.snapshot_file))
+        print('Loaded the conference data from ' + self.snapshot_file)
+        return True
+
+    def refresh(self):
+        if self.snapshot_file is not None and self.papers.stamp is None:
+            self.load_snapshot()
+
+        self.authors.refresh()
+        self.playlist.refresh() # Also reloads the papers if they changed
+        if self.media is not None:
+            self.media.refresh()
@@ -0,0 +1,277 @@
+import asyncio, itertools
+import discord
+
+
+# In-process stand-ins for the playback process and for Discord, for the benchmarks (see scripts/benchmark.py) and for running
+# the manager without VLC or a Discord connection.
+
+
+# Same interface as PlaybackClient, but plays nothing: each video "plays" for its duration, as given by get_duration (in
+# seconds, 0 by default), and the same events are reported on the event loop. Time is the event loop's, so videos play on
+# virtual time in a simulation (see simulation.py). Pausing is recorded but does not hold up the videos.
+class FakePlayer:
+    def __init__(self, get_duration = None, progress_interval = None):
+        self.get_duration = get_duration if get_duration is not None else (lambda video: 0)
+        self.progress_interval = progress_interval # Seconds between progress events, or None for none
+
+        self.next_id = 0
+        self.playback_id = None
+        self.finished = None
+        self.task = None
+        self.waiter = None # Future which the current video waits on
+        self.command = None # Command which interrupted the current video: ('skip',) or ('jump', index)
+        self.last_index = None # Set by finish_current
+        self.progress_callbacks = []
+        self.frame_callbacks = []
+        self.item_callbacks = []
+
+        self.videos = None
+        self.index = None
+        self.started = None # Clock time at which the current video started, less the start position
+        self.paused = False
+
+        # Everything the player was asked to do, for checking afterwards
+        self.played = [] # (videos, start_index, position) of each playlist
+        self.preloaded = []
+        self.commands = []
+
+    def start(self):
+        pass
+
+    def close(self):
+        self.finish(self.playback_id, 'stopped')
+
+    def add_progress_callback(self, callback):
+        self.progress_callbacks.append(callback)
+
+    def add_frame_callback(self, callback):
+        self.frame_callbacks.append(callback)
+
+    def add_item_callback(self, callback):
+        self.item_callbacks.append(callback)
+
+    @staticmethod
+    def emit(callbacks, event):
+        for callback in list(callbacks):
+            callback(event)
+
+    def play_playlist(self, videos, start_index = 0, repeat = False, position = 0):
+        self.next_id += 1
+        self.finish(self.playback_id, 'stopped')
+        self.playback_id = self.next_id
+        self.finished = asyncio.get_running_loop().create_future()
+        self.last_index = None
+        self.paused = False
+        self.played.append((list(videos), start_index, position))
+        self.task = asyncio.create_task(self.run(self.playback_id, list(videos), start_index, repeat, position))
+
+    def play_video(self, video, repeat = False):
+        self.play_playlist([video], repeat = repeat)
+
+    def preload(self, videos):
+        self.preloaded.append(list(videos))
+
+    async def wait_finished(self):
+        if self.finished is None:
+            return None
+        return await asyncio.shield(self.finished)
+
+    def is_playing(self):
+        return self.playback_id is not None
+
+    def finish(self, playback_id, reason):
+        if playback_id is None or playback_id != self.playback_id:
+            return
+
+        self.playback_id = None
+        self.videos = None
+        self.index = None
+        FakePlayer.wake(self.waiter, False)
+        if not self.finished.done():
+            self.finished.set_result(reason)
+
+    def interrupt(self, command):
+        self.commands.append(command)
+        if self.playback_id is not None:
+            self.command = command
+            FakePlayer.wake(self.waiter, False)
+
+    # Ends the current playlist as if the playback process had crashed, and the PlaybackClient had restarted it
+    def crash(self):
+        self.commands.append(('crash',))
+        self.finish(self.playback_id, 'crashed')
+
+    def stop(self):
+        self.commands.append(('stop',))
+        self.finish(self.playback_id, 'stopped')
+
+    def skip(self):
+        self.interrupt(('skip',))
+
+    def jump(self, index):
+        self.interrupt(('jump', index))
+
+    def pause(self):
+        self.commands.append(('pause',))
+        self.paused = self.playback_id is not None
+
+    def resume(self):
+        self.commands.append(('resume',))
+        self.paused = False
+
+    def finish_current(self):
+        self.commands.append(('finish',))
+        self.last_index = self.index
+
+    def fade_out(self, seconds):
+        self.commands.append(('fade', seconds))
+
+    def get_time(self):
+        if self.started is None or self.playback_id is None:
+            return 0
+        return int((asyncio.get_running_loop().time() - self.started) * 1000)
+
+    async def status(self):
+        playing = self.playback_id is not None
+        return {
+            'state': 'playing' if playing else 'idle',
+            'id': self.playback_id,
+            'index': self.index,
+            'video': self.videos[self.index] if playing and self.index is not None else None,
+            'paused': self.paused,
+            'time': self.get_time(),
+            'length': int(self.get_duration(self.videos[self.index]) * 1000) if playing and self.index is not None else 0
+        }
+
+    # Waits for the given number of seconds, or until a command interrupts the video. Returns False if interrupted.
+    async def wait(self, seconds):
+        loop = asyncio.get_running_loop()
+        self.waiter = loop.create_future()
+        timer = loop.call_later(seconds, FakePlayer.wake, self.waiter, True)
+        try:
+            return await self.waiter
+        finally:
+            timer.cancel()
+
+    @staticmethod
+    def wake(waiter, result):
+        if waiter is not None and not waiter.done():
+            waiter.set_result(result)
+
+    # Plays a video from the position (in ms) to its end, reporting progress on the way. Returns False if interrupted.
+    async def play_item(self, playback_id, video, position):
+        length = self.get_duration(video)
+        self.started = asyncio.get_running_loop().time() - position / 1000
+        remaining = max(0, length - position / 1000)
+
+        while True:
+            if self.command is not None or self.playback_id != playback_id:
+                return False
+            step = remaining if self.progress_interval is None else min(self.progress_interval, remaining)
+            if not await self.wait(step):
+                return False
+            remaining -= step
+            if remaining <= 0:
+                return True
+            FakePlayer.emit(self.progress_callbacks, {'id': playback_id, 'index': self.index, 'video': video, 'time': self.get_time(), 'length': int(length * 1000)})
+
+    async def run(self, playback_id, videos, index, repeat, position):
+        self.videos = videos
+        frame_sent = False
+        while True:
+            if index >= len(videos):
+                if not repeat:
+                    self.finish(playback_id, 'ended')
+                    return
+                index = 0
+
+            self.index = index
+            self.command = None
+            FakePlayer.emit(self.item_callbacks, {'id': playback_id, 'index': index, 'video': videos[index]})
+            if not frame_sent:
+                frame_sent = True
+                FakePlayer.emit(self.frame_callbacks, {'id': playback_id, 'video': videos[index]})
+
+            completed = await self.play_item(playback_id, videos[index], position)
+            position = 0
+            if self.playback_id != playback_id:
+                return
+
+            command = self.command
+            if completed or command is None:
+                if self.last_index is not None and index >= self.last_index:
+                    self.finish(playback_id, 'ended')
+                    return
+                index += 1
+            elif command[0] == 'skip':
+                if repeat or index + 1 >= len(videos):
+                    self.finish(playback_id, 'skipped')
+                    return
+                index += 1
+            elif command[0] == 'jump':
+                if 0 <= command[1] < len(videos):
+                    index = command[1]
+
+
+# Text channel that records the messages sent to it and their event loop times, optionally taking send_latency seconds for each send.
+class FakeChannel:
+    def __init__(self, id, name, guild, send_latency = 0):
+        self.id = id
+        self.name = name
+        self.guild = guild
+        self.type = discord.ChannelType.text
+        self.send_latency = send_latency
+        self.sent = []
+        self.sent_at = []
+
+    async def send(self, content):
+        if self.send_latency > 0:
+            await asyncio.sleep(self.send_latency)
+        self.sent.append(content)
+        self.sent_at.append(asyncio.get_running_loop().time())
+
+
+class FakeGuild:
+    def __init__(self, id):
+        self.id = id
+        self.text_channels = []
+
+
+# Same interface as the parts of discord.Client used by Bot. start() reports the client as ready straight away, with the
+# guilds and channels added beforehand, and then waits like the real client.
+class FakeDiscordClient:
+    def __init__(self, send_latency = 0):
+        self.guilds = []
+        self.send_latency = send_latency
+        self.handlers = {}
+        self.channels = {}
+        self.ids = itertools.count(1000)
+
+    def event(self, coro):
+        self.handlers[coro.__name__] = coro
+        return coro
+
+    def add_guild(self, guild_id, channel_names = ()):
+        guild = FakeGuild(int(guild_id))
+        self.guilds.append(guild)
+        for name in channel_names:
+            self.add_channel(guild, name)
+        return guild
+
+    def add_channel(self, guild, name):
+        channel = FakeChannel(next(self.ids), name, guild, self.send_latency)
+        guild.text_channels.append(channel)
+        self.channels[channel.id] = channel
+        return channel
+
+    def get_channel(self, id):
+        return self.channels.get(id)
+
+    # Messages sent to all channels
+    def get_sent(self):
+        return [(channel.name, content) for channel in self.channels.values() for content in channel.sent]
+
+    async def start(self, token):
+        if 'on_ready' in self.handlers:
+            await self.handlers['on_ready']()
+        await asyncio.Event().wait()
@@ -0,0 +1,81 @@
+import os
+import sqlite3
+from datetime import datetime
+
+
+class StoredJob:
+    __slots__ = ('id', 'session_number', 'session_name', 'run_time', 'done', 'track')
+
+    def __init__(self, id, session_number, session_name, run_time, done = False, track = 1):
+        self.id = id
+        self.session_number = session_number
+        self.session_name = session_name
+        self.run_time = run_time
+        self.done = done
+        self.track = track
+
+
+# Keeps the scheduled session broadcasts in a local SQLite file, so that a restart loads the jobs instead of recomputing them from
+# sessions.csv, and knows which sessions already started. Jobs are identified by the same ids as the scheduler's jobs. The jobs of
+# all tracks are kept in the same store.
+class SessionJobStore:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread = False) # Closed from the hotkey listener thread when quitting
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, session_number INTEGER, session_name TEXT, '
+                'run_time TEXT, done INTEGER DEFAULT 0, track INTEGER DEFAULT 1)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+            # Stores created before tracks were added only have jobs on track 1
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(jobs)')]
+            if 'track' not in columns:
+                self.connection.execute('ALTER TABLE jobs ADD COLUMN track INTEGER DEFAULT 1')
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def get_stamp(sessions_file):
+        stat = os.stat(sessions_file)
+        return str(stat.st_mtime_ns) + ':' + str(stat.st_size)
+
+    # Checks whether the jobs were built from the current version of the sessions file.
+    def is_current(self, sessions_file):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'sessions_stamp'").fetchone()
+        return row is not None and row[0] == SessionJobStore.get_stamp(sessions_file)
+
+    # Jobs of the given track, or of all tracks if track is None, in order of run time
+    def load_jobs(self, track = None):
+        query = 'SELECT id, session_number, session_name, run_time, done, track FROM jobs'
+        if track is None:
+            rows = self.connection.execute(query + ' ORDER BY run_time')
+        else:
+            rows = self.connection.execute(query + ' WHERE track = ? ORDER BY run_time', (int(track),))
+        return [StoredJob(id, session_number, session_name, datetime.fromisoformat(run_time), bool(done), track)
+            for id, session_number, session_name, run_time, done, track in rows]
+
+    def get_tracks(self):
+        return [row[0] for row in self.connection.execute('SELECT DISTINCT track FROM jobs ORDER BY track')]
+
+    # Replaces the stored jobs with the given ones, built from the sessions file. Only the differences are written, so jobs which
+    # did not change keep their state. Returns the number of jobs added and removed.
+    def apply(self, jobs, sessions_file):
+        stored_ids = set(row[0] for row in self.connection.execute('SELECT id FROM jobs'))
+        new_jobs = {job.id: job for job in jobs}
+
+        added = [job for job_id, job in new_jobs.items() if job_id not in stored_ids]
+        removed = [job_id for job_id in stored_ids if job_id not in new_jobs]
+
+        with self.connection:
+            self.connection.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in removed])
+            self.connection.executemany('INSERT INTO jobs (id, session_number, session_name, run_time, done, track) VALUES (?, ?, ?, ?, ?, ?)',
+                [(job.id, job.session_number, job.session_name, job.run_time.isoformat(), int(job.done), job.track) for job in added])
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sessions_stamp', ?)", (SessionJobStore.get_stamp(sessions_file),))
+
+        return len(added), len(removed)
+
+    # Records that the job has run (or will not be run), so that it is not started again after a restart.
+    def mark_done(self, job_ids):
+        with self.connection:
+            self.connection.executemany('UPDATE jobs SET done = 1 WHERE id = ?', [(job_id,) for job_id in job_ids])
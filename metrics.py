@@ -0,0 +1,173 @@
+import json, math, threading, time
+from collections import deque
+from datetime import datetime, timezone
+
+
+# Counters, gauges and timing summaries for the broadcast pipeline, exposed in the Prometheus text format (see
+# MetricsRegistry.render, served at /metrics by the control server). Timings can also be appended to a JSON-lines file, one line
+# per observation, for analysis after the conference. Metrics are created on first use:
+#   REGISTRY.counter('name', 'help').inc(reason = 'error')
+#   REGISTRY.summary('name_seconds', 'help').observe(0.25)
+class Metric:
+    TYPE = None
+
+    def __init__(self, registry, name, help):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.values = {} # By label tuple
+
+    @staticmethod
+    def get_key(labels):
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    @staticmethod
+    def format_labels(key, extra = ()):
+        pairs = list(key) + list(extra)
+        if len(pairs) == 0:
+            return ''
+        return '{' + ','.join(name + '="' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"' for name, value in pairs) + '}'
+
+    @staticmethod
+    def format_value(value):
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(float(value))
+
+    # Copies the values, as they can be updated from other threads while rendering
+    def snapshot(self):
+        with self.registry.lock:
+            return list(self.values.items())
+
+    def render(self, lines):
+        lines.append('# HELP ' + self.name + ' ' + self.help)
+        lines.append('# TYPE ' + self.name + ' ' + self.TYPE)
+        for key, value in self.snapshot():
+            lines.append(self.name + Metric.format_labels(key) + ' ' + Metric.format_value(value))
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount = 1, **labels):
+        key = Metric.get_key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+# A gauge is either set, or read from a function for each set of labels each time the metrics are rendered.
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def __init__(self, registry, name, help):
+        super().__init__(registry, name, help)
+        self.functions = {} # By label tuple
+
+    def set(self, value, **labels):
+        with self.registry.lock:
+            self.values[Metric.get_key(labels)] = value
+
+    # A function added again with the same labels (e.g., after a restart) replaces the previous one.
+    def add_function(self, function, **labels):
+        with self.registry.lock:
+            self.functions[Metric.get_key(labels)] = function
+
+    def render(self, lines):
+        with self.registry.lock:
+            functions = list(self.functions.items())
+        for key, function in functions:
+            value = function()
+            with self.registry.lock:
+                self.values[key] = value
+        super().render(lines)
+
+
+# Count and sum of all observations, and quantiles over the last WINDOW observations.
+class Summary(Metric):
+    TYPE = 'summary'
+    WINDOW = 500
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def observe(self, value, **labels):
+        key = Metric.get_key(labels)
+        with self.registry.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [0, 0.0, deque(maxlen=Summary.WINDOW)]
+            entry[0] += 1
+            entry[1] += value
+            entry[2].append(value)
+        self.registry.log(self.name, value, labels)
+
+    # Returns the time since started (a time.perf_counter() value), and observes it.
+    def observe_since(self, started, **labels):
+        elapsed = time.perf_counter() - started
+        self.observe(elapsed, **labels)
+        return elapsed
+
+    def render(self, lines):
+        lines.append('# HELP ' + self.name + ' ' + self.help)
+        lines.append('# TYPE ' + self.name + ' summary')
+        with self.registry.lock:
+            values = [(key, count, total, sorted(window)) for key, (count, total, window) in self.values.items()]
+
+        for key, count, total, recent in values:
+            for quantile in Summary.QUANTILES:
+                value = recent[min(len(recent) - 1, int(quantile * len(recent)))] if len(recent) > 0 else float('nan')
+                lines.append(self.name + Metric.format_labels(key, [('quantile', str(quantile))]) + ' ' + Metric.format_value(value))
+            lines.append(self.name + '_sum' + Metric.format_labels(key) + ' ' + Metric.format_value(total))
+            lines.append(self.name + '_count' + Metric.format_labels(key) + ' ' + str(count))
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.log_file = None
+
+    def get(self, metric_class, name, help, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = metric_class(self, name, help, **kwargs)
+        return metric
+
+    def counter(self, name, help):
+        return self.get(Counter, name, help)
+
+    # Gauges which are read from a function can have one function for each set of labels, such as one for each track.
+    def gauge(self, name, help, function = None, **labels):
+        gauge = self.get(Gauge, name, help)
+        if function is not None:
+            gauge.add_function(function, **labels)
+        return gauge
+
+    def summary(self, name, help):
+        return self.get(Summary, name, help)
+
+    # Appends every timing observation to the file as a JSON line: {"time", "metric", "value", "labels"}.
+    def open_log(self, path):
+        self.log_file = open(path, 'a', buffering=1, encoding='utf-8')
+
+    def log(self, name, value, labels):
+        if self.log_file is None:
+            return
+
+        line = json.dumps({'time': datetime.now(timezone.utc).isoformat(), 'metric': name, 'value': value, 'labels': labels})
+        with self.lock:
+            self.log_file.write(line + '\n')
+
+    # Renders all metrics in the Prometheus text exposition format.
+    def render(self):
+        lines = []
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            metric.render(lines)
+        return '\n'.join(lines) + '\n'
+
+
+# Registry used throughout the bot process
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,356 @@
+import asyncio, multiprocessing, threading
+from metrics import REGISTRY
+
+
+# Runs in the playback process. Owns the VLC player and executes commands received from the bot process over a pipe.
+# Commands are dicts with a 'command' key (play, preload, stop, skip, jump, pause, resume, finish, fade, status, exit). Events sent back are dicts with an 'event' key:
+#   item:     a video of the playlist with the given playback id started playing
+#   frame:    the first frame of the playlist with the given playback id is being displayed
+#   finished: the playlist with the given playback id stopped playing ('ended', 'error', 'stopped' or 'skipped')
+#   progress: media time of the current video, sent every PROGRESS_INTERVAL seconds while playing
+#   status:   reply to a status command
+#   metric:   a timing or count measured by the player, recorded in the bot process's metrics registry
+class PlaybackWorker:
+    PROGRESS_INTERVAL = 1
+
+    def __init__(self, conn, test_mode = False):
+        from player import VLCPlayer # Only the playback process loads libvlc
+
+        self.conn = conn
+        self.send_lock = threading.Lock() # Events are also sent from libvlc's event thread
+        self.player = VLCPlayer(test_mode)
+        self.playback_id = None
+        self.video = None
+        self.index = None
+        self.repeat = False
+        self.stop_reason = None
+        self.frame_sent = False
+        self.player.add_finish_callback(self.on_finish)
+        self.player.add_frame_callback(self.on_frame)
+        self.player.add_item_callback(self.on_item)
+        self.player.add_metric_callback(self.on_metric)
+
+    def send(self, event, **fields):
+        fields['event'] = event
+        with self.send_lock:
+            self.conn.send(fields)
+
+    def on_item(self, index, video):
+        if self.playback_id is None:
+            return
+
+        self.index = index
+        self.video = video
+        self.send('item', id = self.playback_id, index = index, video = video)
+
+    def on_metric(self, kind, name, help, value):
+        self.send('metric', kind = kind, name = name, help = help, value = value)
+
+    def on_frame(self):
+        if self.playback_id is None or self.frame_sent:
+            return
+
+        self.frame_sent = True
+        self.send('frame', id = self.playback_id, video = self.video)
+
+    def on_finish(self, reason):
+        if self.playback_id is None:
+            return
+
+        playback_id, video, index = self.playback_id, self.video, self.index
+        self.playback_id = None
+        self.video = None
+        self.index = None
+        self.send('finished', id = playback_id, index = index, video = video, reason = self.stop_reason or reason)
+
+    def stop(self, reason):
+        if self.playback_id is not None:
+            self.stop_reason = reason
+            self.player.stop()
+
+    def get_status(self):
+        playing = self.playback_id is not None
+        return {
+            'state': 'playing' if playing else 'idle',
+            'id': self.playback_id,
+            'index': self.index,
+            'video': self.video,
+            'paused': self.player.paused if playing else False,
+            'time': self.player.get_time() if playing else 0,
+            'length': self.player.get_length() if playing else 0
+        }
+
+    def handle(self, message):
+        command = message['command']
+
+        if command == 'play':
+            self.stop('stopped') # Report the previous video as finished before starting the next one
+            self.stop_reason = None
+            self.frame_sent = False
+            self.playback_id = message['id']
+            self.repeat = message['repeat']
+            self.player.play_playlist(message['videos'], message['start'], message['repeat'], message['position'])
+        elif command == 'preload':
+            self.player.preload(message['videos'])
+        elif command == 'stop':
+            self.stop('stopped')
+        elif command == 'skip':
+            # Skip to the next video. Skipping a looping video or the last video of a playlist ends the playlist.
+            if self.playback_id is not None and (self.repeat or not self.player.next()):
+                self.stop('skipped')
+        elif command == 'jump':
+            if self.playback_id is not None and not self.player.jump(message['index']):
+                print('Cannot jump to video ' + str(message['index']) + ' of the playlist')
+        elif command == 'pause':
+            if self.playback_id is not None:
+                self.player.pause()
+        elif command == 'resume':
+            if self.playback_id is not None:
+                self.player.resume()
+        elif command == 'finish':
+            # End the playlist after the current video
+            if self.playback_id is not None:
+                self.player.finish_current()
+        elif command == 'fade':
+            # Fade out in the background, so that commands are still handled while fading
+            if self.playback_id is not None:
+                threading.Thread(target = self.player.fade_out, args = (message['seconds'],), daemon = True).start()
+        elif command == 'status':
+            status = self.get_status()
+            self.send('status', request = message['request'], **status)
+        else:
+            print('Playback process received unknown command ' + str(command))
+
+    def run(self):
+        while True:
+            # Wait for the next command. Report progress whenever the wait times out while a video is playing.
+            if self.conn.poll(PlaybackWorker.PROGRESS_INTERVAL):
+                message = self.conn.recv()
+                if message['command'] == 'exit':
+                    break
+                self.handle(message)
+            elif self.playback_id is not None:
+                self.send('progress', id = self.playback_id, index = self.index, video = self.video, time = self.player.get_time(), length = self.player.get_length())
+
+        self.stop('stopped')
+
+
+def run_worker(conn, test_mode = False):
+    try:
+        PlaybackWorker(conn, test_mode).run()
+    except (EOFError, OSError, KeyboardInterrupt):
+        pass # The bot process went away
+
+
+
+# Drives a PlaybackWorker running in a child process, so that video playback never blocks the bot's event loop.
+# The child process is restarted automatically if it exits unexpectedly; the playlist that was playing finishes as 'crashed'.
+class PlaybackClient:
+    STATUS_TIMEOUT = 2
+
+    def __init__(self, test_mode = False):
+        self.test_mode = test_mode
+        self.loop = None
+        self.process = None
+        self.conn = None
+        self.send_lock = threading.Lock() # Commands can be sent from the keyboard listener thread (see --hotkeys)
+        self.closing = False
+
+        self.next_id = 0
+        self.playback_id = None
+        self.finished = None
+        self.status_requests = {}
+        self.progress_callbacks = []
+        self.frame_callbacks = []
+        self.item_callbacks = []
+        self.last_progress = None
+
+    # Starts the playback process. Must be called from the event loop that waits for playback.
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.spawn()
+
+    def spawn(self):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target = run_worker, args = (child_conn, self.test_mode), name = 'playback', daemon = True)
+        self.process.start()
+        child_conn.close() # Only the child holds its end, so the pipe reports EOF as soon as the child exits
+        self.conn = parent_conn
+
+        reader = threading.Thread(target = self.read_events, args = (parent_conn,), name = 'playback-events', daemon = True)
+        reader.start()
+        print('Started playback process with pid ' + str(self.process.pid))
+
+    def close(self):
+        self.closing = True
+        if self.process is None:
+            return
+        self.send({'command': 'exit'})
+        self.process.join(5)
+
+    # Commands sent before the playback process is started, or while it is being restarted after a crash, are dropped. A playlist
+    # that was playing when the process crashed is reported as finished ('crashed') once the restart begins. Returns whether the
+    # command was sent.
+    def send(self, message):
+        with self.send_lock:
+            if self.conn is None or self.conn.closed:
+                print('Playback process is not running. Dropped command: ' + message['command'])
+                return False
+            try:
+                self.conn.send(message)
+            except (OSError, ValueError) as ex:
+                print('Could not send command to the playback process: ' + message['command'] + '. Reason: ' + str(ex))
+                return False
+        return True
+
+    # Receives events from the playback process on a background thread and hands them to the event loop.
+    def read_events(self, conn):
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            self.loop.call_soon_threadsafe(self.handle_event, message)
+
+        self.loop.call_soon_threadsafe(self.on_worker_exit, conn)
+
+    def on_worker_exit(self, conn):
+        if self.closing or conn is not self.conn:
+            return
+
+        self.process.join(1)
+        print('Playback process exited unexpectedly with code ' + str(self.process.exitcode) + '. Restarting it.')
+        conn.close()
+
+        REGISTRY.counter('playback_process_restarts_total', 'Restarts of the playback process after it exited unexpectedly').inc()
+        self.finish(self.playback_id, 'crashed')
+        for future in self.status_requests.values():
+            if not future.done():
+                future.set_result(None)
+        self.status_requests.clear()
+
+        self.spawn()
+
+    def handle_event(self, message):
+        event = message['event']
+
+        if event == 'item':
+            if message['id'] != self.playback_id:
+                return
+            for callback in list(self.item_callbacks):
+                callback(message)
+        elif event == 'frame':
+            if message['id'] != self.playback_id:
+                return
+            for callback in list(self.frame_callbacks):
+                callback(message)
+        elif event == 'finished':
+            self.finish(message['id'], message['reason'])
+        elif event == 'progress':
+            if message['id'] != self.playback_id:
+                return
+            self.last_progress = message
+            for callback in list(self.progress_callbacks):
+                callback(message)
+        elif event == 'metric':
+            if message['kind'] == 'counter':
+                REGISTRY.counter(message['name'], message['help']).inc(message['value'])
+            else:
+                REGISTRY.summary(message['name'], message['help']).observe(message['value'])
+        elif event == 'status':
+            future = self.status_requests.pop(message['request'], None)
+            if future is not None and not future.done():
+                future.set_result(message)
+
+    def finish(self, playback_id, reason):
+        if playback_id is None or playback_id != self.playback_id:
+            return
+
+        self.playback_id = None
+        self.last_progress = None
+        if not self.finished.done():
+            self.finished.set_result(reason)
+
+    # Registers a function which is called on the event loop with each progress event ({'index', 'video', 'time', 'length'}).
+    def add_progress_callback(self, callback):
+        self.progress_callbacks.append(callback)
+
+    # Registers a function which is called on the event loop when the first frame of a playlist is displayed ({'video'}).
+    def add_frame_callback(self, callback):
+        self.frame_callbacks.append(callback)
+
+    # Registers a function which is called on the event loop as each video of a playlist starts playing ({'index', 'video'}).
+    def add_item_callback(self, callback):
+        self.item_callbacks.append(callback)
+
+    # Plays the videos back to back, starting at start_index and position (in ms) within that video. The playlist repeats until
+    # stopped or skipped if repeat is set.
+    def play_playlist(self, videos, start_index = 0, repeat = False, position = 0):
+        if self.process is None:
+            self.start()
+
+        self.next_id += 1
+        self.finish(self.playback_id, 'stopped')
+        self.playback_id = self.next_id
+        self.finished = self.loop.create_future()
+        self.send({'command': 'play', 'id': self.playback_id, 'videos': list(videos), 'start': start_index, 'repeat': repeat, 'position': position})
+
+    def play_video(self, video, repeat = False):
+        self.play_playlist([video], repeat = repeat)
+
+    # Asks the playback process to open the given videos ahead of time, so that they start quickly when played.
+    def preload(self, videos):
+        if self.process is None:
+            self.start()
+
+        self.send({'command': 'preload', 'videos': list(videos)})
+
+    # Waits until the current playlist stops playing. Returns the reason: 'ended', 'error', 'stopped', 'skipped' or 'crashed'.
+    async def wait_finished(self):
+        if self.finished is None:
+            return None
+        return await asyncio.shield(self.finished)
+
+    def is_playing(self):
+        return self.playback_id is not None
+
+    def stop(self):
+        self.send({'command': 'stop'})
+
+    def skip(self):
+        self.send({'command': 'skip'})
+
+    # Plays the video at the given index of the current playlist.
+    def jump(self, index):
+        self.send({'command': 'jump', 'index': index})
+
+    def pause(self):
+        self.send({'command': 'pause'})
+
+    def resume(self):
+        self.send({'command': 'resume'})
+
+    # Ends the current playlist once the video that is playing has finished.
+    def finish_current(self):
+        self.send({'command': 'finish'})
+
+    # Fades the audio out over the given number of seconds. Playback continues until stopped.
+    def fade_out(self, seconds):
+        self.send({'command': 'fade', 'seconds': seconds})
+
+    # Asks the playback process what it is doing. Returns None if it does not answer in time.
+    async def status(self):
+        if self.process is None:
+            return None
+
+        self.next_id += 1
+        request = self.next_id
+        future = self.loop.create_future()
+        self.status_requests[request] = future
+        self.send({'command': 'status', 'request': request})
+
+        try:
+            return await asyncio.wait_for(future, PlaybackClient.STATUS_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.status_requests.pop(request, None)
+            return None
@@ -1,41 +1,299 @@
-import vlc, time
+import asyncio, threading, time
+import vlc
 
 class VLCPlayer:
+    VOLUME = 100
+    FADE_STEPS = 20
+    # libvlc events which mean that the current media is no longer playing, and the reason reported for each.
+    END_EVENTS = {
+        vlc.EventType.MediaPlayerEndReached: 'ended',
+        vlc.EventType.MediaPlayerEncounteredError: 'error',
+        vlc.EventType.MediaPlayerStopped: 'stopped'
+    }
 
     def __init__(self, test_mode = False):
-        self.vlc_instance = vlc.Instance('--input-repeat=-1', '--mouse-hide-timeout=0', '--freetype-font=Verdana', '--freetype-rel-fontsize=22', '--verbose=0', '--log-verbose=1')
+        self.vlc_instance = vlc.Instance('--mouse-hide-timeout=0', '--freetype-font=Verdana', '--freetype-rel-fontsize=22', '--verbose=0', '--log-verbose=1')
         self.player = self.vlc_instance.media_player_new()
 
+        # Videos are played as a list on the same media player, which moves from one video to the next without tearing down
+        # the video window. Looping (for filler videos) is done with the list's playback mode.
+        self.list_player = self.vlc_instance.media_list_player_new()
+        self.list_player.set_media_player(self.player)
+        self.media_list = None
+        self.playlist_count = 0 # Number of playlists started. A fade out ends when the next playlist starts.
+        self.videos = []
+        self.item_index = -1
+        self.start_media = None # Media given a start time by play_playlist, until another video is jumped to
+        self.item_callbacks = []
+        self.paused = False
+        self.metric_callbacks = []
+        self.play_requested = None # Time the playlist was started, until its first frame is displayed
+        self.ended_at = None # Time the last video ended, until the next one plays
+
+        # Completion state for the current playlist. Set from libvlc's event thread, so no polling is needed to detect the end.
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.finished.set()
+        self.finish_reason = None
+        self.finish_callbacks = []
+        self.frame_callbacks = []
+        self.started = False
+
+        # Media created ahead of time by preload(), by video path
+        self.preloaded = {}
+
+        event_manager = self.player.event_manager()
+        event_manager.event_attach(vlc.EventType.MediaPlayerPlaying, self.on_playing)
+        event_manager.event_attach(vlc.EventType.MediaPlayerVout, self.on_vout)
+        for event_type in VLCPlayer.END_EVENTS:
+            event_manager.event_attach(event_type, self.on_media_end)
+
+        list_event_manager = self.list_player.event_manager()
+        list_event_manager.event_attach(vlc.EventType.MediaListPlayerNextItemSet, self.on_next_item)
+        list_event_manager.event_attach(vlc.EventType.MediaListPlayerPlayed, self.on_list_end)
+
         # Avoid displaying verbose output if not in test mode.
         #if test_mode == False:
             #self.vlc_instance.log_unset()
 
-    def play_video(self, video):
-        media = self.vlc_instance.media_new(video)
-        self.player.set_media(media)
+    # libvlc event handlers. These run on libvlc's event thread and must not call back into the player, or lock the media list.
+    def on_playing(self, event):
+        self.started = True
+        if self.ended_at is not None:
+            self.report('summary', 'player_video_gap_seconds', 'Time from the end of a video to the next video of the playlist playing', time.perf_counter() - self.ended_at)
+            self.ended_at = None
+
+    # A video output was created for the media, i.e., the first frame is about to be shown.
+    def on_vout(self, event):
+        if self.started:
+            if self.play_requested is not None:
+                self.report('summary', 'player_first_frame_seconds', 'Time from starting a playlist to its first frame being displayed', time.perf_counter() - self.play_requested)
+                self.play_requested = None
+            for callback in list(self.frame_callbacks):
+                callback()
+
+    # The list player moved on to the next video. The index is looked up in the list, as finish_current removes items from it.
+    def on_next_item(self, event):
+        if self.media_list is None or event.u.media is None:
+            return
+
+        index = self.media_list.index_of_item(vlc.Media(event.u.media))
+        if index < 0 or index >= len(self.videos):
+            return
+
+        self.item_index = index
+        for callback in list(self.item_callbacks):
+            callback(self.item_index, self.videos[self.item_index])
+
+    def on_list_end(self, event):
+        if self.started:
+            self.started = False
+            self.finish('ended')
+
+    def on_media_end(self, event):
+        reason = VLCPlayer.END_EVENTS.get(event.type, 'stopped')
+
+        # The end of a single video is handled by the list player, which either plays the next video or reports the end of the list.
+        if reason == 'ended':
+            self.ended_at = time.perf_counter()
+            return
+
+        if reason == 'error':
+            self.report('counter', 'player_errors_total', 'Videos which could not be played', 1)
+
+        # Ignore events left over from the previous media, which can arrive before the new media starts.
+        if self.started or reason == 'error':
+            self.started = False
+            self.finish(reason)
+
+    def finish(self, reason):
+        with self.lock:
+            if self.finished.is_set():
+                return
+            self.finish_reason = reason
+            self.finished.set()
+            callbacks = list(self.finish_callbacks)
+
+        for callback in callbacks:
+            callback(reason)
+
+    # Registers a function to be called with the finish reason ('ended', 'error' or 'stopped') whenever a playlist stops playing.
+    # The callback runs on the thread that detected the end, and is called immediately if nothing is playing.
+    def add_finish_callback(self, callback):
+        with self.lock:
+            self.finish_callbacks.append(callback)
+            already_finished = self.finished.is_set()
+
+        if already_finished:
+            callback(self.finish_reason)
+
+    # Registers a function to be called (on libvlc's event thread) when the first frame of a video is displayed.
+    def add_frame_callback(self, callback):
+        self.frame_callbacks.append(callback)
+
+    # Registers a function to be called (on libvlc's event thread) with the index and path of each video as it starts playing.
+    def add_item_callback(self, callback):
+        self.item_callbacks.append(callback)
+
+    # Registers a function to be called with (kind, name, help, value) for each metric measured by the player. Kind is 'summary'
+    # (a timing, in seconds) or 'counter'. The callback runs on libvlc's event thread.
+    def add_metric_callback(self, callback):
+        self.metric_callbacks.append(callback)
+
+    def report(self, kind, name, help, value):
+        for callback in list(self.metric_callbacks):
+            callback(kind, name, help, value)
+
+    def remove_finish_callback(self, callback):
+        with self.lock:
+            if callback in self.finish_callbacks:
+                self.finish_callbacks.remove(callback)
+
+    # Plays the videos in order starting at start_index (and position, in milliseconds, within that video), without gaps between videos. Returns immediately; the item callbacks are
+    # called as each video starts and the finish callbacks when the end of the list is reached (or playback is stopped).
+    def play_playlist(self, videos, start_index = 0, repeat = False, position = 0):
+        # Stop the previous playlist first, so that its Stopped event is not taken as the end of this one.
+        self.list_player.stop()
+        with self.lock:
+            self.started = False
+            self.finish_reason = None
+            self.finished.clear()
+        self.play_requested = time.perf_counter()
+        self.ended_at = None
+
+        # Videos that were not preloaded are parsed in the background, so that each one is ready before the previous one ends.
+        media_list = self.vlc_instance.media_list_new()
+        self.start_media = None
+        for i, video in enumerate(videos):
+            media = self.preloaded.pop(video, None)
+            if media is None:
+                media = self.create_media(video)
+            if i == start_index and position > 0:
+                media.add_option('start-time=' + str(position / 1000))
+                self.start_media = media
+            media_list.add_media(media)
+
+        self.videos = list(videos)
+        self.item_index = start_index
+        self.media_list = media_list
+        self.playlist_count += 1
+        self.paused = False
+        self.list_player.set_media_list(media_list)
+        self.list_player.set_playback_mode(vlc.PlaybackMode.loop if repeat else vlc.PlaybackMode.default)
         self.player.set_fullscreen(True)
-        self.player.play()
+        self.player.audio_set_volume(VLCPlayer.VOLUME) # In case the previous playlist was faded out
+        self.list_player.play_item_at_index(start_index)
+
+    def play_video(self, video, repeat = False):
+        self.play_playlist([video], repeat = repeat)
+
+    # Moves on to the next video in the playlist. Returns False if the current video is the last one.
+    def next(self):
+        return self.list_player.next() == 0
+
+    # Plays the video at the given index of the playlist. Returns False if there is no such video.
+    def jump(self, index):
+        if self.media_list is None or index < 0 or index >= self.media_list.count():
+            return False
+
+        # The start time only applies to the first play, so the video is played from the start if it is jumped to again
+        if self.start_media is not None:
+            self.media_list.lock()
+            try:
+                start_index = self.media_list.index_of_item(self.start_media)
+                if start_index >= 0:
+                    self.media_list.remove_index(start_index)
+                    self.media_list.insert_media(self.create_media(self.videos[start_index]), start_index)
+            finally:
+                self.media_list.unlock()
+            self.start_media = None
+
+        self.item_index = index
+        self.paused = False
+        self.list_player.play_item_at_index(index)
+        return True
+
+    def pause(self):
+        self.paused = True
+        self.list_player.set_pause(1)
+
+    def resume(self):
+        self.paused = False
+        self.list_player.set_pause(0)
+
+    # Ends the playlist once the current video has finished, by removing the videos after it from the list.
+    def finish_current(self):
+        if self.media_list is None:
+            return
+
+        self.media_list.lock()
+        try:
+            for i in range(self.media_list.count() - 1, self.item_index, -1):
+                self.media_list.remove_index(i)
+        finally:
+            self.media_list.unlock()
+
+    # Lowers the volume to silence over the given number of seconds. Blocks until done, or until another playlist is started.
+    def fade_out(self, seconds):
+        playlist_count = self.playlist_count
+        volume = self.player.audio_get_volume()
+        for step in range(1, VLCPlayer.FADE_STEPS + 1):
+            time.sleep(seconds / VLCPlayer.FADE_STEPS)
+            if self.playlist_count != playlist_count:
+                return
+            self.player.audio_set_volume(int(volume * (1 - step / VLCPlayer.FADE_STEPS)))
+
+    # Media are parsed in the background, so that each one is ready before it is played
+    def create_media(self, video):
+        media = self.vlc_instance.media_new(video)
+        media.parse_with_options(vlc.MediaParseFlag.local, 0)
+        return media
+
+    # Creates the media for the given videos and starts parsing them in the background, so that playing them later only has
+    # to start decoding. Replaces any media preloaded earlier.
+    def preload(self, videos):
+        preloaded = {}
+        for video in videos:
+            media = self.preloaded.get(video)
+            if media is None:
+                media = self.create_media(video)
+            preloaded[video] = media
+
+        self.preloaded = preloaded
+
+    # Blocks until the current playlist stops playing. Returns the finish reason, or None on timeout.
+    def wait_until_finished(self, timeout = None):
+        if not self.finished.wait(timeout):
+            return None
+        return self.finish_reason
+
+    # Waits without blocking the event loop until the current playlist stops playing. Returns the finish reason.
+    async def wait_finished(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def on_finish(reason):
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(reason))
+
+        self.add_finish_callback(on_finish)
+        try:
+            return await future
+        finally:
+            self.remove_finish_callback(on_finish)
 
     def is_playing(self):
         playing = set([1,2,3,4])
         return self.player.get_state() in playing
 
-    def stop(self):
-        return self.player.stop()
+    def get_time(self):
+        return self.player.get_time()
 
-    def play_playlist(self, files):
-        for video in files:
-            try:
-                self.play_video(video)
-                
-                time.sleep(1)
-
-                while True:
-                    state = self.player.get_state()
-                    if not self.is_playing():
-                        break
-                    continue
-            except:
-                raise RuntimeError('Error playing video ' + video)
-
-    
\ No newline at end of file
+    def get_length(self):
+        return self.player.get_length()
+
+    def stop(self):
+        self.started = False
+        self.paused = False
+        result = self.list_player.stop()
+        self.finish('stopped')
+        return result
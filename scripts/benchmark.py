@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import contextlib
+import csv
+import importlib
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root_path)
+from bot import Bot
+from data import ConferenceData
+from fakes import FakePlayer, FakeDiscordClient
+from synthetic_conference import SyntheticConference
+from startup_benchmark import git_commit
+
+# Times the main steps of running a conference on synthetic conferences of increasing size (see synthetic_conference.py), with the
+# player and Discord replaced by the fakes in fakes.py:
+#   load_data:            reading papers.csv, authors.csv and playlist.csv and building the session lists, from cold
+#   load_snapshot:        the same from the compiled snapshot (see compile_data.py)
+#   prepare_sessions:     the warm-up of every session: session videos, channel lookup, announcements and preload
+#   render_announcements: the session and paper announcements of every session, with the data already read
+#   schedule_startup:     reading sessions.csv and scheduling both weeks of every session, as at startup
+#   broadcast_sessions:   starting every session, with videos that end straight away
+#   generate_playlist:    playlist_generator.py from papers.csv and the video files, in full and with --incremental (no changes)
+# Each benchmark is run several times and the median is appended to a CSV file with the commit, so that changes can be compared
+# across commits (see --compare). Output printed by the code being measured is discarded.
+
+results_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_results.csv')
+GUILD_ID = 1
+TV_CHANNEL = 'tv'
+
+tv = importlib.import_module('cscw-tv')
+
+
+class Conference:
+    def __init__(self, path, papers):
+        self.path = path
+        self.papers = papers
+        self.scheduling_path = os.path.join(path, 'scheduling')
+        self.media_path = os.path.join(path, 'videos')
+        self.sessions = []
+
+    def get_file(self, name):
+        return os.path.join(self.scheduling_path, name)
+
+
+# Writes a synthetic conference whose sessions start tomorrow, so that they can all be scheduled
+def create_conference(path, papers):
+    start = datetime.now(timezone.utc).replace(tzinfo = None, minute = 0, second = 0, microsecond = 0) + timedelta(days = 1)
+    synthetic = SyntheticConference(papers, start = start)
+    synthetic.write(os.path.join(path, 'scheduling'), os.path.join(path, 'videos'), media_index = True)
+
+    conference = Conference(path, papers)
+    conference.sessions = [(row[0], row[1]) for row in synthetic.sessions]
+    return conference
+
+
+def create_bot(conference):
+    client = FakeDiscordClient()
+    client.add_guild(GUILD_ID, [TV_CHANNEL] + [Bot.get_valid_name(name, number) for number, name in conference.sessions])
+    return Bot('', GUILD_ID, client = client)
+
+
+async def create_manager(conference):
+    bot = create_bot(conference)
+    await bot.on_ready()
+    return tv.CSCWManager(bot,
+        bot.get_channel_by_name(TV_CHANNEL).id,
+        conference.get_file('playlist.csv'),
+        conference.get_file('papers.csv'),
+        conference.get_file('authors.csv'),
+        conference.media_path,
+        status_file = os.path.join(conference.path, 'status.json'),
+        media_index_file = conference.get_file('media_index.json'),
+        player = FakePlayer())
+
+
+async def bench_load_data(conference):
+    manager = await create_manager(conference)
+    started = time.perf_counter()
+    manager.load_data()
+    for session_number, session_name in conference.sessions:
+        manager.playlist.get_session(session_number)
+    return time.perf_counter() - started
+
+
+def create_data(conference, snapshot_file = None):
+    return ConferenceData(conference.get_file('playlist.csv'), conference.get_file('papers.csv'), conference.get_file('authors.csv'),
+        conference.media_path, conference.get_file('media_index.json'), snapshot_file)
+
+
+async def bench_load_snapshot(conference):
+    snapshot_file = conference.get_file('conference_data.pickle')
+    data = create_data(conference)
+    data.refresh()
+    data.save_snapshot(snapshot_file) # Written each time, as the playlist benchmarks change playlist.csv
+
+    started = time.perf_counter()
+    data = create_data(conference, snapshot_file)
+    data.refresh()
+    for session_number, session_name in conference.sessions:
+        data.playlist.get_session(session_number)
+    return time.perf_counter() - started
+
+
+async def bench_prepare_sessions(conference):
+    manager = await create_manager(conference)
+    manager.load_data()
+    started = time.perf_counter()
+    for session_number, session_name in conference.sessions:
+        await manager.prepare_session(session_number, session_name)
+    return time.perf_counter() - started
+
+
+async def bench_render_announcements(conference):
+    manager = await create_manager(conference)
+    manager.load_data()
+    sessions = [(number, name, manager.playlist.get_session(number)) for number, name in conference.sessions]
+    started = time.perf_counter()
+    for session_number, session_name, session_videos in sessions:
+        manager.create_session_message(session_number, session_name, 0, session_videos)
+        for video in session_videos:
+            if video.is_paper():
+                manager.create_paper_message(video.paper)
+    return time.perf_counter() - started
+
+
+class NoManager:
+    track = 1
+
+    async def start_session(self, **kwargs):
+        pass
+    async def prepare_session(self, **kwargs):
+        pass
+
+
+async def bench_schedule_startup(conference):
+    started = time.perf_counter()
+    sessions_file = conference.get_file('sessions.csv')
+    timetable_data = tv.load_timetable(sessions_file)
+    scheduler = tv.CSCWSchedulingHandler(NoManager())
+    tv.schedule_sessions(scheduler, timetable_data, sessions_file = sessions_file)
+    return time.perf_counter() - started
+
+
+async def bench_broadcast_sessions(conference):
+    manager = await create_manager(conference)
+    manager.load_data()
+    started = time.perf_counter()
+    for session_number, session_name in conference.sessions:
+        await manager.start_session(session_number, session_name)
+    elapsed = time.perf_counter() - started
+
+    for task in asyncio.all_tasks() - {asyncio.current_task()}:
+        task.cancel() # Messages still waiting for the rate limit
+    return elapsed
+
+
+def run_playlist_generator(conference, incremental):
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'playlist_generator.py'),
+        '--media-path', conference.media_path, '--scheduling-path', conference.scheduling_path]
+    if incremental:
+        command.append('--incremental')
+
+    started = time.perf_counter()
+    result = subprocess.run(command, capture_output = True, text = True)
+    if result.returncode != 0:
+        raise RuntimeError('Playlist generator failed:\n' + result.stderr)
+    return time.perf_counter() - started
+
+
+async def bench_generate_playlist(conference):
+    return run_playlist_generator(conference, False)
+
+
+async def bench_generate_playlist_incremental(conference):
+    run_playlist_generator(conference, False) # Writes the manifest
+    return run_playlist_generator(conference, True)
+
+
+BENCHMARKS = {
+    'load_data': bench_load_data,
+    'load_snapshot': bench_load_snapshot,
+    'prepare_sessions': bench_prepare_sessions,
+    'render_announcements': bench_render_announcements,
+    'schedule_startup': bench_schedule_startup,
+    'broadcast_sessions': bench_broadcast_sessions,
+    'generate_playlist': bench_generate_playlist,
+    'generate_playlist_incremental': bench_generate_playlist_incremental
+}
+
+
+def run_benchmark(benchmark, conference, runs):
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(runs):
+            with contextlib.redirect_stdout(devnull):
+                times.append(asyncio.run(BENCHMARKS[benchmark](conference)))
+    return times
+
+
+# Latest result of each benchmark and size from another commit, or from the given commit
+def load_baseline(path, commit, compare):
+    baseline = {}
+    if not os.path.isfile(path):
+        return baseline
+
+    with open(path, newline = '', encoding = 'utf-8') as infile:
+        for row in csv.DictReader(infile):
+            if (compare is not None and row['commit'].startswith(compare)) or (compare is None and row['commit'] != commit):
+                baseline[(row['benchmark'], int(row['papers']))] = (row['commit'], float(row['median_seconds']))
+    return baseline
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description='Benchmarks the bot on synthetic conferences, with fake playback and Discord.')
+    args_parser.add_argument('--papers', help='Comma separated conference sizes, in papers. Defaults to 100,1000,10000', default='100,1000,10000')
+    args_parser.add_argument('--runs', help='Number of runs of each benchmark. Defaults to 3', default=3, type=int)
+    args_parser.add_argument('--only', help='Comma separated benchmarks to run: ' + ', '.join(BENCHMARKS), default='')
+    args_parser.add_argument('--compare', help='Commit to compare with. Defaults to the latest results from another commit', default=None)
+    args_parser.add_argument('--out', help='CSV file to append the results to', default=results_file)
+    args = args_parser.parse_args()
+
+    benchmarks = [name.strip() for name in args.only.split(',') if name.strip() != ''] or list(BENCHMARKS)
+    for name in benchmarks:
+        if name not in BENCHMARKS:
+            args_parser.error('Unknown benchmark ' + name)
+
+    commit = git_commit()
+    baseline = load_baseline(args.out, commit, args.compare)
+    results = []
+    for papers in [int(size) for size in args.papers.split(',')]:
+        with tempfile.TemporaryDirectory() as temp_path:
+            conference = create_conference(temp_path, papers)
+            print('**' + str(papers) + ' papers, ' + str(len(conference.sessions)) + ' sessions**')
+            for benchmark in benchmarks:
+                times = run_benchmark(benchmark, conference, args.runs)
+                median = statistics.median(times)
+                results.append([benchmark, papers, min(times), median])
+
+                line = '\t' + benchmark + ': ' + '{:.4f}'.format(median) + ' s'
+                previous = baseline.get((benchmark, papers))
+                if previous is not None and previous[1] > 0:
+                    line += ' (' + '{:+.1f}'.format((median / previous[1] - 1) * 100) + '% from ' + previous[0] + ')'
+                print(line)
+
+    write_header = not os.path.isfile(args.out)
+    with open(args.out, 'a', newline='', encoding='utf-8') as outfile:
+        writer = csv.writer(outfile)
+        if write_header:
+            writer.writerow(['date', 'commit', 'benchmark', 'papers', 'runs', 'min_seconds', 'median_seconds'])
+        date = datetime.now().isoformat(timespec='seconds')
+        for benchmark, papers, fastest, median in results:
+            writer.writerow([date, commit, benchmark, papers, args.runs, '{:.5f}'.format(fastest), '{:.5f}'.format(median)])
+    print('Results appended to ' + os.path.abspath(args.out))
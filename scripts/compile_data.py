@@ -0,0 +1,70 @@
+import argparse
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from data import ConferenceData
+
+# Checks the data files and compiles them into one snapshot file, which cscw-tv.py loads at startup instead of parsing the CSV
+# files (see data.ConferenceData). The snapshot holds the built paper, author, playlist and media tables, and is ignored once any
+# of the files changes, so run this again after editing them. The checks report playlist entries whose paper is not in papers.csv,
+# sessions without videos, papers without authors and videos missing from the media index.
+
+scheduling_path = os.path.join('..', 'scheduling')
+media_path = 'videos'
+snapshot_name = 'conference_data.pickle'
+
+
+def check_data(data, scheduling_path):
+    problems = []
+
+    playlist_data = pd.read_csv(os.path.join(scheduling_path, 'playlist.csv')).fillna('')
+    for file_name, is_paper, paper_id, cycle in zip(playlist_data['file_name'], playlist_data['is_paper'], playlist_data['paper_id'], playlist_data['cycle']):
+        if is_paper and data.papers.get_paper(cycle = cycle, id = paper_id) is None:
+            problems.append('Playlist entry ' + str(file_name) + ' is not in papers.csv (cycle ' + str(cycle) + ', paper ' + str(paper_id) + ')')
+
+    timetable_data = pd.read_csv(os.path.join(scheduling_path, 'sessions.csv'))
+    tracks = timetable_data['track'] if 'track' in timetable_data.columns else [1] * len(timetable_data)
+    for session_number, session_name, track in zip(timetable_data['session_number'], timetable_data['session_name'], tracks):
+        if len(data.playlist.get_session(session_number, track)) == 0:
+            problems.append('Session ' + str(session_number) + '. ' + str(session_name) + ' (track ' + str(track) + ') has no videos in the playlist')
+
+    for paper in data.papers.papers.values():
+        if data.authors.get_credit(paper) is None:
+            problems.append('Paper ' + str(paper.id) + ' in cycle ' + paper.cycle + ' has no authors in authors.csv')
+
+    if data.media is not None and len(data.media.media) > 0:
+        for session_videos in data.playlist.sessions.values():
+            for video in session_videos:
+                if data.media.get_info(video.video_path) is None:
+                    problems.append('Video ' + os.path.basename(video.video_path) + ' is not in the media index')
+
+    return problems
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description='Checks the data files and compiles them into a snapshot for cscw-tv.py.')
+    args_parser.add_argument('--scheduling-path', help='Directory containing the data files, where the snapshot is written', default=scheduling_path)
+    args_parser.add_argument('--media-path', help='Directory containing the videos, as cscw-tv.py sees it. Defaults to videos', default=media_path)
+    args = args_parser.parse_args()
+
+    started = time.perf_counter()
+    snapshot_file = os.path.join(args.scheduling_path, snapshot_name)
+    data = ConferenceData(os.path.join(args.scheduling_path, 'playlist.csv'),
+        os.path.join(args.scheduling_path, 'papers.csv'),
+        os.path.join(args.scheduling_path, 'authors.csv'),
+        args.media_path,
+        os.path.join(args.scheduling_path, 'media_index.json'))
+    data.refresh()
+
+    problems = check_data(data, args.scheduling_path)
+    for problem in problems:
+        print(problem)
+
+    data.save_snapshot(snapshot_file)
+    print('Finished writing data snapshot in ' + os.path.abspath(snapshot_file))
+    print('**Results**\n\tPapers: ' + str(len(data.papers.papers)) + '\n\tSessions: ' + str(len(data.playlist.sessions))
+        + '\n\tProblems: ' + str(len(problems)) + '\n\tSnapshot size: ' + '{:.1f}'.format(os.path.getsize(snapshot_file) / 1024) + ' KB'
+        + '\n\tTime: ' + '{:.3f}'.format(time.perf_counter() - started) + ' s')
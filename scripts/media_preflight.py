@@ -0,0 +1,218 @@
+import argparse
+import json
+import os
+import re
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Checks the videos before the conference, so that a truncated video or a missing subtitle file is found ahead of time instead of
+# in the middle of a session. Each MP4 file's container header is read to get its duration and codecs, and whether the moov box
+# (the index of the file) comes before the media data, which lets playback start without reading the whole file. The subtitle file
+# must be present and parse as SRT. The results are written to an index, which cscw-tv.py reads at startup (see data.MediaIndex).
+# Files are only checked again if their size or modification time changed since the last run.
+
+media_path = os.path.join('..', 'videos')
+index_file = os.path.join('..', 'scheduling', 'media_index.json')
+video_suffix = '.mp4'
+subtitle_suffix = '.srt'
+INDEX_VERSION = 1
+
+# Boxes inside moov which contain the boxes needed to get the codecs
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+SRT_TIMING = re.compile(r'^\d{1,2}:\d{2}:\d{2}[,.]\d{1,3} --> \d{1,2}:\d{2}:\d{2}[,.]\d{1,3}')
+
+
+# Reads the box headers from the current position up to end. Returns (type, payload offset, payload size, box end) for each box.
+def read_boxes(f, end):
+    boxes = []
+    position = f.tell()
+    while position + 8 <= end:
+        f.seek(position)
+        size, box_type = struct.unpack('>I4s', f.read(8))
+        if not box_type.isalnum():
+            raise ValueError('Not an MP4 file (invalid box type ' + repr(box_type) + ' at byte ' + str(position) + ')')
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - position # The box extends to the end of the file
+        if size < header_size:
+            raise ValueError('Invalid size for box ' + repr(box_type))
+
+        boxes.append((box_type, position + header_size, size - header_size, position + size))
+        position += size
+    return boxes
+
+
+# Gets the duration (in seconds) from mvhd, and the codec of each track from the handler type (hdlr) and first sample entry (stsd).
+def parse_moov(data, info, handler = None):
+    position = 0
+    while position + 8 <= len(data):
+        size, box_type = struct.unpack_from('>I4s', data, position)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, position + 8)[0]
+            header_size = 16
+        if size < header_size or position + size > len(data):
+            raise ValueError('Invalid size for box ' + repr(box_type) + ' in moov')
+        payload = data[position + header_size:position + size]
+
+        if box_type == b'mvhd':
+            if payload[0] == 1:
+                timescale, duration = struct.unpack_from('>IQ', payload, 20)
+            else:
+                timescale, duration = struct.unpack_from('>II', payload, 12)
+            info['duration'] = round(duration / timescale, 3) if timescale > 0 else None
+        elif box_type == b'trak':
+            handler = parse_moov(payload, info)
+        elif box_type == b'hdlr':
+            handler = payload[8:12].decode('latin-1')
+        elif box_type == b'stsd' and len(payload) >= 16:
+            codec = payload[12:16].decode('latin-1')
+            if handler == 'vide':
+                info['video_codec'] = codec
+            elif handler == 'soun':
+                info['audio_codec'] = codec
+        elif box_type in CONTAINER_BOXES:
+            handler = parse_moov(payload, info, handler)
+
+        position += size
+    return handler
+
+
+def inspect_mp4(path, info):
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        boxes = read_boxes(f, file_size)
+
+        box_types = [box[0] for box in boxes]
+        if len(boxes) > 0 and boxes[-1][3] > file_size:
+            info['problems'].append('Truncated: ' + boxes[-1][0].decode('latin-1') + ' box ends ' + str(boxes[-1][3] - file_size) + ' bytes past the end of the file')
+        if b'moov' not in box_types:
+            info['problems'].append('No moov box')
+            return
+        if b'mdat' not in box_types:
+            info['problems'].append('No mdat box')
+        else:
+            info['fast_start'] = box_types.index(b'moov') < box_types.index(b'mdat')
+
+        _, offset, size, end = boxes[box_types.index(b'moov')]
+        if end > file_size:
+            return
+        f.seek(offset)
+        parse_moov(f.read(size), info)
+
+    if info['duration'] is None:
+        info['problems'].append('No duration in moov')
+
+
+# Checks that each subtitle block has a number, a timing line and text. Returns the number of cues.
+def inspect_srt(path):
+    try:
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            text = f.read()
+    except UnicodeDecodeError:
+        with open(path, 'r', encoding='latin-1') as f:
+            text = f.read()
+
+    cues = 0
+    for block in re.split(r'\n\s*\n', text.replace('\r\n', '\n').strip()):
+        if block == '':
+            continue
+        lines = block.split('\n')
+        if len(lines) < 2 or not lines[0].strip().isdigit() or SRT_TIMING.match(lines[1].strip()) is None:
+            raise ValueError('Invalid subtitle block ' + str(cues + 1) + ': ' + repr(block[:40]))
+        cues += 1
+    return cues
+
+
+# Runs in a worker process. Checks a video and its subtitle file.
+def inspect_video(path):
+    info = {'duration': None, 'video_codec': None, 'audio_codec': None, 'fast_start': None, 'subtitle_cues': None, 'problems': []}
+
+    try:
+        inspect_mp4(path, info)
+    except (OSError, ValueError, struct.error) as ex:
+        info['problems'].append('Cannot read MP4 header: ' + str(ex))
+
+    subtitle_file = os.path.splitext(path)[0] + subtitle_suffix
+    if not os.path.isfile(subtitle_file):
+        info['problems'].append('Missing subtitle file')
+    else:
+        try:
+            info['subtitle_cues'] = inspect_srt(subtitle_file)
+        except (OSError, ValueError) as ex:
+            info['problems'].append('Cannot parse subtitle file: ' + str(ex))
+
+    return info
+
+
+def load_index(path):
+    try:
+        with open(path, 'r') as openfile:
+            index = json.load(openfile)
+        if index.get('version') == INDEX_VERSION:
+            return index['files']
+    except (OSError, ValueError):
+        pass
+    return {}
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description='Checks the videos and subtitles, and writes the media index read by cscw-tv.py.')
+    args_parser.add_argument('--media-path', help='Directory containing the videos', default=media_path)
+    args_parser.add_argument('--index', help='Index file to write', default=index_file)
+    args_parser.add_argument('--workers', help='Number of worker processes. Defaults to the number of CPUs', default=None, type=int)
+    args_parser.add_argument('--full', help='Check every file again, even if it did not change', action='store_true')
+    args = args_parser.parse_args()
+
+    started = time.perf_counter()
+    previous = {} if args.full else load_index(args.index)
+
+    stats = {}
+    with os.scandir(args.media_path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                stats[entry.name] = (stat.st_size, stat.st_mtime_ns)
+
+    files = {}
+    changed = []
+    for name in sorted(stats):
+        base, suffix = os.path.splitext(name)
+        if suffix.lower() != video_suffix:
+            continue
+        size, mtime = stats[name]
+        # The subtitle file is checked along with its video, so a video is also checked again if its subtitle file changed
+        subtitle_mtime = stats.get(base + subtitle_suffix, (0, 0))[1]
+
+        entry = previous.get(name)
+        if entry is not None and entry['size'] == size and entry['mtime'] == mtime and entry.get('subtitle_mtime') == subtitle_mtime:
+            files[name] = entry
+        else:
+            files[name] = {'size': size, 'mtime': mtime, 'subtitle_mtime': subtitle_mtime}
+            changed.append(name)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        paths = [os.path.join(args.media_path, name) for name in changed]
+        for name, info in zip(changed, executor.map(inspect_video, paths, chunksize=16)):
+            files[name].update(info)
+
+    temp_file = args.index + '.tmp'
+    with open(temp_file, 'w') as outfile:
+        json.dump({'version': INDEX_VERSION, 'files': files}, outfile, separators=(',', ':'))
+    os.replace(temp_file, args.index)
+
+    problems = [(name, entry['problems']) for name, entry in files.items() if len(entry['problems']) > 0]
+    for name, file_problems in problems:
+        print(name + ': ' + '; '.join(file_problems))
+    slow_start = [name for name, entry in files.items() if entry['fast_start'] is False]
+    if len(slow_start) > 0:
+        print('Videos with the moov box after the media data (slower to start, fix with "ffmpeg -movflags +faststart"): ' + ', '.join(slow_start))
+
+    print('Finished writing media index in ' + os.path.abspath(args.index))
+    print('**Results**\n\tVideos: ' + str(len(files)) + '\n\tChecked: ' + str(len(changed)) + '\n\tWith problems: ' + str(len(problems))
+        + '\n\tTotal duration: ' + '{:.1f}'.format(sum(entry['duration'] or 0 for entry in files.values()) / 60) + ' min'
+        + '\n\tTime: ' + '{:.3f}'.format(time.perf_counter() - started) + ' s')
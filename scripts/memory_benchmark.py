@@ -0,0 +1,162 @@
+import argparse
+import asyncio
+import gc
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root_path)
+import discord
+from bot import Bot
+
+# Compares the memory used by the Discord client in its default configuration and in the lean one (cscw-tv.py --lean-client, see
+# Bot.create_client) over a conference-length run. Nothing connects to Discord: a stub gateway feeds the client the events a busy
+# conference guild sends every day (the guild with its channels at startup, then messages, typing and reactions from the attendees),
+# and only those the client has the intents for, as Discord does. Each configuration runs in its own process, and the resident size
+# and the memory allocated by Python (tracemalloc) are reported at the end of each day.
+
+GUILD_ID = 1
+BOT_ID = 2
+
+
+class StubGateway:
+    def __init__(self, client, seed, members, channels):
+        self.client = client
+        self.state = client._connection
+        self.random = random.Random(seed)
+        self.intents = client.intents
+        self.next_id = 10 ** 6
+        self.users = [{'id': str(1000 + i), 'username': 'attendee' + str(i), 'discriminator': '0001', 'avatar': None} for i in range(members)]
+        self.channel_ids = [str(100 + i) for i in range(channels)]
+
+    def get_id(self):
+        self.next_id += 1
+        return str(self.next_id)
+
+    @staticmethod
+    def get_timestamp():
+        return datetime.now(timezone.utc).isoformat()
+
+    def get_member(self, user):
+        return {'user': user, 'roles': [], 'joined_at': StubGateway.get_timestamp(), 'deaf': False, 'mute': False}
+
+    # Sent once the client has identified, with the bot's own member. Without the members intent, Discord leaves out the others.
+    def connect(self):
+        self.state.user = discord.ClientUser(state = self.state, data = {'id': str(BOT_ID), 'username': 'cscw-bot', 'discriminator': '0001', 'avatar': None, 'bot': True})
+        channels = [{'id': channel_id, 'type': 0, 'name': str(i).zfill(2) + '-session', 'position': i, 'permission_overwrites': []}
+            for i, channel_id in enumerate(self.channel_ids)]
+        members = [self.get_member(self.state.user._to_minimal_user_json())]
+        if self.intents.members:
+            members += [self.get_member(user) for user in self.users]
+        self.send('GUILD_CREATE', {'id': str(GUILD_ID), 'name': 'CSCW', 'channels': channels, 'members': members, 'roles': [], 'emojis': [],
+            'stickers': [], 'threads': [], 'presences': [], 'voice_states': [], 'member_count': len(self.users) + 1, 'large': True,
+            'owner_id': str(BOT_ID)})
+
+    def send(self, event, data):
+        self.state.parsers[event](data)
+
+    def send_message(self):
+        user = self.random.choice(self.users)
+        content = ' '.join('chat' for _ in range(self.random.randint(3, 40)))
+        self.send('MESSAGE_CREATE', {'id': self.get_id(), 'channel_id': self.random.choice(self.channel_ids), 'guild_id': str(GUILD_ID),
+            'author': user, 'member': self.get_member(user), 'content': content if self.intents.message_content else '',
+            'timestamp': StubGateway.get_timestamp(), 'edited_timestamp': None, 'tts': False, 'mention_everyone': False, 'mentions': [],
+            'mention_roles': [], 'attachments': [], 'embeds': [], 'pinned': False, 'type': 0})
+
+    def send_typing(self):
+        user = self.random.choice(self.users)
+        self.send('TYPING_START', {'channel_id': self.random.choice(self.channel_ids), 'guild_id': str(GUILD_ID), 'user_id': user['id'],
+            'timestamp': int(time.time()), 'member': self.get_member(user)})
+
+    def send_reaction(self):
+        user = self.random.choice(self.users)
+        self.send('MESSAGE_REACTION_ADD', {'user_id': user['id'], 'channel_id': self.random.choice(self.channel_ids), 'message_id': str(self.next_id),
+            'guild_id': str(GUILD_ID), 'emoji': {'id': None, 'name': '👏'}, 'member': self.get_member(user), 'burst': False, 'type': 0})
+
+    # Events of one day, in random order. Events without the matching intent are not sent.
+    async def run_day(self, messages):
+        events = []
+        if self.intents.guild_messages:
+            events += [self.send_message] * messages
+        if self.intents.guild_typing:
+            events += [self.send_typing] * messages
+        if self.intents.guild_reactions:
+            events += [self.send_reaction] * (messages // 2)
+        self.random.shuffle(events)
+
+        for i, event in enumerate(events):
+            event()
+            if i % 1000 == 0:
+                await asyncio.sleep(0) # Let the dispatched event handlers run
+
+
+def get_rss():
+    try:
+        with open('/proc/self/statm') as infile:
+            return int(infile.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # Peak instead of current, outside Linux
+
+
+# Runs one configuration and prints a SAMPLE line at the end of each day, for the parent process
+async def run_client(lean, args):
+    tracemalloc.start()
+    bot = Bot('', GUILD_ID, lean = lean)
+    await bot.client._async_setup_hook()
+    gateway = StubGateway(bot.client, args.seed, args.members, args.channels)
+    gateway.connect()
+    await bot.on_ready()
+
+    for day in range(args.days + 1):
+        if day > 0:
+            await gateway.run_day(args.messages)
+        await asyncio.sleep(0)
+        gc.collect()
+        print('SAMPLE', day, get_rss(), tracemalloc.get_traced_memory()[0], len(bot.client.cached_messages), len(bot.client.get_guild(GUILD_ID).members), flush = True)
+
+
+def run_process(lean, args):
+    command = [sys.executable, os.path.abspath(__file__), '--mode', 'lean' if lean else 'default', '--days', str(args.days), '--messages', str(args.messages),
+        '--members', str(args.members), '--channels', str(args.channels), '--seed', str(args.seed)]
+    result = subprocess.run(command, capture_output = True, text = True)
+    if result.returncode != 0:
+        raise RuntimeError('Memory benchmark failed:\n' + result.stderr)
+    return [[int(value) for value in line.split()[1:]] for line in result.stdout.splitlines() if line.startswith('SAMPLE')]
+
+
+def format_mb(value):
+    return '{:.1f}'.format(value / 1024 / 1024) + ' MB'
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description='Memory used by the default and lean Discord clients over a conference-length run against a stub gateway.')
+    args_parser.add_argument('--days', help='Days of conference traffic. Defaults to 14', default=14, type=int)
+    args_parser.add_argument('--messages', help='Messages sent by attendees each day. Defaults to 5000', default=5000, type=int)
+    args_parser.add_argument('--members', help='Attendees in the guild. Defaults to 3000', default=3000, type=int)
+    args_parser.add_argument('--channels', help='Text channels in the guild. Defaults to 120', default=120, type=int)
+    args_parser.add_argument('--seed', help='Random seed. Defaults to 1', default=1, type=int)
+    args_parser.add_argument('--mode', help=argparse.SUPPRESS, default=None, choices=['default', 'lean'])
+    args = args_parser.parse_args()
+
+    if args.mode is not None:
+        asyncio.run(run_client(args.mode == 'lean', args))
+        sys.exit(0)
+
+    started = time.perf_counter()
+    results = {mode: run_process(mode == 'lean', args) for mode in ('default', 'lean')}
+    print('**Memory by day** (resident / allocated by Python / cached messages / cached members)')
+    for day, (default, lean) in enumerate(zip(results['default'], results['lean'])):
+        print('\tDay ' + str(day) + ': default ' + format_mb(default[1]) + ' / ' + format_mb(default[2]) + ' / ' + str(default[3]) + ' / ' + str(default[4])
+            + '; lean ' + format_mb(lean[1]) + ' / ' + format_mb(lean[2]) + ' / ' + str(lean[3]) + ' / ' + str(lean[4]))
+
+    default, lean = results['default'][-1], results['lean'][-1]
+    print('**Results**\n\tResident size at the end: default ' + format_mb(default[1]) + ', lean ' + format_mb(lean[1])
+        + '\n\tGrowth since startup: default ' + format_mb(default[1] - results['default'][0][1]) + ', lean ' + format_mb(lean[1] - results['lean'][0][1])
+        + '\n\tAllocated by Python at the end: default ' + format_mb(default[2]) + ', lean ' + format_mb(lean[2])
+        + '\n\tTime: ' + '{:.1f}'.format(time.perf_counter() - started) + ' s')
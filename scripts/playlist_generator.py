@@ -1,110 +1,180 @@
-import pandas as pd
+import argparse
+import json
 import os
-from os.path import isfile, join
+import time
+import pandas as pd
 
 
 media_path = os.path.join('..', 'videos')
 scheduling_path = os.path.join('..', 'scheduling')
-video_suffix = 'mp4'
-out_file = os.path.join(scheduling_path, 'playlist.csv')
-
-  
-
-def get_presentation_info(papers, target_cycle, target_id):
-    for i, paper in papers.iterrows():      
-
-        paper_cycle = paper["cycle"].lower().strip()
-        paper_id = str(paper["paper_id"])
-
-        if len(paper_cycle) < 1 or len(paper_id) < 1:
-            continue
-
-        if paper_cycle == target_cycle.lower() and paper_id == str(target_id):
-            return {
-                "session_number": paper["session_number"],
-                "talk_number": paper["talk_number"]
-            }
-
-
-    return None
-
-# Pre-process data and ensure that numbers are stored as integers.
-papers_data = pd.read_csv(os.path.join(scheduling_path, 'papers.csv')).dropna()
-papers_data['paper_id'] = papers_data['paper_id'].astype(int)
-papers_data['session_number'] = papers_data['session_number'].astype(int)
-papers_data['talk_number'] = papers_data['talk_number'].astype(int)
-
+video_suffix = '.mp4'
+columns = ['file_name', 'session_number', 'is_paper', 'paper_id', 'cycle', 'play_order', 'track']
 
-playlist_items = []
-existing_files = []
 
-playlist_items_added = 0
-files = [f for f in os.listdir(media_path) if isfile(join(media_path, f))]
+# Lists the files of the media directory in a single pass. Returns the (mtime, size) of every file, by name.
+def scan_files(media_path):
+    stats = {}
+    with os.scandir(media_path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                stats[entry.name] = [stat.st_mtime_ns, stat.st_size]
 
-for video in files:
-    video_lower = video.lower()
-    parts = str(video_lower).split('_')
-    if len(parts) < 2:
-        print('Invalid file name for file ' + str(video))
-        continue
+    return stats
 
-    pcs_cycle = parts[0]
-    second = parts[1].split('.')
-    
-    if not second[1] == video_suffix:
-        continue
-    
-    if len(pcs_cycle) < 5:
-        print('Invalid cycle name ' + str(pcs_cycle))
-        continue
 
-    paper_id = second[0]
+# Reads the videos from the given file names, which follow the 'cycle_paperid.mp4' format. Papers in keys, a set of
+# (cycle, paper_id), already have a video. Returns the valid videos as a data frame (file_name, cycle, paper_id).
+def parse_videos(file_names, keys = None):
+    videos = []
+    keys = set() if keys is None else keys
 
-    if len(paper_id) == 0:
-        print('Invalid paper id ' + str(paper_id))
-        continue
-
-    if video in existing_files:
-        print('Ignoring entry for video ' + str(video))
-        continue
-
-    existing_files.append(video_lower)
-    
-    presentation_info = get_presentation_info(papers_data, pcs_cycle, paper_id)
-    
-    if presentation_info is None:
-        print('Could not get associated session number for paper id: ' + str(paper_id) + ' in cycle: ' + str(pcs_cycle))
-        continue
-
-    is_paper = True
-    
-    playlist_row = [video, presentation_info["session_number"], is_paper, paper_id, pcs_cycle, presentation_info["talk_number"]]
-    playlist_items.append(playlist_row)
-
-    playlist_items_added += 1
-    # End for
-
-    
+    for video in sorted(file_names):
+        name, suffix = os.path.splitext(video.lower())
+        if suffix != video_suffix:
+            continue
 
+        parts = name.split('_')
+        if len(parts) < 2:
+            print('Invalid file name for file ' + str(video))
+            continue
 
+        pcs_cycle = parts[0]
+        if len(pcs_cycle) < 5:
+            print('Invalid cycle name ' + str(pcs_cycle))
+            continue
 
-# Create dataframe containing the playlist data
-out_df = pd.DataFrame(data=playlist_items, columns=['file_name', 'session_number', 'is_paper', 'paper_id', 'cycle', 'play_order'])
+        try:
+            paper_id = int(parts[1])
+        except ValueError:
+            print('Invalid paper id ' + str(parts[1]))
+            continue
 
-# Ensure that playlist items are sorted first by sessio number and then by play order within session.
-out_df.sort_values(['session_number', 'play_order'], inplace=True)
+        # Only one video per paper, e.g., if both CSCW22A_12.mp4 and cscw22a_12.mp4 exist
+        if (pcs_cycle, paper_id) in keys:
+            print('Ignoring entry for video ' + str(video))
+            continue
 
-#Write to UTF-8 csv file
-out_df.to_csv(out_file, index=False, encoding='utf-8')
+        keys.add((pcs_cycle, paper_id))
+        videos.append((video, pcs_cycle, paper_id))
 
-print ('Finished writing playlist file in ' + os.path.abspath(out_file))
-print('**Results**\n\tTotal files processed: ' + str(len(files)) + '\n\t' + 'Valid video files found: ' + str(len(existing_files)) + '\n\tPlaylist items created: ' + str(playlist_items_added))
+    return pd.DataFrame(videos, columns=['file_name', 'cycle', 'paper_id'])
 
 
+# Pre-process data and ensure that numbers are stored as integers. Cycles are compared in lower case. Papers without a track are
+# on track 1.
+def load_papers(papers_file):
+    papers_data = pd.read_csv(papers_file).dropna(subset=['cycle', 'paper_id', 'session_number', 'talk_number'])
+    papers_data['cycle'] = papers_data['cycle'].astype(str).str.strip().str.lower()
+    papers_data['paper_id'] = papers_data['paper_id'].astype(int)
+    papers_data['session_number'] = papers_data['session_number'].astype(int)
+    papers_data['talk_number'] = papers_data['talk_number'].astype(int)
+    if 'track' in papers_data.columns:
+        papers_data['track'] = pd.to_numeric(papers_data['track'], errors='coerce').fillna(1).astype(int)
+    else:
+        papers_data['track'] = 1
 
+    papers_data = papers_data[papers_data['cycle'] != '']
+    return papers_data.drop_duplicates(subset=['cycle', 'paper_id'])[['cycle', 'paper_id', 'session_number', 'talk_number', 'track']]
 
 
+# Joins the videos to the papers on (cycle, paper_id) to get the session and play order of each video.
+def build_playlist(videos, papers_data):
+    joined = videos.merge(papers_data, how='left', on=['cycle', 'paper_id'])
 
+    for pcs_cycle, paper_id in zip(joined['cycle'][joined['session_number'].isna()], joined['paper_id'][joined['session_number'].isna()]):
+        print('Could not get associated session number for paper id: ' + str(paper_id) + ' in cycle: ' + str(pcs_cycle))
 
-    
-    
+    joined = joined.dropna(subset=['session_number'])
+    return pd.DataFrame({
+        'file_name': joined['file_name'],
+        'session_number': joined['session_number'].astype(int),
+        'is_paper': True,
+        'paper_id': joined['paper_id'],
+        'cycle': joined['cycle'],
+        'play_order': joined['talk_number'].astype(int),
+        'track': joined['track'].astype(int)
+    }, columns=columns)
+
+
+def get_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def load_manifest(manifest_file):
+    try:
+        with open(manifest_file, 'r') as openfile:
+            return json.load(openfile)
+    except (OSError, ValueError):
+        return None
+
+
+# Keeps the rows of the existing playlist for the files which did not change since the last run, so that manual edits (such as
+# added filler videos or a changed play order) are kept. Rows for changed or removed files are dropped. Returns the kept rows and
+# the new or changed files, which are the only ones to read and join to the papers, or None and all files if the whole playlist
+# has to be generated again.
+def get_incremental(stats, papers_file, manifest, out_file):
+    if manifest is None or not os.path.isfile(out_file):
+        print('No previous playlist to update. Generating the full playlist.')
+        return None, list(stats)
+
+    if manifest['papers'] != get_stamp(papers_file):
+        print('Papers file changed. Generating the full playlist.')
+        return None, list(stats)
+
+    previous = manifest['files']
+    changed = [name for name in stats if previous.get(name) != stats[name]]
+    removed = set(name for name in previous if name not in stats)
+
+    existing = pd.read_csv(out_file)
+    if 'track' not in existing.columns:
+        existing['track'] = 1
+    kept = existing[~existing['file_name'].isin(removed.union(changed))]
+
+    print('Changed files: ' + str(len(changed)) + '. Removed files: ' + str(len(removed)) + '. Kept playlist items: ' + str(len(kept)))
+    return kept, changed
+
+
+# Papers which already have a video in the kept rows of the playlist
+def get_paper_keys(playlist):
+    papers = playlist[playlist['is_paper'] == True].dropna(subset=['cycle', 'paper_id'])
+    return set(zip(papers['cycle'].astype(str).str.lower(), papers['paper_id'].astype(int)))
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description='Writes playlist.csv for the paper presentation videos.')
+    args_parser.add_argument('--incremental', help='Only update the playlist items of the video files added, changed or removed since the last run', action='store_true')
+    args_parser.add_argument('--media-path', help='Directory containing the videos', default=media_path)
+    args_parser.add_argument('--scheduling-path', help='Directory containing papers.csv, where playlist.csv is written', default=scheduling_path)
+    args = args_parser.parse_args()
+
+    started = time.perf_counter()
+    papers_file = os.path.join(args.scheduling_path, 'papers.csv')
+    out_file = os.path.join(args.scheduling_path, 'playlist.csv')
+    manifest_file = os.path.join(args.scheduling_path, 'playlist_manifest.json')
+
+    stats = scan_files(args.media_path)
+    kept, file_names = None, list(stats)
+    if args.incremental:
+        kept, file_names = get_incremental(stats, papers_file, load_manifest(manifest_file), out_file)
+
+    # Only the new or changed videos are joined to the papers when updating the playlist
+    videos = parse_videos(file_names, None if kept is None else get_paper_keys(kept))
+    playlist = build_playlist(videos, load_papers(papers_file)) if len(videos) > 0 else pd.DataFrame(columns=columns)
+    playlist_items_added = len(playlist)
+    out_df = playlist if kept is None else pd.concat([kept, playlist])
+
+    # Ensure that playlist items are sorted first by track, then by session number and then by play order within session.
+    out_df = out_df.sort_values(['track', 'session_number', 'play_order'], kind='stable')
+
+    #Write to UTF-8 csv file
+    out_df.to_csv(out_file, index=False, encoding='utf-8')
+
+    # Remember the files that the playlist was generated from, for --incremental
+    with open(manifest_file, 'w') as outfile:
+        json.dump({'papers': get_stamp(papers_file), 'files': stats}, outfile)
+
+    print ('Finished writing playlist file in ' + os.path.abspath(out_file))
+    print('**Results**\n\tTotal files processed: ' + str(len(stats)) + '\n\t' + 'Valid video files found: ' + str(len(videos)) + '\n\tPlaylist items created: ' + str(playlist_items_added)
+        + '\n\tTime: ' + '{:.3f}'.format(time.perf_counter() - started) + ' s')
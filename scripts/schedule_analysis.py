@@ -0,0 +1,203 @@
+import argparse
+import bisect
+import importlib
+import os
+import sys
+import time
+from collections import Counter
+from datetime import timedelta
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from data import PaperCatalog, PlaylistStore, MediaIndex
+tv = importlib.import_module('cscw-tv')
+
+# Projects when each session ends in week 1 and week 2, from the session start times (sessions.csv), the videos of each session
+# (playlist.csv) and the video durations (media_index.json, written by media_preflight.py). A session overruns if it is still
+# playing when the next session is due to start, in which case it is preempted by cscw-tv.py. For each overrun, the talks that
+# could be moved out of the session and the sessions with enough spare time to take them are suggested.
+# Each track is broadcast on its own TV channel, so sessions only overlap with sessions of the same track, and talks are only moved
+# within a track. Sessions are sorted by start time once per week and track and the overlaps found with bisect, so the analysis is
+# quick enough to run after every playlist edit. The spare time after a session is at most the regular interval between session
+# starts, so that the gaps overnight and between the weeks are not taken as room for more talks.
+
+scheduling_path = os.path.join('..', 'scheduling')
+media_path = os.path.join('..', 'videos')
+
+
+# A session's videos and their total duration. Videos missing from the media index are counted as unknown.
+class SessionLength:
+    def __init__(self, session_number, session_name, talks, unknown, track = 1):
+        self.session_number = session_number
+        self.track = track
+        self.session_name = session_name
+        self.talks = talks # (duration in seconds, label) of each video
+        self.unknown = unknown # Videos without a duration
+        self.duration = timedelta(seconds = round(sum(duration for duration, label in talks)))
+
+
+# The projection of one session in one week
+class SessionSlot:
+    def __init__(self, session, week, start):
+        self.session = session
+        self.week = week
+        self.start = start
+        self.end = start + session.duration
+        self.next_start = None # Start of the next session, or None for the last session
+        self.interval = None # Most common time between the starts of consecutive sessions in the week and track
+        self.overlaps = [] # Sessions which are due to start while this one is still playing
+
+    def get_slack(self):
+        if self.next_start is None:
+            return None
+        return self.next_start - self.end
+
+    # Time left before the next session that talks could be moved into
+    def get_spare(self):
+        if self.next_start is None or self.interval is None:
+            return None
+        return min(self.next_start, self.start + self.interval) - self.end
+
+
+# Start times are read as cscw-tv.py reads them, and shown in UTC
+def load_sessions(sessions_file):
+    timetable_data = tv.load_timetable(sessions_file)
+    for column in ('w1_time_utc', 'w2_time_utc'):
+        timetable_data[column] = timetable_data[column].dt.tz_localize(None)
+    return timetable_data
+
+
+# Videos and total duration of each session, by (track, session number)
+def get_session_lengths(timetable_data, playlist, media):
+    lengths = {}
+    for session_number, session_name, track in zip(timetable_data['session_number'], timetable_data['session_name'], timetable_data['track']):
+        talks = []
+        unknown = 0
+        for video in playlist.get_session(session_number, track):
+            info = media.get_info(video.video_path)
+            label = video.paper.title.strip() if video.is_paper() and str(video.paper.title).strip() != '' else os.path.basename(video.video_path)
+            if info is None or info.duration is None:
+                unknown += 1
+            else:
+                talks.append((info.duration, label))
+        lengths[(int(track), int(session_number))] = SessionLength(int(session_number), str(session_name), talks, unknown, int(track))
+    return lengths
+
+
+# Projects the sessions of one week and track, sorted by start time. A session overlaps with every later session whose start time
+# is before its projected end, which are found by bisecting the sorted start times.
+def project_week(timetable_data, lengths, week, track = 1):
+    column = 'w' + str(week) + '_time_utc'
+    slots = sorted((SessionSlot(lengths[(track, int(session_number))], week, start.to_pydatetime())
+        for session_number, start, session_track in zip(timetable_data['session_number'], timetable_data[column], timetable_data['track'])
+        if session_track == track and not pd.isna(start)),
+        key = lambda slot: slot.start)
+
+    starts = [slot.start for slot in slots]
+    intervals = Counter(starts[i + 1] - starts[i] for i in range(len(starts) - 1))
+    interval = intervals.most_common(1)[0][0] if len(intervals) > 0 else None
+    for i, slot in enumerate(slots):
+        slot.interval = interval
+        if i + 1 < len(slots):
+            slot.next_start = starts[i + 1]
+        slot.overlaps = slots[i + 1:bisect.bisect_left(starts, slot.end, lo = i + 1)]
+    return slots
+
+
+# Suggests talks to move out of an overrunning session: the shortest single talk which is long enough, or else the longest talks
+# until the overrun is covered. Each talk goes to the session with the least spare time that still fits it in both weeks.
+def suggest_moves(session, overrun, spare_sessions):
+    talks = sorted(session.talks)
+    durations = [duration for duration, label in talks]
+    needed = overrun.total_seconds()
+
+    i = bisect.bisect_left(durations, needed)
+    if i < len(talks):
+        moves = [talks[i]]
+    else:
+        moves = []
+        for talk in reversed(talks):
+            moves.append(talk)
+            needed -= talk[0]
+            if needed <= 0:
+                break
+
+    suggestions = []
+    for duration, label in moves:
+        j = bisect.bisect_left(spare_sessions, (duration,))
+        target = None
+        if j < len(spare_sessions):
+            spare, target = spare_sessions.pop(j)
+            if spare > duration:
+                bisect.insort(spare_sessions, (spare - duration, target))
+        suggestions.append((duration, label, target))
+    return suggestions
+
+
+def format_duration(value):
+    seconds = int(value.total_seconds())
+    sign = '-' if seconds < 0 else ''
+    seconds = abs(seconds)
+    return sign + str(seconds // 3600) + ':' + '{:02d}'.format(seconds // 60 % 60) + ':' + '{:02d}'.format(seconds % 60)
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description='Projects the end time of each session and reports sessions which overrun.')
+    args_parser.add_argument('--scheduling-path', help='Directory containing sessions.csv, playlist.csv, papers.csv and media_index.json', default=scheduling_path)
+    args_parser.add_argument('--media-path', help='Directory containing the videos', default=media_path)
+    args_parser.add_argument('--all', help='List every session, not only those with problems', action='store_true')
+    args = args_parser.parse_args()
+
+    started = time.perf_counter()
+    papers = PaperCatalog(os.path.join(args.scheduling_path, 'papers.csv'))
+    playlist = PlaylistStore(os.path.join(args.scheduling_path, 'playlist.csv'), papers, args.media_path)
+    media = MediaIndex(os.path.join(args.scheduling_path, 'media_index.json'))
+    playlist.refresh()
+    if not media.refresh():
+        print('No media index found. Run media_preflight.py first to get the video durations.')
+        sys.exit(1)
+
+    timetable_data = load_sessions(os.path.join(args.scheduling_path, 'sessions.csv'))
+    lengths = get_session_lengths(timetable_data, playlist, media)
+    tracks = sorted(set(int(track) for track in timetable_data['track']))
+    weeks = {(week, track): project_week(timetable_data, lengths, week, track) for week in (1, 2) for track in tracks}
+
+    # Spare time of each session is the least it has in either week
+    slack = {}
+    for slots in weeks.values():
+        for slot in slots:
+            if slot.get_spare() is not None:
+                key = (slot.session.track, slot.session.session_number)
+                slack[key] = min(slack.get(key, slot.get_spare()), slot.get_spare())
+    spare_sessions = {track: sorted((value.total_seconds(), number) for (session_track, number), value in slack.items()
+        if session_track == track and value > timedelta(0)) for track in tracks}
+
+    overruns = {}
+    for (week, track), slots in weeks.items():
+        print('**Week ' + str(week) + ('' if len(tracks) == 1 else ', track ' + str(track)) + '**')
+        for slot in slots:
+            slot_slack = slot.get_slack()
+            problem = slot_slack is not None and slot_slack < timedelta(0)
+            if not (problem or args.all or slot.session.unknown > 0):
+                continue
+
+            line = ('\tSession ' + str(slot.session.session_number) + '. ' + slot.session.session_name + ': ' + str(slot.start) + ' to ' + str(slot.end)
+                + ' (' + format_duration(slot.session.duration) + ', ' + str(len(slot.session.talks)) + ' videos)')
+            if slot.session.unknown > 0:
+                line += '. ' + str(slot.session.unknown) + ' videos have no duration'
+            if problem:
+                line += '. OVERRUNS by ' + format_duration(-slot_slack) + ' into session ' + ', '.join(str(other.session.session_number) for other in slot.overlaps)
+                key = (track, slot.session.session_number)
+                overruns[key] = max(overruns.get(key, timedelta(0)), -slot_slack)
+            print(line)
+
+    if len(overruns) > 0:
+        print('**Suggested moves**')
+        for track, number in sorted(overruns):
+            session = lengths[(track, number)]
+            for duration, label, target in suggest_moves(session, overruns[(track, number)], spare_sessions[track]):
+                print('\tSession ' + str(number) + ('' if len(tracks) == 1 else ' (track ' + str(track) + ')') + ': move "' + label + '" (' + format_duration(timedelta(seconds = duration)) + ') to '
+                    + ('session ' + str(target) if target is not None else 'a new session. No session has enough spare time'))
+
+    print('**Results**\n\tSessions: ' + str(len(lengths)) + '\n\tOverrunning sessions: ' + str(len(overruns))
+        + '\n\tTime: ' + '{:.3f}'.format(time.perf_counter() - started) + ' s')
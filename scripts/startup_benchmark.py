@@ -0,0 +1,119 @@
+import argparse
+import csv
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+# Measures how long cscw-tv.py takes from a cold start to "Scheduling complete": importing the script, reading sessions.csv and
+# scheduling every session. Each run is a fresh interpreter, as after a crash. Results are appended to a CSV file, so that
+# startup time can be tracked across changes.
+
+root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sessions_file = os.path.join(root_path, 'scheduling', 'sessions.csv')
+results_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_benchmark.csv')
+
+# Run in a fresh interpreter. Mirrors main() up to "Scheduling complete", without connecting to Discord or starting playback.
+STARTUP = '''
+import time
+started = time.perf_counter()
+import asyncio, importlib, os, sys
+sys.path.insert(0, sys.argv[1])
+os.chdir(sys.argv[1])
+
+class Manager:
+    track = 1
+
+    async def start_session(self, **kwargs):
+        pass
+    async def prepare_session(self, **kwargs):
+        pass
+
+async def schedule():
+    tv = importlib.import_module('cscw-tv')
+    timetable_data = tv.load_timetable(sys.argv[2])
+    scheduler = tv.CSCWSchedulingHandler(Manager())
+    tv.schedule_sessions(scheduler, timetable_data, sessions_file = sys.argv[2])
+    scheduler.start()
+    print('Scheduling complete.')
+    return time.perf_counter() - started
+
+elapsed = asyncio.run(schedule())
+print('STARTUP_SECONDS', elapsed)
+'''
+
+
+# Writes a timetable with the given number of sessions, all in the future
+def generate_timetable(path, rows):
+    start = datetime.now(timezone.utc) + timedelta(days=1)
+    with open(path, 'w', newline='', encoding='utf-8') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(['session_number', 'session_name', 'w1_time_utc', 'w2_time_utc'])
+        for i in range(rows):
+            w1_time = start + timedelta(minutes=30 * i)
+            w2_time = w1_time + timedelta(days=7)
+            writer.writerow([i, 'Session ' + str(i), w1_time.strftime('%Y-%m-%d %H:%M'), w2_time.strftime('%Y-%m-%d %H:%M')])
+
+
+def run_once(timetable_file):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', STARTUP, root_path, timetable_file], capture_output=True, text=True)
+    wall_time = time.perf_counter() - started
+
+    if result.returncode != 0:
+        raise RuntimeError('Startup failed:\n' + result.stderr)
+
+    for line in result.stdout.splitlines():
+        if line.startswith('STARTUP_SECONDS'):
+            return float(line.split()[1]), wall_time
+
+    raise RuntimeError('Startup did not report its time:\n' + result.stdout)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root_path, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description='Time from a cold start of cscw-tv.py to "Scheduling complete".')
+    args_parser.add_argument('--runs', help='Number of runs. Defaults to 5', default=5, type=int)
+    args_parser.add_argument('--rows', help='Generate a timetable with this many sessions instead of using scheduling/sessions.csv', default=0, type=int)
+    args_parser.add_argument('--out', help='CSV file to append the results to', default=results_file)
+    args = args_parser.parse_args()
+
+    timetable_file = sessions_file
+    temp_dir = None
+    if args.rows > 0:
+        temp_dir = tempfile.TemporaryDirectory()
+        timetable_file = os.path.join(temp_dir.name, 'sessions.csv')
+        generate_timetable(timetable_file, args.rows)
+
+    startup_times = []
+    wall_times = []
+    for i in range(args.runs):
+        startup_time, wall_time = run_once(timetable_file)
+        startup_times.append(startup_time)
+        wall_times.append(wall_time)
+        print('Run ' + str(i + 1) + ': ' + '{:.3f}'.format(startup_time) + ' s to "Scheduling complete" (' + '{:.3f}'.format(wall_time) + ' s including interpreter start)')
+
+    median_startup = statistics.median(startup_times)
+    median_wall = statistics.median(wall_times)
+    print('**Results**\n\tMedian time to "Scheduling complete": ' + '{:.3f}'.format(median_startup) + ' s\n\tMedian process time: ' + '{:.3f}'.format(median_wall) + ' s')
+
+    write_header = not os.path.isfile(args.out)
+    with open(args.out, 'a', newline='', encoding='utf-8') as outfile:
+        writer = csv.writer(outfile)
+        if write_header:
+            writer.writerow(['date', 'commit', 'timetable', 'runs', 'median_startup_seconds', 'median_process_seconds'])
+        writer.writerow([datetime.now().isoformat(timespec='seconds'), git_commit(), os.path.basename(timetable_file) if args.rows == 0 else str(args.rows) + ' generated sessions',
+            args.runs, '{:.4f}'.format(median_startup), '{:.4f}'.format(median_wall)])
+    print('Results appended to ' + os.path.abspath(args.out))
+
+    if temp_dir is not None:
+        temp_dir.cleanup()
@@ -0,0 +1,118 @@
+import argparse
+import csv
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+# Generates a conference with the given number of papers: papers.csv, authors.csv, playlist.csv and sessions.csv in the same
+# format as the real files, and optionally empty video and subtitle files and a media index with video durations. Used by the
+# benchmarks (see benchmark.py) and for trying out changes without the real conference data. The same seed gives the same files.
+# With several tracks, sessions are dealt to the tracks in turn and the tracks run at the same time, and the files get a track column.
+
+# PCS cycle in the video file names and papers.csv, and the matching cycle name in authors.csv (see data.Paper.map_cycle)
+CYCLES = [('cscw21b', 'jan'), ('cscw21d', 'apr'), ('cscw22a', 'jul21'), ('cscw22b', 'jan22')]
+TIME_FORMAT = '%Y-%m-%d %H:%M'
+
+WORDS = ['collaborative', 'online', 'communities', 'remote', 'work', 'social', 'media', 'crowdsourcing', 'platform', 'design',
+    'understanding', 'health', 'misinformation', 'moderation', 'participation', 'creative', 'learning', 'privacy', 'civic', 'data',
+    'care', 'accessibility', 'labor', 'gig', 'teams', 'trust', 'algorithmic', 'fairness', 'wikipedia', 'open', 'source', 'discord',
+    'video', 'streaming', 'pandemic', 'family', 'youth', 'volunteer', 'infrastructure', 'sensemaking', 'awareness', 'conversational']
+FIRST_NAMES = ['Alex', 'Maria', 'Wei', 'Priya', 'Jonas', 'Fatima', 'Kenji', 'Olga', 'Diego', 'Amara', 'Liam', 'Sofia', 'Hyun-woo',
+    'Noor', 'Mateo', 'Ingrid', 'Chen', 'Aisha', 'Tomás', 'Yuki', 'Émilie', 'Rahul', 'Zanele', 'Björn']
+LAST_NAMES = ['Smith', 'García', 'Wang', 'Patel', 'Müller', 'Haddad', 'Tanaka', 'Ivanova', 'López', 'Okafor', 'Murphy', 'Rossi',
+    'Kim', 'Rahman', 'Silva', 'Larsen', 'Li', 'Hassan', "O'Brien", 'Sato', 'Dubois', 'Gupta', 'Dlamini', 'Andersson']
+
+
+class SyntheticConference:
+    def __init__(self, papers, seed = 1, talks_per_session = (4, 6), session_minutes = 90, start = datetime(2026, 11, 2, 14), tracks = 1):
+        self.random = random.Random(seed)
+        self.tracks = tracks
+        self.papers = []
+        self.authors = []
+        self.playlist = []
+        self.sessions = []
+        self.durations = {} # Seconds, by video file name
+
+        paper_ids = {cycle: self.random.sample(range(100, 100 + 20 * papers), papers) for cycle, _ in CYCLES}
+        session_number = 0
+        talk_number = 0
+        talks = 0
+        for i in range(papers):
+            if talk_number == talks:
+                session_number += 1
+                talk_number = 0
+                talks = self.random.randint(*talks_per_session)
+            talk_number += 1
+
+            cycle, author_cycle = CYCLES[i % len(CYCLES)]
+            paper_id = paper_ids[cycle][i]
+            names = [self.random.choice(FIRST_NAMES) + ' ' + self.random.choice(LAST_NAMES) for _ in range(self.random.randint(1, 8))]
+            title = ' '.join(self.random.choice(WORDS) for _ in range(self.random.randint(4, 12))).capitalize()
+            file_name = cycle + '_' + str(paper_id) + '.mp4'
+
+            track = self.get_track(session_number)
+            self.papers.append([title, cycle.upper(), paper_id, session_number, talk_number, self.random.choice(names)] + track)
+            self.authors.append([author_cycle, paper_id] + names)
+            self.playlist.append([file_name, session_number, True, paper_id, cycle, talk_number] + track)
+            self.durations[file_name] = round(self.random.uniform(6, 14) * 60, 3)
+
+        # Sessions of a track follow each other during the day, eight a day, and run again a week later (or once week 1 is over, for
+        # large conferences)
+        track_sessions = -(-session_number // tracks)
+        week = timedelta(days = max(7, -(-track_sessions // 8)))
+        for number in range(1, session_number + 1):
+            day, slot = divmod((number - 1) // tracks, 8)
+            w1_time = start + timedelta(days = day, minutes = slot * session_minutes)
+            w2_time = w1_time + week
+            name = ' '.join(self.random.choice(WORDS) for _ in range(self.random.randint(1, 3))).title()
+            self.sessions.append([number, name, w1_time.strftime(TIME_FORMAT), w2_time.strftime(TIME_FORMAT)] + self.get_track(number))
+
+    # Track column of a session, which is only written with several tracks
+    def get_track(self, session_number):
+        return [(session_number - 1) % self.tracks + 1] if self.tracks > 1 else []
+
+    def write(self, scheduling_path, media_path = None, media_index = False):
+        os.makedirs(scheduling_path, exist_ok = True)
+        max_authors = max((len(row) - 2 for row in self.authors), default = 0)
+        track = ['track'] if self.tracks > 1 else []
+
+        files = [
+            ('papers.csv', ['title', 'cycle', 'paper_id', 'session_number', 'talk_number', 'presenter'] + track, self.papers),
+            ('authors.csv', ['cycle', 'id'] + ['author_' + str(i) for i in range(1, max_authors + 1)], self.authors),
+            ('playlist.csv', ['file_name', 'session_number', 'is_paper', 'paper_id', 'cycle', 'play_order'] + track, self.playlist),
+            ('sessions.csv', ['session_number', 'session_name', 'w1_time_utc', 'w2_time_utc'] + track, self.sessions)
+        ]
+        for name, header, rows in files:
+            with open(os.path.join(scheduling_path, name), 'w', newline = '', encoding = 'utf-8') as outfile:
+                writer = csv.writer(outfile)
+                writer.writerow(header)
+                writer.writerows(rows)
+
+        if media_path is not None:
+            os.makedirs(media_path, exist_ok = True)
+            for file_name in self.durations:
+                for path in (file_name, os.path.splitext(file_name)[0] + '.srt'):
+                    open(os.path.join(media_path, path), 'w').close()
+
+        # In the format written by media_preflight.py
+        if media_index:
+            files = {file_name: {'size': 0, 'mtime': 0, 'subtitle_mtime': 0, 'duration': duration, 'video_codec': 'avc1', 'audio_codec': 'mp4a',
+                'fast_start': True, 'subtitle_cues': 0, 'problems': []} for file_name, duration in self.durations.items()}
+            with open(os.path.join(scheduling_path, 'media_index.json'), 'w') as outfile:
+                json.dump({'version': 1, 'files': files}, outfile)
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description='Generates the schedule files of a synthetic conference.')
+    args_parser.add_argument('--papers', help='Number of papers. Defaults to 500', default=500, type=int)
+    args_parser.add_argument('--out', help='Directory to write the files to, in scheduling/ and videos/', default=os.path.join('..', 'synthetic'))
+    args_parser.add_argument('--seed', help='Random seed. Defaults to 1', default=1, type=int)
+    args_parser.add_argument('--videos', help='Also create empty video and subtitle files', action='store_true')
+    args_parser.add_argument('--media-index', help='Also write a media index with random video durations', action='store_true')
+    args_parser.add_argument('--tracks', help='Number of tracks running at the same time. Defaults to 1', default=1, type=int)
+    args = args_parser.parse_args()
+
+    conference = SyntheticConference(args.papers, args.seed, tracks = args.tracks)
+    conference.write(os.path.join(args.out, 'scheduling'), os.path.join(args.out, 'videos') if args.videos else None, args.media_index)
+    print('**Results**\n\tPapers: ' + str(len(conference.papers)) + '\n\tSessions: ' + str(len(conference.sessions)) + '\n\tTracks: ' + str(args.tracks) + '\n\tWritten to: ' + os.path.abspath(args.out))
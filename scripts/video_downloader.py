@@ -1,23 +1,128 @@
 import requests
+import argparse
 import csv
+import hashlib
+import json
 import os
 import os.path
-import pathlib
-import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 
-def download_file_from_google_drive(id, destination):
-    URL = "https://docs.google.com/uc?export=download"
+URL = "https://docs.google.com/uc?export=download"
+CHUNK_SIZE = 32768
+RETRIES = 3
+RETRY_DELAY = 2 # Seconds, doubled after each failed attempt
 
+
+# Totals across all downloads, printed as a single progress line
+class Progress:
+    INTERVAL = 1 # Seconds between progress lines
+
+    def __init__(self, total_files):
+        self.lock = threading.Lock()
+        self.total_files = total_files
+        self.done_files = 0
+        self.failed_files = 0
+        self.skipped_files = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+        self.printed = 0
+
+    def add_bytes(self, count):
+        with self.lock:
+            self.bytes += count
+            now = time.perf_counter()
+            if now - self.printed >= Progress.INTERVAL:
+                self.printed = now
+                print(self.describe(), end='\r', flush=True)
+
+    def file_done(self, skipped = False, failed = False):
+        with self.lock:
+            self.done_files += 1
+            if skipped:
+                self.skipped_files += 1
+            if failed:
+                self.failed_files += 1
+
+    def describe(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.bytes / elapsed / 1e6 if elapsed > 0 else 0
+        return ('Files: ' + str(self.done_files) + '/' + str(self.total_files) + ', downloaded ' + '{:.1f}'.format(self.bytes / 1e6) + ' MB at '
+            + '{:.1f}'.format(rate) + ' MB/s')
+
+
+# Size and SHA-256 of each downloaded file, kept in a JSON file next to the downloads. Written after every completed file.
+class Manifest:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.files = {}
+        try:
+            with open(path, 'r') as openfile:
+                self.files = json.load(openfile)
+        except (OSError, ValueError):
+            pass
+
+    def record(self, name, size, sha256):
+        with self.lock:
+            self.files[name] = {'size': size, 'sha256': sha256}
+            temp_file = self.path + '.tmp'
+            with open(temp_file, 'w') as outfile:
+                json.dump(self.files, outfile, indent=1, sort_keys=True)
+            os.replace(temp_file, self.path)
+
+
+# One requests session for all workers, so that connections are reused. The pool holds a connection for each worker.
+def create_session(workers):
     session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
 
-    response = session.get(URL, params = { 'id' : id }, stream = True)
+# Downloads the file to destination + '.part', resuming from the end of an existing .part file with a Range request, and renames
+# it to destination once it is complete. A part file which already holds the whole file (e.g., the rename was interrupted) gets a
+# 416 response, and is renamed if its size matches the one in Content-Range. Returns the size and SHA-256 of the file.
+def download_file_from_google_drive(session, url, id, destination, progress):
+    part_file = destination + '.part'
+    offset = os.path.getsize(part_file) if os.path.isfile(part_file) else 0
+    headers = { 'Range': 'bytes=' + str(offset) + '-' } if offset > 0 else {}
+
+    response = session.get(url, params = { 'id' : id }, headers = headers, stream = True)
     token = get_confirm_token(response)
 
     if token:
+        response.close()
         params = { 'id' : id, 'confirm' : 1 }
-        response = session.get(URL, params = params, stream = True)
+        response = session.get(url, params = params, headers = headers, stream = True)
+
+    with response:
+        if offset > 0 and response.status_code == 416:
+            expected_size = get_range_size(response)
+            if expected_size != offset:
+                os.remove(part_file)
+                raise IOError('Part file has ' + str(offset) + ' bytes but the file has ' + (str(expected_size) + ' bytes' if expected_size is not None else 'an unknown size') + '. Starting again')
+            size, sha256 = hash_file(part_file)
+        else:
+            # The server does not support ranges (or the part file is no longer valid). Start again.
+            if offset > 0 and response.status_code != 206:
+                offset = 0
+            response.raise_for_status()
+
+            expected_size = None
+            if 'Content-Length' in response.headers:
+                expected_size = offset + int(response.headers['Content-Length'])
 
-    save_response_content(response, destination)
+            size, sha256 = save_response_content(response, part_file, offset, progress)
+
+    if expected_size is not None and size != expected_size:
+        raise IOError('Incomplete download: got ' + str(size) + ' of ' + str(expected_size) + ' bytes')
+
+    os.replace(part_file, destination)
+    return size, sha256
 
 def get_confirm_token(response):
     for key, value in response.cookies.items():
@@ -26,13 +131,48 @@ def get_confirm_token(response):
 
     return None
 
-def save_response_content(response, destination):
-    CHUNK_SIZE = 32768
+# Size of the whole file from a 416 response's Content-Range header ('bytes */size'), or None if it is not given
+def get_range_size(response):
+    content_range = response.headers.get('Content-Range', '')
+    try:
+        return int(content_range[content_range.rindex('/') + 1:])
+    except ValueError:
+        return None
+
+# Returns the size and SHA-256 of a file which is already complete
+def hash_file(path):
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+
+    return size, digest.hexdigest()
 
-    with open(destination, "wb") as f:
+# Appends the response to the file from the offset, and returns the total size and SHA-256 of the file.
+def save_response_content(response, destination, offset, progress):
+    digest = hashlib.sha256()
+    mode = 'r+b' if offset > 0 else 'wb'
+
+    with open(destination, mode) as f:
+        # Hash the part that was downloaded before
+        while f.tell() < offset:
+            digest.update(f.read(min(CHUNK_SIZE, offset - f.tell())))
+        f.truncate(offset)
+
+        size = offset
         for chunk in response.iter_content(CHUNK_SIZE):
             if chunk: # filter out keep-alive new chunks
                 f.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+                progress.add_bytes(len(chunk))
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    return size, digest.hexdigest()
 
 IDX_TIME = 2
 IDX_LINK_VID = 2
@@ -50,24 +190,48 @@ def get_paper_id(pcs_url):
         sub_id = sub_id[:sub_id.find('/')]
     return cycle_id+"_"+sub_id
 
-def down_file(id, fpath):
+# Downloads a file unless it is already complete. Interrupted downloads are retried, continuing from where they stopped.
+def down_file(session, url, id, fpath, manifest, progress):
     if os.path.isfile(fpath):
         print("Skipped:", fpath)
-    else:
-        download_file_from_google_drive(id, fpath)
+        progress.file_done(skipped = True)
+        return True
+
+    delay = RETRY_DELAY
+    for attempt in range(1, RETRIES + 1):
+        try:
+            size, sha256 = download_file_from_google_drive(session, url, id, fpath, progress)
+            manifest.record(os.path.basename(fpath), size, sha256)
+            progress.file_done()
+            print("Downloaded:", fpath, str(size), "bytes")
+            return True
+        except (requests.RequestException, IOError) as ex:
+            print("Download of " + fpath + " failed (attempt " + str(attempt) + " of " + str(RETRIES) + "). Reason: " + str(ex))
+            if attempt < RETRIES:
+                time.sleep(delay)
+                delay *= 2
+
+    progress.file_done(failed = True)
+    return False
 
-def down_files(d):
+# Gets the subtitle and video downloads for a row of links.csv, as (id, file path) pairs
+def get_downloads(d, out_path):
     vid_id = d[IDX_LINK_VID][d[IDX_LINK_VID].find("id=")+3:]
     srt_id = d[IDX_LINK_SRT][d[IDX_LINK_SRT].find("id=")+3:]
     paper_id = d[IDX_PAPER_ID]
-    print(paper_id)
-    down_file(srt_id, 'files/'+paper_id+".srt")
-    down_file(vid_id, 'files/'+paper_id+".mp4")
+    return [(srt_id, os.path.join(out_path, paper_id+".srt")), (vid_id, os.path.join(out_path, paper_id+".mp4"))]
 
 
 if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description='Downloads the presentation videos and subtitles listed in links.csv.')
+    args_parser.add_argument('--links', help='CSV file with the links', default=os.path.join('..', 'scheduling', 'links.csv'))
+    args_parser.add_argument('--out', help='Directory to download to. Defaults to files', default='files')
+    args_parser.add_argument('--url-base', help='Download URL, which is given the file id as the id parameter. Defaults to Google Drive', default=URL)
+    args_parser.add_argument('--workers', help='Number of concurrent downloads. Defaults to 4', default=4, type=int)
+    args = args_parser.parse_args()
+
     valid_d = []
-    with open (os.path.join('..', 'scheduling', 'links.csv')) as csvf:
+    with open (args.links) as csvf:
         reader = csv.reader(csvf, delimiter=',')
         next(reader, None)  # skip the headers
         for row in reader:
@@ -93,9 +257,17 @@ if __name__ == "__main__":
         valid_d.reverse()
 
         # download
-        if (True):
-            i = 1
-            for d in valid_d:
-                print (i)
-                i += 1
-                down_files(d)
\ No newline at end of file
+        os.makedirs(args.out, exist_ok=True)
+        downloads = [download for d in valid_d for download in get_downloads(d, args.out)]
+        progress = Progress(len(downloads))
+        manifest = Manifest(os.path.join(args.out, 'manifest.json'))
+        session = create_session(args.workers)
+
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(down_file, session, args.url_base, id, fpath, manifest, progress) for id, fpath in downloads]
+            for future in as_completed(futures):
+                future.result()
+
+        print(progress.describe())
+        print('**Results**\n\tFiles: ' + str(progress.total_files) + '\n\tSkipped (already downloaded): ' + str(progress.skipped_files)
+            + '\n\tFailed: ' + str(progress.failed_files) + '\n\tManifest: ' + os.path.abspath(manifest.path))
@@ -0,0 +1,424 @@
+import asyncio, contextlib, importlib, os, random, selectors, sys, time
+from datetime import timedelta, timezone
+from fakes import FakePlayer, FakeDiscordClient
+from bot import Bot
+from data import ConferenceData
+from metrics import REGISTRY
+
+
+# Dry run of the whole timetable (cscw-tv.py --simulate). The real scheduler and manager run on an event loop with a virtual
+# clock: whenever nothing is ready to run, the clock jumps straight to the next timer instead of waiting for it, so two weeks of
+# sessions take seconds. Playback and Discord are replaced by the fakes in fakes.py, and each video plays for its duration in
+# the media index (see scripts/media_preflight.py). Playback crashes and restarts of the script can be injected at random times.
+# The report lists sessions which started late or not at all, sessions which were still on air when the next one was due, how
+# playback resumed after each crash and restart, and how many messages were sent. The script exits with status 1 if any session
+# started late or not at all, overran or was not resumed, so that it can be run as a check on every change.
+# Each track is simulated with its own manager, scheduler and player, on the same clock, Discord client and conference data, as
+# main() runs them. Crashes are injected into the player of one track, and restarts restart all tracks.
+
+media_path = 'videos'
+scheduling_path = 'scheduling'
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class VirtualClock:
+    def __init__(self, start):
+        self.start = start # Time when the simulation starts, as an aware datetime
+        self.elapsed = 0.0
+        self.loop = None
+
+    def time(self):
+        return self.elapsed
+
+    def advance(self, seconds):
+        self.elapsed += seconds
+
+    def now(self, time_zone = timezone.utc):
+        return (self.start + timedelta(seconds = self.elapsed)).astimezone(time_zone)
+
+    # Runs the coroutine function at the given time, in place of an APScheduler date job
+    def run_at(self, when, function, **kwargs):
+        delay = max(0, (when - self.now()).total_seconds())
+        self.loop.call_later(delay, lambda: self.loop.create_task(function(**kwargs)))
+
+    def create_loop(self):
+        self.loop = VirtualEventLoop(self)
+        return self.loop
+
+
+# Selector which moves the virtual clock forward to the next timer instead of waiting for it. It only blocks when there is no
+# timer at all, until a thread wakes up the event loop.
+class VirtualSelector:
+    def __init__(self, clock):
+        self.clock = clock
+        self.selector = selectors.DefaultSelector()
+
+    def select(self, timeout = None):
+        events = self.selector.select(0)
+        if len(events) > 0:
+            return events
+        if timeout is None:
+            return self.selector.select(None)
+
+        self.clock.advance(timeout)
+        return events
+
+    def __getattr__(self, name):
+        return getattr(self.selector, name)
+
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock):
+        self.clock = clock
+        super().__init__(VirtualSelector(clock))
+
+    def time(self):
+        return self.clock.time()
+
+    # Runs blocking work (such as status file writes) right away instead of in a thread, so that the clock cannot move on while it runs
+    def run_in_executor(self, executor, func, *args):
+        future = self.create_future()
+        try:
+            future.set_result(func(*args))
+        except Exception as ex:
+            future.set_exception(ex)
+        return future
+
+
+# Simulates one track
+class Simulation:
+    GUILD_ID = 1
+    TV_CHANNEL = 'tv' # Of track 1. The other tracks are announced in tv-<track>.
+    GRACE_PERIOD = 10 # Seconds, as in main()
+    PROGRESS_INTERVAL = 5 # Seconds between progress events. The playback process reports every second, but the position is only saved every 5 s.
+    DEFAULT_DURATION = 600 # Seconds, for videos which are not in the media index
+    CHECK_INTERVAL = 60 # Seconds between checks for the end of the timetable
+
+    def __init__(self, tv, clock, timetable_data, args, client, data, track = 1):
+        self.tv = tv
+        self.clock = clock
+        self.timetable_data = timetable_data
+        self.args = args
+        self.client = client
+        self.data = data
+        self.track = track
+        self.tv_channel = Simulation.get_tv_channel(track)
+        self.sessions_file = os.path.join(scheduling_path, 'sessions.csv')
+        self.filler_video = os.path.join(media_path, 'cscw_filler.mp4')
+        self.media = data.media
+        self.missing_durations = set()
+        self.status = None # Last status written by the manager, kept across restarts
+        self.finished = False
+
+        self.manager = None
+        self.handler = None
+        self.player = None
+        self.filler_task = None
+
+        self.scheduled = set() # (session number, start time) of every session of the track in the timetable
+        for session_number, w1_time, w2_time, session_track in zip(timetable_data['session_number'], timetable_data['w1_time_utc'],
+                timetable_data['w2_time_utc'], timetable_data['track']):
+            for session_time in (w1_time, w2_time):
+                if session_track == track and not session_time is None and session_time == session_time: # Not NaT
+                    self.scheduled.add((int(session_number), session_time.to_pydatetime()))
+        self.starts = [] # (ScheduledBroadcast, time it was handed over to)
+        self.preemptions = [] # (ScheduledBroadcast, time, seconds of the session left, index of the next start)
+        self.crashes = [] # (time, session number, playback number, position in s, player, index of the next playlist)
+        self.restarts = [] # (time, session number, playback number, position in s, player)
+        self.items = [] # (time, player, item event, ScheduledBroadcast) of every video which started
+
+    @staticmethod
+    def get_tv_channel(track):
+        return Simulation.TV_CHANNEL if track == 1 else Simulation.TV_CHANNEL + '-' + str(track)
+
+    def get_duration(self, video):
+        info = self.media.get_info(video)
+        if info is None or info.duration is None:
+            if video != self.filler_video:
+                self.missing_durations.add(os.path.basename(video))
+            return Simulation.DEFAULT_DURATION
+        return info.duration
+
+    # Status journal which keeps the status in memory. Writing it to disk would take most of the run time.
+    def create_journal(self):
+        simulation = self
+
+        class MemoryJournal(self.tv.StatusJournal):
+            def write(self, status):
+                simulation.status = dict(status)
+
+            def load(self):
+                return simulation.status
+
+        return MemoryJournal(self.tv.get_status_file(self.track))
+
+    def get_position(self):
+        return self.player.get_time() / 1000 if self.manager.current_videos is not None else None
+
+    # Starts the bot, as main() does after a start or restart
+    async def start(self):
+        tv = self.tv
+        bot = Bot('', Simulation.GUILD_ID, client = self.client)
+        await bot.on_ready()
+
+        self.player = FakePlayer(self.get_duration, progress_interval = Simulation.PROGRESS_INTERVAL)
+        self.manager = tv.CSCWManager(bot,
+            bot.get_channel_by_name(self.tv_channel).id,
+            os.path.join(scheduling_path, 'playlist.csv'),
+            os.path.join(scheduling_path, 'papers.csv'),
+            os.path.join(scheduling_path, 'authors.csv'),
+            media_path,
+            filler_video = self.filler_video,
+            media_index_file = os.path.join(scheduling_path, 'media_index.json'),
+            player = self.player,
+            clock = self.clock,
+            track = self.track,
+            data = self.data)
+        self.manager.status_journal = self.create_journal()
+        self.manager.load_playback_status()
+
+        self.handler = tv.CSCWSchedulingHandler(self.manager, timezone.utc, Simulation.GRACE_PERIOD, warmup_minutes = self.args.warmup,
+            policy = self.args.preempt, max_overrun_minutes = self.args.max_overrun, clock = self.clock)
+        player, broadcasts = self.player, self.handler.broadcasts
+        player.add_item_callback(lambda event: self.items.append((self.clock.now(), player, event, broadcasts.current)))
+        self.watch(self.handler.broadcasts)
+        tv.schedule_resume(self.handler, self.manager)
+        tv.schedule_sessions(self.handler, self.timetable_data, timezone.utc, self.sessions_file)
+        self.manager.load_data()
+        self.handler.start()
+        self.filler_task = asyncio.create_task(self.manager.play_filler())
+
+    # Stops the bot without cleaning up, as if the script was killed. Status writes which were still waiting are lost.
+    def stop(self):
+        broadcasts = self.handler.broadcasts
+        for task in (broadcasts.runner, broadcasts.task, self.filler_task, self.manager.status_journal.writer):
+            if task is not None:
+                task.cancel()
+        for worker in self.manager.bot.outbound.workers.values():
+            worker.cancel()
+        self.player.close()
+
+    def watch(self, broadcasts):
+        on_start = broadcasts.on_start
+
+        def record_start(broadcast):
+            self.starts.append((broadcast, self.clock.now()))
+            on_start(broadcast)
+
+        broadcasts.on_start = record_start
+        broadcasts.on_preempt = self.on_preempt
+
+    def on_preempt(self, broadcast):
+        videos = self.manager.current_videos
+        index = self.manager.current_index
+        left = 0
+        if videos is not None and index is not None:
+            left = max(0, self.get_duration(videos[index].video_path) - self.player.get_time() / 1000)
+            left += sum(self.get_duration(video.video_path) for video in videos[index + 1:])
+        self.preemptions.append((broadcast, self.clock.now(), left, len(self.starts)))
+
+    async def crash(self):
+        status = self.manager.playback_status
+        self.crashes.append((self.clock.now(), status.session_number, status.playback_number, self.get_position(), self.player, len(self.player.played)))
+        self.player.crash()
+
+    async def restart(self):
+        if self.finished:
+            return
+        status = self.manager.playback_status
+        self.restarts.append((self.clock.now(), status.session_number, status.playback_number, self.get_position(), None))
+        self.stop()
+        await self.start()
+        self.restarts[-1] = self.restarts[-1][:4] + (self.player,)
+
+    async def run(self):
+        last = max(session_time for _, session_time in self.scheduled)
+
+        await self.start()
+        while True:
+            await asyncio.sleep(Simulation.CHECK_INTERVAL)
+            if self.clock.now() > last and len(self.handler.broadcasts.queue) == 0 and self.manager.current_videos is None:
+                break
+        self.finished = True
+        self.stop()
+
+    @staticmethod
+    def format_time(value):
+        return value.strftime(TIME_FORMAT)
+
+    @staticmethod
+    def format_seconds(seconds):
+        seconds = int(round(seconds))
+        return str(seconds // 3600) + ':' + '{:02d}'.format(seconds // 60 % 60) + ':' + '{:02d}'.format(seconds % 60)
+
+    @staticmethod
+    def get_peak(times, window = 60):
+        peak = 0
+        first = 0
+        for i, sent_at in enumerate(times):
+            while sent_at - times[first] >= window:
+                first += 1
+            peak = max(peak, i - first + 1)
+        return peak
+
+    # Playback number and position (in s) that a playlist started at
+    @staticmethod
+    def get_start(player, index):
+        if index >= len(player.played):
+            return None, None
+        videos, start_index, position = player.played[index]
+        return os.path.basename(videos[start_index]), position / 1000
+
+    # Prints the report of the track. Returns the number of problems found.
+    def report(self):
+        # A session counts as started once its first video plays. It may have been handed over to and preempted straight away.
+        started = set((broadcast.session_number, broadcast.time) for item_at, player, event, broadcast in self.items
+            if broadcast is not None and broadcast.play_number == 0 and event['video'] != self.filler_video)
+        late = []
+        for broadcast, started_at in self.starts:
+            lateness = (started_at - broadcast.time).total_seconds()
+            if lateness > Simulation.GRACE_PERIOD:
+                late.append((broadcast, lateness))
+        missed = sorted(self.scheduled - set(started), key = lambda session: session[1])
+        problems = len(missed) + len(late) + len(self.preemptions)
+        warmups = {}
+        for key, value in REGISTRY.counter('session_warmup_total', 'Sessions started, by whether the warm-up could be used').snapshot():
+            labels = dict(key)
+            if labels.get('track') == str(self.track):
+                warmups[labels.get('result')] = warmups.get(labels.get('result'), 0) + value
+
+        print('**Sessions**\n\tScheduled: ' + str(len(self.scheduled)) + '\n\tStarted: ' + str(len(started)) + '\n\tStarted from a warm-up: ' + str(warmups.get('hit', 0))
+            + ', prepared at the start: ' + str(warmups.get('miss', 0)))
+        for session_number, session_time in missed:
+            print('\tNOT STARTED: session ' + str(session_number) + ' at ' + Simulation.format_time(session_time))
+        for broadcast, lateness in late:
+            print('\tLATE: session ' + str(broadcast.session_number) + ' due at ' + Simulation.format_time(broadcast.time) + ' started ' + '{:.0f}'.format(lateness) + ' s late')
+
+        print('**Overruns**\n\tSessions still on air when the next one was due: ' + str(len(self.preemptions)))
+        for broadcast, preempted_at, left, next_start in self.preemptions:
+            line = '\tSession ' + str(broadcast.session_number) + '. ' + broadcast.session_name + ' (' + Simulation.format_time(broadcast.time) + '): ' + Simulation.format_seconds(left) + ' left'
+            if next_start < len(self.starts):
+                line += ' when session ' + str(self.starts[next_start][0].session_number) + ' was due'
+            print(line)
+
+        print('**Crashes**\n\tInjected: ' + str(len(self.crashes)))
+        for crashed_at, session_number, playback_number, position, player, next_playlist in self.crashes:
+            line = '\t' + Simulation.format_time(crashed_at) + ': '
+            if position is None:
+                print(line + 'nothing on air')
+                continue
+            video, resumed_at = Simulation.get_start(player, next_playlist)
+            line += 'session ' + str(session_number) + ', video # ' + str(playback_number) + ' at ' + '{:.0f}'.format(position) + ' s. '
+            if video is None:
+                line += 'NOT RESUMED'
+                problems += 1
+            else:
+                line += 'Resumed ' + video + ' at ' + '{:.0f}'.format(resumed_at) + ' s'
+            print(line)
+
+        print('**Restarts**\n\tInjected: ' + str(len(self.restarts)))
+        for restarted_at, session_number, playback_number, position, player in self.restarts:
+            line = '\t' + Simulation.format_time(restarted_at) + ': '
+            if position is None:
+                print(line + 'nothing on air')
+                continue
+            line += 'session ' + str(session_number) + ', video # ' + str(playback_number) + ' at ' + '{:.0f}'.format(position) + ' s. '
+            resumed = [(item_at, event) for item_at, item_player, event, broadcast in self.items if item_player is player and event['video'] != self.filler_video]
+            index = next((i for i, (videos, start_index, start_position) in enumerate(player.played) if videos != [self.filler_video]), None) if player is not None else None
+            if len(resumed) == 0 or index is None:
+                line += 'NOT RESUMED'
+                problems += 1
+            else:
+                video, resumed_at = Simulation.get_start(player, index)
+                line += 'Resumed ' + video + ' at ' + '{:.0f}'.format(resumed_at) + ' s after ' + '{:.0f}'.format((resumed[0][0] - restarted_at).total_seconds()) + ' s off air'
+            print(line)
+        return problems
+
+
+# Injects the crashes and restarts within the first half hour of randomly chosen sessions. A crash is injected into the player of
+# the session's track. A restart restarts every track, as they all run in the same script.
+def inject_failures(simulations, clock, args):
+    rng = random.Random(args.seed)
+    sessions = sorted((session_number, session_time, simulation.track) for simulation in simulations for session_number, session_time in simulation.scheduled)
+    by_track = {simulation.track: simulation for simulation in simulations}
+
+    async def restart():
+        for simulation in simulations:
+            await simulation.restart()
+
+    for _ in range(args.crashes):
+        session_number, session_time, track = rng.choice(sessions)
+        clock.run_at(session_time + timedelta(seconds = rng.uniform(0, 1800)), by_track[track].crash)
+    for _ in range(args.restarts):
+        session_number, session_time, track = rng.choice(sessions)
+        clock.run_at(session_time + timedelta(seconds = rng.uniform(0, 1800)), restart)
+
+
+async def run_tracks(simulations, clock, args):
+    inject_failures(simulations, clock, args)
+    await asyncio.gather(*(simulation.run() for simulation in simulations))
+
+
+# Prints the messages sent to all channels
+def report_messages(client, tv_channels):
+    channels = list(client.channels.values())
+    tv_sent = sum(len(channel.sent) for channel in channels if channel.name in tv_channels)
+    session_sent = sum(len(channel.sent) for channel in channels if channel.name not in tv_channels)
+    peak = max((Simulation.get_peak(channel.sent_at) for channel in channels), default = 0)
+    print('**Messages**\n\tSent: ' + str(tv_sent + session_sent) + '\n\tTV channels: ' + str(tv_sent) + '\n\tSession channels: ' + str(session_sent)
+        + '\n\tMost messages to one channel in a minute: ' + str(peak))
+
+
+# Runs the simulation and prints the report. Returns the number of problems found.
+def run_simulation(args):
+    tv = importlib.import_module('cscw-tv')
+    timetable_data = tv.load_timetable(os.path.join(scheduling_path, 'sessions.csv'))
+    times = [session_time for column in ('w1_time_utc', 'w2_time_utc') for session_time in timetable_data[column] if session_time == session_time]
+    if len(times) == 0:
+        print('There are no sessions to simulate.')
+        return 0
+
+    clock = VirtualClock(min(times).to_pydatetime() - timedelta(minutes = args.warmup + 1))
+    loop = clock.create_loop()
+    asyncio.set_event_loop(loop)
+
+    # One Discord client and one copy of the conference data for all tracks, as in main()
+    tracks = tv.get_tracks(timetable_data)
+    client = FakeDiscordClient()
+    client.add_guild(Simulation.GUILD_ID, [Simulation.get_tv_channel(track) for track in tracks] + [Bot.get_valid_name(str(session_name), int(session_number))
+        for session_number, session_name in zip(timetable_data['session_number'], timetable_data['session_name'])])
+    data = ConferenceData(os.path.join(scheduling_path, 'playlist.csv'), os.path.join(scheduling_path, 'papers.csv'), os.path.join(scheduling_path, 'authors.csv'),
+        media_path, os.path.join(scheduling_path, 'media_index.json'), os.path.join(scheduling_path, 'conference_data.pickle'))
+    data.refresh()
+    simulations = [Simulation(tv, clock, timetable_data, args, client, data, track) for track in tracks]
+    simulations = [simulation for simulation in simulations if len(simulation.scheduled) > 0]
+
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            try:
+                loop.run_until_complete(run_tracks(simulations, clock, args))
+            finally:
+                tasks = asyncio.all_tasks(loop)
+                for task in tasks:
+                    task.cancel()
+                if len(tasks) > 0:
+                    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions = True))
+                asyncio.set_event_loop(None)
+                loop.close()
+    elapsed = time.perf_counter() - started
+
+    print('**Simulation**\n\t' + Simulation.format_time(clock.start) + ' to ' + Simulation.format_time(clock.now()) + ', policy ' + args.preempt
+        + ', ' + str(len(simulations)) + (' track' if len(simulations) == 1 else ' tracks') + '\n\tRan in ' + '{:.2f}'.format(elapsed) + ' s')
+    missing_durations = set().union(*(simulation.missing_durations for simulation in simulations))
+    if len(missing_durations) > 0:
+        print('\t' + str(len(missing_durations)) + ' videos are not in the media index and were played for ' + str(Simulation.DEFAULT_DURATION) + ' s. Run scripts/media_preflight.py first.')
+
+    problems = 0
+    for simulation in simulations:
+        if len(simulations) > 1:
+            print('**Track ' + str(simulation.track) + '**')
+        problems += simulation.report()
+    report_messages(client, set(simulation.tv_channel for simulation in simulations))
+    print('**Problems: ' + str(problems) + '**')
+    return problems
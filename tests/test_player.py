@@ -0,0 +1,217 @@
+import asyncio, importlib, os, sys, threading, types, unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Stand-in for the python-vlc module, with just enough of libvlc for VLCPlayer to be created and played. Nothing happens on its
+# own: the tests fire the libvlc events, from another thread as libvlc does.
+class EventManager:
+    def __init__(self):
+        self.callbacks = {}
+
+    def event_attach(self, event_type, callback):
+        self.callbacks.setdefault(event_type, []).append(callback)
+
+    def fire(self, event_type, media = None):
+        event = types.SimpleNamespace(type = event_type, u = types.SimpleNamespace(media = media))
+        for callback in self.callbacks.get(event_type, []):
+            callback(event)
+
+
+class Media:
+    def __init__(self, path):
+        self.path = path
+        self.options = []
+
+    def parse_with_options(self, flags, timeout):
+        pass
+
+    def add_option(self, option):
+        self.options.append(option)
+
+
+class MediaList:
+    def __init__(self):
+        self.items = []
+
+    def add_media(self, media):
+        self.items.append(media)
+
+    def insert_media(self, media, index):
+        self.items.insert(index, media)
+
+    def count(self):
+        return len(self.items)
+
+    def index_of_item(self, media):
+        return self.items.index(media) if media in self.items else -1
+
+    def remove_index(self, index):
+        del self.items[index]
+
+    def lock(self):
+        pass
+
+    def unlock(self):
+        pass
+
+
+class MediaPlayer:
+    def __init__(self):
+        self.events = EventManager()
+        self.volume = 100
+        self.state_calls = 0
+
+    def event_manager(self):
+        return self.events
+
+    # VLCPlayer must detect the end of a playlist from the events, without polling the state.
+    def get_state(self):
+        self.state_calls += 1
+        return 0
+
+    def set_fullscreen(self, fullscreen):
+        pass
+
+    def audio_get_volume(self):
+        return self.volume
+
+    def audio_set_volume(self, volume):
+        self.volume = volume
+
+
+class MediaListPlayer:
+    def __init__(self):
+        self.events = EventManager()
+        self.media_list = None
+        self.played = []
+
+    def event_manager(self):
+        return self.events
+
+    def set_media_player(self, player):
+        self.player = player
+
+    def set_media_list(self, media_list):
+        self.media_list = media_list
+
+    def set_playback_mode(self, mode):
+        pass
+
+    def play_item_at_index(self, index):
+        self.played.append(index)
+
+    def stop(self):
+        pass
+
+
+class Instance:
+    def __init__(self, *args):
+        pass
+
+    def media_player_new(self):
+        return MediaPlayer()
+
+    def media_list_player_new(self):
+        return MediaListPlayer()
+
+    def media_list_new(self):
+        return MediaList()
+
+    def media_new(self, path):
+        return Media(path)
+
+
+def create_vlc_stub():
+    vlc = types.ModuleType('vlc')
+    vlc.EventType = types.SimpleNamespace(MediaPlayerPlaying = 'playing', MediaPlayerVout = 'vout', MediaPlayerEndReached = 'end_reached',
+        MediaPlayerEncounteredError = 'error', MediaPlayerStopped = 'stopped', MediaListPlayerNextItemSet = 'next_item', MediaListPlayerPlayed = 'played')
+    vlc.MediaParseFlag = types.SimpleNamespace(local = 0)
+    vlc.PlaybackMode = types.SimpleNamespace(default = 0, loop = 1)
+    vlc.Instance = Instance
+    vlc.Media = lambda item: item # Events carry the media itself rather than a pointer to it
+    return vlc
+
+
+class VLCPlayerTest(unittest.TestCase):
+    def setUp(self):
+        self.modules = mock.patch.dict(sys.modules, {'vlc': create_vlc_stub()})
+        self.modules.start()
+        sys.modules.pop('player', None)
+        self.player = importlib.import_module('player').VLCPlayer()
+        self.stub = self.player.player
+
+    def tearDown(self):
+        self.modules.stop()
+
+    # Plays the videos, fires the given events (name, video index) from another thread and returns the finish reason
+    def play(self, videos, events):
+        async def run():
+            self.player.play_playlist(videos)
+            waiting = asyncio.ensure_future(self.player.wait_finished())
+            await asyncio.sleep(0)
+            thread = threading.Thread(target = self.fire, args = (events,))
+            thread.start()
+            reason = await asyncio.wait_for(waiting, 5)
+            thread.join()
+            return reason
+
+        return asyncio.run(run())
+
+    def fire(self, events):
+        for name, index in events:
+            media = self.player.media_list.items[index] if index is not None else None
+            event_manager = self.player.list_player.events if name in ('next_item', 'played') else self.stub.events
+            event_manager.fire(name, media)
+
+    def test_end_of_playlist(self):
+        items = []
+        self.player.add_item_callback(lambda index, video: items.append((index, video)))
+        reason = self.play(['a.mp4', 'b.mp4'], [('next_item', 0), ('playing', None), ('vout', None), ('end_reached', None),
+            ('next_item', 1), ('playing', None), ('end_reached', None), ('played', None)])
+
+        self.assertEqual(reason, 'ended')
+        self.assertEqual(items, [(0, 'a.mp4'), (1, 'b.mp4')])
+        self.assertEqual(self.stub.state_calls, 0)
+
+    def test_error(self):
+        reason = self.play(['a.mp4'], [('next_item', 0), ('error', None)])
+
+        self.assertEqual(reason, 'error')
+        self.assertEqual(self.stub.state_calls, 0)
+
+    def test_items_after_finish_current(self):
+        items = []
+        self.player.add_item_callback(lambda index, video: items.append(index))
+        self.player.play_playlist(['a.mp4', 'b.mp4', 'c.mp4'], start_index = 1)
+        self.fire([('next_item', 1), ('playing', None)])
+        self.player.finish_current()
+        self.player.jump(0)
+        self.fire([('next_item', 0), ('next_item', 1)])
+
+        self.assertEqual(items, [1, 0, 1])
+        self.assertEqual(self.player.media_list.count(), 2)
+
+    def test_start_time_only_on_first_play(self):
+        self.player.play_playlist(['a.mp4', 'b.mp4'], start_index = 1, position = 90000)
+        self.assertEqual(self.player.media_list.items[1].options, ['start-time=90.0'])
+
+        self.assertTrue(self.player.jump(1))
+        self.assertEqual(self.player.media_list.items[1].options, [])
+        self.assertEqual(self.player.media_list.items[1].path, 'b.mp4')
+        self.assertEqual(self.player.list_player.played, [1, 1])
+
+    def test_stopped(self):
+        async def run():
+            self.player.play_playlist(['a.mp4'])
+            waiting = asyncio.ensure_future(self.player.wait_finished())
+            await asyncio.sleep(0)
+            self.player.stop()
+            return await asyncio.wait_for(waiting, 5)
+
+        self.assertEqual(asyncio.run(run()), 'stopped')
+        self.assertEqual(self.stub.state_calls, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
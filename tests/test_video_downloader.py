@@ -0,0 +1,106 @@
+import hashlib, os, sys, tempfile, threading, unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+import video_downloader
+
+CONTENT = bytes(range(256)) * 400
+
+
+# Local stand-in for the download server. Serves CONTENT for any path, with or without support for Range requests.
+class DownloadHandler(BaseHTTPRequestHandler):
+    ranges = True
+    requests = []
+
+    def do_GET(self):
+        header = self.headers.get('Range')
+        DownloadHandler.requests.append(header)
+        if header is None or not DownloadHandler.ranges:
+            self.send_content(200, CONTENT)
+            return
+
+        start = int(header[len('bytes='):].split('-')[0])
+        if start >= len(CONTENT):
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */' + str(len(CONTENT)))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_content(206, CONTENT[start:], {'Content-Range': 'bytes ' + str(start) + '-' + str(len(CONTENT) - 1) + '/' + str(len(CONTENT))})
+
+    def send_content(self, status, content, headers = {}):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), DownloadHandler)
+        cls.thread = threading.Thread(target = cls.server.serve_forever, daemon = True)
+        cls.thread.start()
+        cls.url = 'http://127.0.0.1:' + str(cls.server.server_address[1]) + '/download'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        DownloadHandler.ranges = True
+        DownloadHandler.requests = []
+        self.directory = tempfile.TemporaryDirectory()
+        self.destination = os.path.join(self.directory.name, 'cscw22a_1.mp4')
+        self.session = video_downloader.create_session(1)
+
+    def tearDown(self):
+        self.session.close()
+        self.directory.cleanup()
+
+    def write_part(self, content):
+        with open(self.destination + '.part', 'wb') as outfile:
+            outfile.write(content)
+
+    def download(self):
+        return video_downloader.download_file_from_google_drive(self.session, self.url, '1', self.destination, video_downloader.Progress(1))
+
+    def assert_complete(self, result):
+        self.assertEqual(result, (len(CONTENT), hashlib.sha256(CONTENT).hexdigest()))
+        with open(self.destination, 'rb') as infile:
+            self.assertEqual(infile.read(), CONTENT)
+        self.assertFalse(os.path.exists(self.destination + '.part'))
+
+    def test_resume(self):
+        self.write_part(CONTENT[:1000])
+        self.assert_complete(self.download())
+        self.assertEqual(DownloadHandler.requests, ['bytes=1000-'])
+
+    def test_no_range_support(self):
+        DownloadHandler.ranges = False
+        self.write_part(b'x' * 1000)
+        self.assert_complete(self.download())
+
+    def test_part_file_complete(self):
+        self.write_part(CONTENT)
+        self.assert_complete(self.download())
+        self.assertEqual(DownloadHandler.requests, ['bytes=' + str(len(CONTENT)) + '-'])
+
+    def test_part_file_too_long(self):
+        self.write_part(CONTENT + b'x')
+        with self.assertRaises(IOError):
+            self.download()
+        self.assertFalse(os.path.exists(self.destination + '.part'))
+
+        self.assert_complete(self.download())
+
+
+if __name__ == '__main__':
+    unittest.main()